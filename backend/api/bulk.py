@@ -0,0 +1,242 @@
+from datetime import datetime, timezone
+from typing import AsyncIterator, Callable
+from fastapi import HTTPException, Request
+from pydantic import BaseModel, ValidationError
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+import codecs
+import csv
+import json
+
+from . import crud, schemas
+
+BATCH_SIZE = 2000
+# a single JSON array item is buffered until complete; larger ones stop the import
+MAX_ITEM_CHARS = 65536
+
+# -------- PARSE --------
+async def _iter_text(request: Request) -> AsyncIterator[str]:
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    async for chunk in request.stream():
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+async def _iter_lines(request: Request) -> AsyncIterator[str]:
+    pending = ""
+    async for text in _iter_text(request):
+        pending += text
+        lines = pending.split("\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line
+    if pending:
+        yield pending
+
+SCAN_START = (0, 0, False, False)
+
+def _item_end(buffer: str,
+              pos: int,
+              scan: tuple[int, int, bool, bool]) -> tuple[int, tuple[int, int, bool, bool]]:
+    # Where the array item starting at pos ends: just past its closing bracket,
+    # or at the delimiter after a scalar. -1 while the item is incomplete, with
+    # the state to resume from (offset into the item, depth, string, escape),
+    # so each chunk only scans the text it added.
+    offset, depth, in_string, escaped = scan
+    for index in range(pos + offset, len(buffer)):
+        char = buffer[index]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            depth += 1
+        elif char in "}]":
+            if depth == 0:
+                return index, SCAN_START
+            depth -= 1
+            if depth == 0:
+                return index + 1, SCAN_START
+        elif char == "," and depth == 0:
+            return index, SCAN_START
+    return -1, (len(buffer) - pos, depth, in_string, escaped)
+
+async def iter_json_array(request: Request) -> AsyncIterator:
+    decoder = json.JSONDecoder()
+    buffer = ""
+    opened = closed = False
+    scan = None
+    async for text in _iter_text(request):
+        buffer += text
+        pos = 0
+        while not closed:
+            if scan is None:
+                while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                    pos += 1
+                if pos == len(buffer):
+                    break
+                if not opened:
+                    if buffer[pos] != "[":
+                        raise ValueError("Body must be a JSON array")
+                    opened = True
+                    pos += 1
+                    continue
+                if buffer[pos] == "]":
+                    closed = True
+                    break
+                try:
+                    item, pos = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    # incomplete or malformed: find the item's end before
+                    # decoding it again
+                    scan = SCAN_START
+                else:
+                    yield item
+                    continue
+            end, scan = _item_end(buffer,
+                                  pos,
+                                  scan)
+            if end == -1:
+                if len(buffer) - pos > MAX_ITEM_CHARS:
+                    raise ValueError(f"Array item longer than {MAX_ITEM_CHARS} characters")
+                # wait for the next chunk
+                break
+            raw, pos, scan = buffer[pos:end], end, None
+            try:
+                item = json.loads(raw)
+            except json.JSONDecodeError:
+                # malformed: pass the raw text on so it fails validation as
+                # its own row, and carry on with the next item
+                item = raw
+            yield item
+        buffer = buffer[pos:]
+    if not closed:
+        raise ValueError("Malformed or truncated JSON array")
+
+async def iter_ndjson(request: Request) -> AsyncIterator[str]:
+    # lines are validated with model_validate_json, so a bad line only fails its row
+    async for line in _iter_lines(request):
+        if line.strip():
+            yield line
+
+async def iter_csv(request: Request) -> AsyncIterator[dict]:
+    header = None
+    record = ""
+    async for line in _iter_lines(request):
+        record += line + "\n"
+        # a quoted field may span lines; wait until the quotes are balanced
+        if record.count('"') % 2:
+            continue
+        values = next(csv.reader([record]), [])
+        record = ""
+        if not values:
+            continue
+        if header is None:
+            header = [value.strip() for value in values]
+            continue
+        yield dict(zip(header, values))
+
+def iter_records(request: Request) -> AsyncIterator:
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type == "application/json":
+        return iter_json_array(request)
+    if content_type in ("application/x-ndjson", "application/jsonl"):
+        return iter_ndjson(request)
+    if content_type == "text/csv":
+        return iter_csv(request)
+    raise HTTPException(status_code=415,
+                        detail="Send application/json, application/x-ndjson or text/csv")
+
+# -------- INSERT --------
+def insert_books(db: Session,
+                 batch: list[tuple[int, schemas.BookCreate]]) -> list[dict]:
+    rows = [{"title": payload.title,
+             "author": payload.author,
+             "total_copies": payload.total_copies,
+             "available_copies": payload.total_copies} for _, payload in batch]
+    crud.begin_write(db)
+    ids = crud.bulk_create_books(db,
+                                 rows)
+    db.commit()
+    return [{"row": row, "status": "created", "id": book_id, "error": None}
+            for (row, _), book_id in zip(batch, ids)]
+
+def insert_users(db: Session,
+                 batch: list[tuple[int, schemas.UserCreate]]) -> list[dict]:
+    crud.begin_write(db)
+    ids = crud.bulk_create_users(db,
+                                 [{"name": payload.name,
+                                   "email": payload.email} for _, payload in batch],
+                                 created_at=datetime.now(timezone.utc))
+    db.commit()
+    return [{"row": row, "status": "created", "id": user_id, "error": None} if user_id is not None
+            else {"row": row, "status": "duplicate", "id": None, "error": "Email already exists"}
+            for (row, _), user_id in zip(batch, ids)]
+
+# -------- IMPORT --------
+def _error_message(exc: ValidationError) -> str:
+    error = exc.errors()[0]
+    field = ".".join(str(part) for part in error["loc"])
+    return f"{field}: {error['msg']}" if field else error["msg"]
+
+def process_batch(db: Session,
+                  schema: type[BaseModel],
+                  insert_batch: Callable[[Session, list[tuple[int, BaseModel]]], list[dict]],
+                  records: list[tuple[int, object]]) -> list[dict]:
+    # runs on the threadpool: validation is as CPU-bound as the insert
+    results: list[dict] = []
+    batch: list[tuple[int, BaseModel]] = []
+    for row, record in records:
+        try:
+            if isinstance(record, str):
+                batch.append((row, schema.model_validate_json(record)))
+            else:
+                batch.append((row, schema.model_validate(record)))
+        except ValidationError as exc:
+            results.append({"row": row,
+                            "status": "invalid",
+                            "id": None,
+                            "error": _error_message(exc)})
+    if batch:
+        results.extend(insert_batch(db,
+                                    batch))
+    return results
+
+async def import_records(request: Request,
+                         db: Session,
+                         schema: type[BaseModel],
+                         insert_batch: Callable[[Session, list[tuple[int, BaseModel]]], list[dict]]) -> dict:
+    results: list[dict] = []
+    records: list[tuple[int, object]] = []
+    row = 0
+    try:
+        async for record in iter_records(request):
+            row += 1
+            records.append((row, record))
+            if len(records) >= BATCH_SIZE:
+                results.extend(await run_in_threadpool(process_batch, db, schema, insert_batch, records))
+                records = []
+    except ValueError as exc:
+        results.append({"row": row + 1,
+                        "status": "invalid",
+                        "id": None,
+                        "error": f"Stopped reading body: {exc}"})
+    if records:
+        results.extend(await run_in_threadpool(process_batch, db, schema, insert_batch, records))
+
+    results.sort(key=lambda result: result["row"])
+    counts = {"created": 0, "duplicate": 0, "invalid": 0}
+    for result in results:
+        counts[result["status"]] += 1
+    return {"created": counts["created"],
+            "duplicates": counts["duplicate"],
+            "invalid": counts["invalid"],
+            "results": results}
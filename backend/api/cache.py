@@ -0,0 +1,192 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from sqlalchemy.orm import Session
+import json
+import threading
+import time
+
+from . import models
+from .config import settings
+
+# -------- BACKENDS --------
+class CacheBackend(ABC):
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @abstractmethod
+    def get(self, key: str) -> dict | None: ...
+
+    @abstractmethod
+    def set(self, key: str, value: dict) -> None: ...
+
+    @abstractmethod
+    def delete(self, *keys: str) -> None: ...
+
+    def stats(self) -> dict:
+        return {"backend": type(self).__name__,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions}
+
+class NullCache(CacheBackend):
+    def get(self, key: str) -> dict | None:
+        self.misses += 1
+        return None
+
+    def set(self, key: str, value: dict) -> None:
+        pass
+
+    def delete(self, *keys: str) -> None:
+        pass
+
+class MemoryCache(CacheBackend):
+    # Per-process LRU with a TTL on every entry.
+    def __init__(self, max_entries: int, ttl: float):
+        super().__init__()
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> dict | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: str, value: dict) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, *keys: str) -> None:
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def stats(self) -> dict:
+        return {**super().stats(),
+                "entries": len(self._entries)}
+
+class SharedStoreCache(CacheBackend):
+    # Talks to a key/value store the way a Redis client would: string values
+    # with a server-side expiry. LocalStore stands in for the server, so a
+    # multi-worker deployment only needs a client with get/set(ex=)/delete.
+    def __init__(self, store, ttl: float):
+        super().__init__()
+        self.store = store
+        self.ttl = ttl
+
+    def get(self, key: str) -> dict | None:
+        raw = self.store.get(key)
+        if raw is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(raw)
+
+    def set(self, key: str, value: dict) -> None:
+        self.store.set(key,
+                       json.dumps(value, default=str),
+                       ex=self.ttl)
+
+    def delete(self, *keys: str) -> None:
+        self.store.delete(*keys)
+
+    def stats(self) -> dict:
+        return {**super().stats(),
+                "evictions": self.store.evictions}
+
+class LocalStore:
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.evictions = 0
+        self._data: dict[str, tuple[float, str]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._data[key]
+                return None
+            return entry[1]
+
+    def set(self, key: str, value: str, ex: float) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (time.monotonic() + ex, value)
+            if len(self._data) > self.max_entries:
+                # dicts keep insertion order, so this drops the oldest write
+                del self._data[next(iter(self._data))]
+                self.evictions += 1
+
+    def delete(self, *keys: str) -> None:
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+def build_cache() -> CacheBackend:
+    if settings.cache_backend == "memory":
+        return MemoryCache(settings.cache_max_entries,
+                           settings.cache_ttl_seconds)
+    if settings.cache_backend == "shared":
+        return SharedStoreCache(LocalStore(settings.cache_max_entries),
+                                settings.cache_ttl_seconds)
+    return NullCache()
+
+entity_cache = build_cache()
+
+# -------- READ THROUGH --------
+def _snapshot(obj) -> dict:
+    return {column.key: getattr(obj, column.key) for column in obj.__table__.columns}
+
+def _read_through(db: Session,
+                  model,
+                  key: str,
+                  entity_id: int) -> dict | None:
+    data = entity_cache.get(key)
+    if data is not None:
+        return data
+    obj = db.get(model,
+                 entity_id)
+    if obj is None:
+        return None
+    data = _snapshot(obj)
+    entity_cache.set(key,
+                     data)
+    return data
+
+def cached_book(db: Session,
+                book_id: int) -> dict | None:
+    return _read_through(db,
+                         models.Book,
+                         f"book:{book_id}",
+                         book_id)
+
+def cached_user(db: Session,
+                user_id: int) -> dict | None:
+    return _read_through(db,
+                         models.User,
+                         f"user:{user_id}",
+                         user_id)
+
+# -------- INVALIDATE --------
+def invalidate_book(book_id: int) -> None:
+    entity_cache.delete(f"book:{book_id}")
+
+def invalidate_user(user_id: int) -> None:
+    entity_cache.delete(f"user:{user_id}")
@@ -0,0 +1,55 @@
+from typing import Literal
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+class Settings(BaseSettings):
+    model_config = SettingsConfigDict(env_prefix="LIBRARY_",
+                                      env_file=".env",
+                                      extra="ignore")
+
+    # -------- DATABASE --------
+    # unset: the SQLite file in data/library.db
+    database_url: str | None = None
+    async_db: bool = False
+    sqlite_profile: Literal["default", "production"] = "production"
+    db_pool_size: int = 10
+    db_max_overflow: int = 20
+    db_pool_timeout: float = 30
+    db_pool_pre_ping: bool = False
+    db_pool_recycle: int = -1
+    # unset: a read-only connection pool on the same SQLite (WAL) file, or the
+    # primary itself for other databases
+    read_database_url: str | None = None
+    # apply pending migrations when the app starts; off: refuse to start until
+    # python -m api.migrations upgrade has run
+    migrate_on_startup: bool = True
+
+    # -------- CACHE --------
+    cache_backend: Literal["memory", "shared", "none"] = "memory"
+    cache_max_entries: int = 10000
+    cache_ttl_seconds: float = 30
+
+    # -------- HTTP --------
+    cache_control: str = "private, no-cache"
+
+    # -------- IDEMPOTENCY --------
+    idempotency_ttl_hours: float = 24
+
+    # -------- EVENTS --------
+    # GET /books/availability/stream: per-stream queue bound (a stream that
+    # falls further behind is resynced), keep-alive interval, books per stream
+    events_queue_size: int = 64
+    events_heartbeat_seconds: float = 15
+    events_max_books: int = 1000
+
+    # -------- METRICS --------
+    metrics: bool = True
+    slow_query_ms: float = 200
+
+    # -------- LOGGING --------
+    log_format: Literal["text", "json"] = "text"
+    log_level: str = "INFO"
+    log_levels: dict[str, str] = {}
+    log_sample_rates: dict[str, float] = {}
+    log_queue: bool = True
+
+settings = Settings()
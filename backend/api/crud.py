@@ -1,6 +1,97 @@
-from sqlalchemy import select, func
-from sqlalchemy.orm import Session
-from . import models
+from datetime import date, datetime, timedelta, timezone
+from sqlalchemy import Row, select, func, case, tuple_, update, insert, delete, text, literal_column, union_all, Integer, Float
+from sqlalchemy.engine import Connection
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session, joinedload
+from operator import itemgetter
+from typing import Iterator
+from . import models, cache, events
+from .search import TITLE_WEIGHT, AUTHOR_WEIGHT, INDEX_BOOKS_FROM, PAUSE_ROW_INDEXING, RESUME_ROW_INDEXING, search_document
+
+# -------- ROWS --------
+# Column rows for list endpoints: the response schema's fields in order, then
+# version for the ETag. utils.schema_rows zips them straight into dicts.
+USER_COLUMNS = (models.User.id,
+                models.User.name,
+                models.User.email,
+                models.User.created_at,
+                models.User.version)
+
+BOOK_COLUMNS = (models.Book.id,
+                models.Book.title,
+                models.Book.author,
+                models.Book.total_copies,
+                models.Book.available_copies,
+                models.Book.version)
+
+# -------- BULK --------
+def _bulk_insert(db: Session,
+                 model,
+                 rows: list[dict],
+                 shared: dict | None = None,
+                 unique: str | None = None) -> list[int | None]:
+    # Inserts rows (all with the same keys, plus the shared values) and returns
+    # the new ids in row order. With unique, a row whose value in that column
+    # is already taken, in the table or earlier in the batch, is skipped and
+    # gets None.
+    if not rows:
+        return []
+    table = model.__table__
+    shared = shared or {}
+    dialect = db.get_bind().dialect
+    if dialect.name != "sqlite":
+        # PostgreSQL batches RETURNING itself, and ON CONFLICT waits for a
+        # concurrent insert of the same value before skipping it
+        rows = [{**row, **shared} for row in rows]
+        if unique is None:
+            return list(db.scalars(insert(table).returning(table.c.id,
+                                                           sort_by_parameter_order=True),
+                                   rows).all())
+        stmt = _upsert_insert(db,
+                              model).on_conflict_do_nothing(index_elements=[unique])
+        inserted = dict(db.execute(stmt.returning(table.c[unique],
+                                                  table.c.id),
+                                   rows).all())
+        return [inserted.pop(row[unique], None) for row in rows]
+
+    # SQLite: executemany straight on the driver. SQLAlchemy's per-row
+    # parameter processing costs four times the insert itself; the shared
+    # values and column defaults are converted once here instead, and the row
+    # values only when their column type needs it.
+    names = list(rows[0])
+    fixed = {column.name: column.default.arg for column in table.columns
+             if column.default is not None and column.default.is_scalar and column.name not in rows[0]}
+    fixed.update(shared)
+    processors = {name: process for name in [*names, *fixed]
+                  if (process := table.c[name].type.dialect_impl(dialect).bind_processor(dialect))}
+    fixed_values = tuple(processors[name](value) if name in processors else value
+                         for name, value in fixed.items())
+    if any(name in processors for name in names):
+        rows = [{name: processors[name](value) if name in processors else value
+                 for name, value in row.items()} for row in rows]
+    row_values = itemgetter(*names) if len(names) > 1 else lambda row: (row[names[0]],)
+    params = [row_values(row) + fixed_values for row in rows]
+
+    quote = dialect.identifier_preparer.quote
+    sql = (f"INSERT INTO {quote(table.name)} ({', '.join(quote(name) for name in [*names, *fixed])}) "
+           f"VALUES ({', '.join('?' * (len(names) + len(fixed)))})")
+    if unique is not None:
+        sql += f" ON CONFLICT ({quote(unique)}) DO NOTHING"
+
+    # The caller holds the write lock (begin_write), so the rows just inserted
+    # are exactly those above the previous max id, and when none was skipped
+    # SQLite numbered them max + 1, max + 2, ... in row order. RETURNING with
+    # parameter order would fall back to one INSERT per row on SQLite.
+    last_id = db.scalar(select(func.max(table.c.id))) or 0
+    count = db.connection().exec_driver_sql(sql,
+                                            params).rowcount
+    if count == len(rows):
+        return list(range(last_id + 1, last_id + 1 + count))
+    stmt = select(table.c[unique],
+                  table.c.id).where(table.c.id > last_id)
+    inserted = dict(db.execute(stmt).all())
+    return [inserted.pop(row[unique], None) for row in rows]
 
 # -------- USERS --------
 def create_user(db: Session,
@@ -13,20 +104,41 @@ def create_user(db: Session,
     db.refresh(user)
     return user
 
+def bulk_create_users(db: Session,
+                      rows: list[dict],
+                      created_at: datetime) -> list[int | None]:
+    # None for a row whose email is already taken, or came earlier in rows
+    return _bulk_insert(db,
+                        models.User,
+                        rows,
+                        shared={"created_at": created_at},
+                        unique="email")
+
 def get_user(db: Session,
              user_id: int) -> models.User | None:
     return db.get(models.User,
                   user_id)
 
+def get_users_by_ids(db: Session,
+                     user_ids: list[int]) -> list[Row]:
+    stmt = select(*USER_COLUMNS).where(models.User.id.in_(user_ids))
+    return list(db.execute(stmt).all())
+
 def get_user_by_email(db: Session,
                       email: str) -> models.User | None:
     stmt = select(models.User).where(models.User.email == email)
     return db.scalar(stmt)
 
 def list_users(db: Session,
-               skip: int, limit: int) -> list[models.User]:
-    stmt = select(models.User).offset(skip).limit(limit)
-    return list(db.scalars(stmt).all())
+               skip: int,
+               limit: int,
+               after_id: int | None = None) -> list[Row]:
+    stmt = select(*USER_COLUMNS).order_by(models.User.id).limit(limit)
+    if after_id is not None:
+        stmt = stmt.where(models.User.id > after_id)
+    else:
+        stmt = stmt.offset(skip)
+    return list(db.execute(stmt).all())
 
 def update_user(db: Session,
                 user: models.User,
@@ -37,13 +149,15 @@ def update_user(db: Session,
     if email is not None:
         user.email = email
     db.commit()
+    cache.invalidate_user(user.id)
     db.refresh(user)
     return user
 
 def list_user_loans(db: Session,
                     user_id: int,
-                    active_only: bool | None) -> list[models.Loan]:
-    stmt = select(models.Loan).where(models.Loan.user_id == user_id)
+                    active_only: bool | None,
+                    expand: tuple[str, ...] = ()) -> list[models.Loan]:
+    stmt = select(models.Loan).where(models.Loan.user_id == user_id).options(*loan_options(expand))
     if active_only is True:
         stmt = stmt.where(models.Loan.return_date.is_(None))
     if active_only is False:
@@ -67,65 +181,580 @@ def create_book(db: Session,
     db.refresh(book)
     return book
 
+def bulk_create_books(db: Session,
+                      rows: list[dict]) -> list[int]:
+    if db.get_bind().dialect.name != "sqlite":
+        return _bulk_insert(db,
+                            models.Book,
+                            rows)
+    # the FTS row trigger is paused for this transaction; the batch is indexed
+    # with one INSERT ... SELECT instead
+    db.execute(text(PAUSE_ROW_INDEXING))
+    ids = _bulk_insert(db,
+                       models.Book,
+                       rows)
+    if ids:
+        db.execute(text(INDEX_BOOKS_FROM),
+                   {"first_id": ids[0]})
+    db.execute(text(RESUME_ROW_INDEXING))
+    return ids
+
 def get_book(db: Session,
              book_id: int) -> models.Book | None:
     return db.get(models.Book,
                   book_id)
 
+def get_books_by_ids(db: Session,
+                     book_ids: list[int]) -> list[Row]:
+    stmt = select(*BOOK_COLUMNS).where(models.Book.id.in_(book_ids))
+    return list(db.execute(stmt).all())
+
+def get_availability(db: Session,
+                     book_ids: list[int]) -> list[Row]:
+    stmt = select(models.Book.id.label("book_id"),
+                  models.Book.available_copies,
+                  models.Book.total_copies,
+                  models.Book.version).where(models.Book.id.in_(book_ids))
+    return list(db.execute(stmt).all())
+
 def list_books(db: Session,
                skip: int,
-               limit: int) -> list[models.Book]:
-    stmt = select(models.Book).offset(skip).limit(limit)
-    return list(db.scalars(stmt).all())
+               limit: int,
+               after_id: int | None = None) -> list[Row]:
+    stmt = select(*BOOK_COLUMNS).order_by(models.Book.id).limit(limit)
+    if after_id is not None:
+        stmt = stmt.where(models.Book.id > after_id)
+    else:
+        stmt = stmt.offset(skip)
+    return list(db.execute(stmt).all())
+
+def search_books(db: Session,
+                 match: str,
+                 limit: int,
+                 after: tuple[float, int] | None = None) -> list[tuple[models.Book, float]]:
+    if db.get_bind().dialect.name == "postgresql":
+        return _search_books_postgres(db,
+                                      match,
+                                      limit,
+                                      after)
+    ranked = text(
+        "SELECT rowid AS id, bm25(books_fts, :title_weight, :author_weight) AS rank "
+        "FROM books_fts WHERE books_fts MATCH :match"
+    ).bindparams(match=match,
+                 title_weight=TITLE_WEIGHT,
+                 author_weight=AUTHOR_WEIGHT).columns(id=Integer, rank=Float).subquery("ranked")
+    stmt = (
+        select(models.Book, ranked.c.rank)
+        .join(ranked, ranked.c.id == models.Book.id)
+        .order_by(ranked.c.rank, models.Book.id)
+        .limit(limit)
+    )
+    if after is not None:
+        stmt = stmt.where(tuple_(ranked.c.rank, models.Book.id) > after)
+    return [(book, rank) for book, rank in db.execute(stmt).all()]
+
+def _search_books_postgres(db: Session,
+                           match: str,
+                           limit: int,
+                           after: tuple[float, int] | None) -> list[tuple[models.Book, float]]:
+    # match is a to_tsquery expression (search.build_match_query); ts_rank grows
+    # with relevance, so negate it to keep bm25's "lower is better" cursor order
+    query = func.to_tsquery(literal_column("'simple'"), match)
+    document = search_document(models.Book.title,
+                               models.Book.author)
+    rank = (-func.ts_rank(document, query)).label("rank")
+    stmt = (
+        select(models.Book, rank)
+        .where(document.op("@@")(query))
+        .order_by(rank, models.Book.id)
+        .limit(limit)
+    )
+    if after is not None:
+        stmt = stmt.where(tuple_(rank, models.Book.id) > after)
+    return [(book, rank) for book, rank in db.execute(stmt).all()]
 
 def update_book(db: Session,
                 book: models.Book,
                 title: str | None,
                 author: str | None,
-                total_copies: int | None) -> models.Book:
+                total_copies: int | None) -> int:
+    # Returns the number of copies added. They are not put on the shelf here:
+    # the caller passes each one on to the hold queue (services.pass_copy_on).
+    # The caller commits.
     if title is not None:
         book.title = title
     if author is not None:
         book.author = author
 
+    added = 0
     if total_copies is not None:
         used = book.total_copies - book.available_copies
+        added = max(total_copies - book.total_copies, 0)
         book.total_copies = total_copies
-        book.available_copies = max(total_copies - used, 0)
-
-    db.commit()
-    db.refresh(book)
-    return book
+        book.available_copies = max(total_copies - added - used, 0)
+    db.flush()
+    if total_copies is not None:
+        events.record_availability(db,
+                                   book.id,
+                                   book.available_copies,
+                                   book.total_copies,
+                                   book.version)
+    return added
 
 
 # -------- LOANS --------
-def count_active_loans_for_user(db: Session, 
-                                user_id: int) -> int:
-    stmt = select(func.count()).select_from(models.Loan).where(
-        models.Loan.user_id == user_id,
-        models.Loan.return_date.is_(None),
+def begin_write(db: Session) -> None:
+    # BEGIN IMMEDIATE takes SQLite's write lock up front, so the guarded
+    # statements below run serialized instead of failing at commit time.
+    # Other backends ignore the option: the conditional UPDATEs lock (and
+    # re-check) the rows they touch.
+    transaction = db.get_transaction()
+    if transaction is not None and db.info.get("write_transaction") is transaction:
+        # already begun by the caller (idempotency.execute claims its key first)
+        return
+    db.connection(execution_options={"sqlite_begin": "IMMEDIATE"})
+    db.info["write_transaction"] = db.get_transaction()
+
+def claim_loan_slot(db: Session,
+                    user_id: int,
+                    max_active_loans: int) -> bool:
+    stmt = (
+        update(models.User)
+        .where(models.User.id == user_id,
+               models.User.active_loans < max_active_loans)
+        .values(active_loans=models.User.active_loans + 1,
+                total_loans=models.User.total_loans + 1)
+    )
+    return db.execute(stmt).rowcount == 1
+
+def release_loan_slot(db: Session,
+                      user_id: int,
+                      fine_amount: int) -> bool:
+    # never below zero: a drifted counter would otherwise let the user past
+    # MAX_ACTIVE_LOANS in claim_loan_slot. False when there was no slot to
+    # release; the fine is recorded either way.
+    stmt = (
+        update(models.User)
+        .where(models.User.id == user_id,
+               models.User.active_loans > 0)
+        .values(active_loans=models.User.active_loans - 1,
+                outstanding_fines=models.User.outstanding_fines + fine_amount)
+    )
+    if db.execute(stmt).rowcount == 1:
+        return True
+    db.execute(update(models.User)
+               .where(models.User.id == user_id)
+               .values(outstanding_fines=models.User.outstanding_fines + fine_amount))
+    return False
+
+def _change_copies(db: Session,
+                   stmt) -> bool:
+    # RETURNING hands the new counts to the availability stream, published
+    # when the transaction commits
+    row = db.execute(stmt.returning(models.Book.id,
+                                    models.Book.available_copies,
+                                    models.Book.total_copies,
+                                    models.Book.version)).first()
+    if row is None:
+        return False
+    events.record_availability(db,
+                               row.id,
+                               row.available_copies,
+                               row.total_copies,
+                               row.version)
+    return True
+
+def reserve_copy(db: Session,
+                 book_id: int) -> bool:
+    stmt = (
+        update(models.Book)
+        .where(models.Book.id == book_id,
+               models.Book.available_copies > 0)
+        .values(available_copies=models.Book.available_copies - 1)
     )
-    return int(db.scalar(stmt) or 0)
+    return _change_copies(db,
+                          stmt)
+
+def release_copy(db: Session,
+                 book_id: int) -> bool:
+    stmt = (
+        update(models.Book)
+        .where(models.Book.id == book_id,
+               models.Book.available_copies < models.Book.total_copies)
+        .values(available_copies=models.Book.available_copies + 1)
+    )
+    return _change_copies(db,
+                          stmt)
 
 def create_loan(db: Session,
                 user_id: int,
                 book_id: int,
-                due_date) -> models.Loan:
-    loan = models.Loan(user_id=user_id,
-                       book_id=book_id,
-                       due_date=due_date)
-    db.add(loan)
-    db.commit()
-    db.refresh(loan)
-    return loan
+                loan_date: datetime,
+                due_date: datetime) -> models.Loan:
+    stmt = (
+        insert(models.Loan)
+        .values(user_id=user_id,
+                book_id=book_id,
+                loan_date=loan_date,
+                due_date=due_date)
+        .returning(models.Loan)
+    )
+    return db.scalar(stmt)
+
+def mark_loan_returned(db: Session,
+                       loan_id: int,
+                       return_date: datetime,
+                       fine_amount: int) -> bool:
+    stmt = (
+        update(models.Loan)
+        .where(models.Loan.id == loan_id,
+               models.Loan.return_date.is_(None))
+        .values(return_date=return_date,
+                fine_amount=fine_amount)
+    )
+    return db.execute(stmt).rowcount == 1
 
 def get_loan(db: Session,
-             loan_id: int) -> models.Loan | None:
+             loan_id: int,
+             for_update: bool = False) -> models.Loan | None:
+    # FOR UPDATE is dropped on SQLite, where begin_write already serializes writers
     return db.get(models.Loan,
-                  loan_id)
+                  loan_id,
+                  with_for_update=for_update)
+
+def filter_loans_by_status(stmt,
+                           status: str):
+    if status == "active":
+        return stmt.where(models.Loan.return_date.is_(None))
+    if status == "overdue":
+        return stmt.where(models.Loan.return_date.is_(None),
+                          models.Loan.due_date < datetime.now(timezone.utc))
+    if status == "returned":
+        return stmt.where(models.Loan.return_date.is_not(None))
+    return stmt
+
+def loan_options(expand: tuple[str, ...]) -> list:
+    # book and user are many-to-one, so joining them in keeps one row per loan
+    # and the whole page (with relations) in a single query
+    return [joinedload(getattr(models.Loan, name)) for name in expand]
 
 def list_loans(db: Session,
                skip: int,
-               limit: int) -> list[models.Loan]:
-    stmt = select(models.Loan).offset(skip).limit(limit).order_by(models.Loan.loan_date.desc())
+               limit: int,
+               after: tuple[datetime, int] | None = None,
+               status: str = "all",
+               expand: tuple[str, ...] = ()) -> list[models.Loan]:
+    stmt = select(models.Loan).order_by(models.Loan.loan_date.desc(),
+                                        models.Loan.id.desc()).limit(limit).options(*loan_options(expand))
+    stmt = filter_loans_by_status(stmt,
+                                  status)
+    if after is not None:
+        stmt = stmt.where(tuple_(models.Loan.loan_date, models.Loan.id) < after)
+    else:
+        stmt = stmt.offset(skip)
     return list(db.scalars(stmt).all())
+
+def iter_loan_rows(db: Session,
+                   status: str = "all",
+                   user_id: int | None = None,
+                   date_from: datetime | None = None,
+                   date_to: datetime | None = None,
+                   batch_size: int = 1000) -> Iterator[list]:
+    stmt = select(models.Loan.id,
+                  models.Loan.user_id,
+                  models.Loan.book_id,
+                  models.Loan.loan_date,
+                  models.Loan.due_date,
+                  models.Loan.return_date,
+                  models.Loan.fine_amount).order_by(models.Loan.id)
+    stmt = filter_loans_by_status(stmt,
+                                  status)
+    if user_id is not None:
+        stmt = stmt.where(models.Loan.user_id == user_id)
+    if date_from is not None:
+        stmt = stmt.where(models.Loan.loan_date >= date_from)
+    if date_to is not None:
+        stmt = stmt.where(models.Loan.loan_date < date_to)
+    result = db.execute(stmt,
+                        execution_options={"yield_per": batch_size})
+    for partition in result.partitions():
+        yield partition
+
+# -------- HOLDS --------
+def get_book_for_update(db: Session,
+                        book_id: int) -> models.Book | None:
+    return db.get(models.Book,
+                  book_id,
+                  with_for_update=True)
+
+def count_open_holds(db: Session,
+                     user_id: int) -> int:
+    stmt = select(func.count()).where(models.Hold.user_id == user_id,
+                                      models.HOLD_OPEN)
+    return db.scalar(stmt)
+
+def create_hold(db: Session,
+                user_id: int,
+                book_id: int,
+                created_at: datetime) -> models.Hold:
+    stmt = (
+        insert(models.Hold)
+        .values(user_id=user_id,
+                book_id=book_id,
+                status="waiting",
+                created_at=created_at)
+        .returning(models.Hold)
+    )
+    return db.scalar(stmt)
+
+def get_hold(db: Session,
+             hold_id: int,
+             for_update: bool = False) -> models.Hold | None:
+    return db.get(models.Hold,
+                  hold_id,
+                  with_for_update=for_update)
+
+def list_book_holds(db: Session,
+                    book_id: int) -> list[models.Hold]:
+    # ready holds first, then the waiting queue in serving order
+    stmt = (
+        select(models.Hold)
+        .where(models.Hold.book_id == book_id,
+               models.HOLD_OPEN)
+        .order_by(case((models.HOLD_READY, 0), else_=1),
+                  models.Hold.priority.desc(),
+                  models.Hold.id)
+    )
+    return list(db.scalars(stmt).all())
+
+def allocate_next_hold(db: Session,
+                       book_id: int,
+                       now: datetime,
+                       expires_at: datetime,
+                       max_active_loans: int) -> models.Hold | None:
+    # first entry of ix_holds_queue whose holder could borrow the copy; the
+    # others keep their place until they can. SKIP LOCKED lets concurrent
+    # returns of the same book on PostgreSQL take different holders
+    next_hold = (
+        select(models.Hold.id)
+        .join(models.User, models.User.id == models.Hold.user_id)
+        .where(models.Hold.book_id == book_id,
+               models.HOLD_WAITING,
+               models.User.active_loans < max_active_loans)
+        .order_by(models.Hold.priority.desc(),
+                  models.Hold.id)
+        .limit(1)
+        .with_for_update(of=models.Hold,
+                         skip_locked=True)
+    )
+    hold_id = db.scalar(next_hold)
+    if hold_id is None:
+        return None
+    stmt = (
+        update(models.Hold)
+        .where(models.Hold.id == hold_id,
+               models.HOLD_WAITING)
+        .values(status="ready",
+                ready_at=now,
+                expires_at=expires_at)
+        .returning(models.Hold)
+    )
+    return db.scalar(stmt)
+
+def fulfill_ready_hold(db: Session,
+                       user_id: int,
+                       book_id: int,
+                       now: datetime) -> bool:
+    stmt = (
+        update(models.Hold)
+        .where(models.Hold.user_id == user_id,
+               models.Hold.book_id == book_id,
+               models.HOLD_READY,
+               models.Hold.expires_at > now)
+        .values(status="fulfilled")
+    )
+    return db.execute(stmt).rowcount == 1
+
+def fulfill_waiting_hold(db: Session,
+                         user_id: int,
+                         book_id: int) -> None:
+    stmt = (
+        update(models.Hold)
+        .where(models.Hold.user_id == user_id,
+               models.Hold.book_id == book_id,
+               models.HOLD_WAITING)
+        .values(status="fulfilled")
+    )
+    db.execute(stmt)
+
+def close_hold(db: Session,
+               hold_id: int,
+               status: str) -> str | None:
+    # returns the status the hold had, or None if it was no longer open
+    previous = db.scalar(select(models.Hold.status).where(models.Hold.id == hold_id,
+                                                          models.HOLD_OPEN))
+    if previous is None:
+        return None
+    stmt = (
+        update(models.Hold)
+        .where(models.Hold.id == hold_id,
+               models.Hold.status == previous)
+        .values(status=status)
+    )
+    return previous if db.execute(stmt).rowcount == 1 else None
+
+def expire_ready_holds(db: Session,
+                       now: datetime) -> list[Row]:
+    stmt = (
+        update(models.Hold)
+        .where(models.HOLD_READY,
+               models.Hold.expires_at <= now)
+        .values(status="expired")
+        .returning(models.Hold.id,
+                   models.Hold.user_id,
+                   models.Hold.book_id)
+    )
+    return list(db.execute(stmt).all())
+
+# -------- STATS --------
+def _upsert_insert(db: Session,
+                   model):
+    if db.get_bind().dialect.name == "postgresql":
+        return postgresql_insert(model)
+    return sqlite_insert(model)
+
+def _increment(db: Session,
+               model,
+               keys: dict,
+               counts: dict) -> None:
+    # one upsert per rollup row: insert the counts, or add them to the row
+    # already there
+    stmt = _upsert_insert(db,
+                          model).values(**keys,
+                                        **counts)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(keys),
+        set_={name: getattr(model, name) + getattr(stmt.excluded, name) for name in counts}
+    )
+    db.execute(stmt)
+
+def record_loan_event(db: Session,
+                      book_id: int,
+                      day: date,
+                      loans: int = 0,
+                      returns: int = 0,
+                      late_returns: int = 0,
+                      fines: int = 0) -> None:
+    # Only the (day, book) row: a single per-day row would be one hot row that
+    # every loan write in the library waits on. Day totals are summed from
+    # these rows (see roll_up_daily_stats).
+    _increment(db,
+               models.DailyBookStats,
+               {"day": day, "book_id": book_id},
+               {"loans": loans,
+                "returns": returns,
+                "late_returns": late_returns,
+                "fines": fines})
+
+STATS_COUNTS = ("loans", "returns", "late_returns", "fines")
+ROLLUP_JOB = "roll_up_stats"
+# a day is rolled up once it has been over for a full day, so a loan write
+# that commits just after midnight still lands in the per-book rows first
+ROLLUP_LAG_DAYS = 2
+
+def rollup_through(now: datetime) -> date:
+    return now.date() - timedelta(days=ROLLUP_LAG_DAYS)
+
+def stats_rolled_through(db: Session | Connection) -> date | None:
+    mark = db.scalar(select(models.JobState.high_water_mark).where(models.JobState.name == ROLLUP_JOB))
+    return mark.date() if mark is not None else None
+
+def roll_up_daily_stats(db: Session | Connection,
+                        through: date,
+                        now: datetime) -> int:
+    # Writes daily_stats, the per-day totals of daily_book_stats, for the days
+    # after the last rollup up to `through`, and moves the mark. Only execute()
+    # is used, so the migration can run it on its connection.
+    last = stats_rolled_through(db)
+    if last is not None and last >= through:
+        return 0
+    book_stats = models.DailyBookStats
+    window = [book_stats.day <= through]
+    replaced = [models.DailyStats.day <= through]
+    if last is not None:
+        window.append(book_stats.day > last)
+        replaced.append(models.DailyStats.day > last)
+    db.execute(delete(models.DailyStats).where(*replaced))
+    days = db.execute(
+        insert(models.DailyStats).from_select(
+            ["day", *STATS_COUNTS],
+            select(book_stats.day,
+                   *(func.sum(getattr(book_stats, name)) for name in STATS_COUNTS))
+            .where(*window)
+            .group_by(book_stats.day)
+        )
+    ).rowcount
+    db.execute(delete(models.JobState).where(models.JobState.name == ROLLUP_JOB))
+    db.execute(insert(models.JobState).values(name=ROLLUP_JOB,
+                                              high_water_mark=datetime(through.year, through.month, through.day),
+                                              updated_at=now))
+    return days
+
+def get_daily_stats(db: Session,
+                    date_from: date,
+                    date_to: date) -> list[Row]:
+    # rolled-up days from daily_stats; the few days since the last rollup are
+    # summed from daily_book_stats
+    mark = stats_rolled_through(db)
+    book_stats = models.DailyBookStats
+    # one lower bound: SQLite would range-scan on date_from and filter the rest
+    recent_from = date_from if mark is None else max(date_from,
+                                                     mark + timedelta(days=1))
+    recent = (
+        select(book_stats.day,
+               *(func.sum(getattr(book_stats, name)).label(name) for name in STATS_COUNTS))
+        .where(book_stats.day >= recent_from,
+               book_stats.day <= date_to)
+        .group_by(book_stats.day)
+    )
+    if mark is None:
+        return list(db.execute(recent.order_by(book_stats.day)).all())
+    rolled = (
+        select(models.DailyStats.day,
+               *(getattr(models.DailyStats, name) for name in STATS_COUNTS))
+        .where(models.DailyStats.day >= date_from,
+               models.DailyStats.day <= min(date_to, mark))
+    )
+    stmt = union_all(rolled,
+                     recent).order_by("day")
+    return list(db.execute(stmt).all())
+
+def top_borrowed_books(db: Session,
+                       date_from: date,
+                       date_to: date,
+                       limit: int) -> list[Row]:
+    loans = func.sum(models.DailyBookStats.loans).label("loans")
+    stmt = (
+        select(models.Book.id.label("book_id"),
+               models.Book.title,
+               models.Book.author,
+               loans)
+        .join(models.Book, models.Book.id == models.DailyBookStats.book_id)
+        .where(models.DailyBookStats.day >= date_from,
+               models.DailyBookStats.day <= date_to,
+               models.DailyBookStats.loans > 0)
+        .group_by(models.Book.id)
+        .order_by(loans.desc(), models.Book.id)
+        .limit(limit)
+    )
+    return list(db.execute(stmt).all())
+
+def count_open_loans(db: Session,
+                     now: datetime) -> tuple[int, int]:
+    # two range counts on ix_loans_active_due_date (due_date WHERE return_date
+    # IS NULL), overdue and not yet due, so no loan rows are read
+    open_loans = select(func.count()).where(models.Loan.return_date.is_(None))
+    stmt = select(open_loans.where(models.Loan.due_date < now).scalar_subquery(),
+                  open_loans.where(models.Loan.due_date >= now).scalar_subquery())
+    overdue, upcoming = db.execute(stmt).one()
+    return overdue + upcoming, overdue
@@ -1,20 +1,179 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, make_url
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, DeclarativeBase
+from fastapi import Depends
 from pathlib import Path
+import functools
+import inspect
+
+from .config import settings
+from .metrics import instrument_engine
 
 BASE_DIR = Path(__file__).resolve().parent  
 DB_PATH = (BASE_DIR / ".." / ".." / "data" / "library.db").resolve()
-DATABASE_URL = f"sqlite:///{DB_PATH}"
+ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite",
+                 "sqlite+pysqlite": "sqlite+aiosqlite",
+                 "postgresql": "postgresql+asyncpg",
+                 "postgresql+psycopg2": "postgresql+asyncpg"}
+
+def async_url(url: str) -> str:
+    parsed = make_url(url)
+    return parsed.set(drivername=ASYNC_DRIVERS.get(parsed.drivername,
+                                                   parsed.drivername)).render_as_string(hide_password=False)
+
+def is_sqlite(url: str) -> bool:
+    return make_url(url).get_backend_name() == "sqlite"
+
+DATABASE_URL = settings.database_url or f"sqlite:///{DB_PATH}"
+ASYNC_DATABASE_URL = async_url(DATABASE_URL)
+if settings.read_database_url:
+    READ_DATABASE_URL = settings.read_database_url
+elif is_sqlite(DATABASE_URL) and make_url(DATABASE_URL).database:
+    READ_DATABASE_URL = f"sqlite:///file:{make_url(DATABASE_URL).database}?mode=ro&uri=true"
+else:
+    READ_DATABASE_URL = DATABASE_URL
+ASYNC_READ_DATABASE_URL = async_url(READ_DATABASE_URL)
+
+# -------- ENGINE --------
+SQLITE_PROFILES = {
+    "default": {},
+    "production": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -64000,
+        "mmap_size": 268435456,
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000,
+    },
+}
+
+def apply_sqlite_profile(engine: Engine,
+                         profile: str,
+                         read_only: bool = False) -> None:
+    pragmas = SQLITE_PROFILES[profile]
+    if read_only:
+        # the journal mode is a property of the file, set by the writers
+        pragmas = {name: value for name, value in pragmas.items() if name != "journal_mode"}
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+def use_sqlite_begin_modes(engine: Engine) -> None:
+    # Take over BEGIN from the driver so a session can ask for BEGIN IMMEDIATE
+    # through the "sqlite_begin" execution option (see crud.begin_write).
+    @event.listens_for(engine, "connect")
+    def disable_driver_begin(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, "begin")
+    def begin(conn):
+        mode = conn.get_execution_options().get("sqlite_begin", "DEFERRED")
+        conn.exec_driver_sql(f"BEGIN {mode}")
 
-engine = create_engine(
-    DATABASE_URL,
-    connect_args={"check_same_thread": False},  
-)
+def use_utc_sessions(engine: Engine) -> None:
+    # DateTime columns are naive UTC; make the server read them the same way
+    @event.listens_for(engine, "connect")
+    def set_time_zone(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("SET TIME ZONE 'UTC'")
+        cursor.close()
+        dbapi_connection.commit()
+
+def uses_queue_pool(url: str) -> bool:
+    # SQLAlchemy picks the pool per dialect: in-memory SQLite gets a
+    # SingletonThreadPool, which takes none of the sizing arguments
+    parsed = make_url(url)
+    return issubclass(parsed.get_dialect().get_pool_class(parsed),
+                      QueuePool)
+
+def pool_options(queue_pool: bool = True) -> dict:
+    options = {"pool_pre_ping": settings.db_pool_pre_ping,
+               "pool_recycle": settings.db_pool_recycle}
+    if queue_pool:
+        options.update(pool_size=settings.db_pool_size,
+                       max_overflow=settings.db_max_overflow,
+                       pool_timeout=settings.db_pool_timeout)
+    return options
+
+def configure_engine(engine: Engine,
+                     profile: str,
+                     read_only: bool) -> None:
+    # pragmas and BEGIN IMMEDIATE are SQLite's answer to a single writer;
+    # other databases lock rows in the conditional UPDATEs themselves
+    if engine.dialect.name == "sqlite":
+        apply_sqlite_profile(engine,
+                             profile,
+                             read_only)
+        use_sqlite_begin_modes(engine)
+    elif engine.dialect.name == "postgresql":
+        use_utc_sessions(engine)
+    instrument_engine(engine)
+
+def build_engine(url: str,
+                 profile: str = settings.sqlite_profile,
+                 read_only: bool = False) -> Engine:
+    engine = create_engine(
+        url,
+        connect_args={"check_same_thread": False} if is_sqlite(url) else {},
+        **pool_options(uses_queue_pool(url)),
+    )
+    configure_engine(engine,
+                     profile,
+                     read_only)
+    return engine
+
+engine = build_engine(DATABASE_URL)
 
 SessionLocal = sessionmaker(bind=engine,
                             autoflush=False,
                             autocommit=False)
 
+# read-only routes (lists, lookups, availability, export) get their own pool,
+# so they never queue behind borrow/return writers for a connection
+if READ_DATABASE_URL == DATABASE_URL and not uses_queue_pool(DATABASE_URL):
+    # an in-memory database exists only on the primary's connections
+    read_engine = engine
+else:
+    read_engine = build_engine(READ_DATABASE_URL,
+                               read_only=True)
+
+ReadSessionLocal = sessionmaker(bind=read_engine,
+                                autoflush=False,
+                                autocommit=False)
+
+# -------- ASYNC --------
+async_engine = None
+AsyncSessionLocal = None
+async_read_engine = None
+AsyncReadSessionLocal = None
+
+def build_async_engine(url: str,
+                       read_only: bool = False) -> AsyncEngine:
+    engine = create_async_engine(url,
+                                 poolclass=AsyncAdaptedQueuePool,
+                                 **pool_options())
+    configure_engine(engine.sync_engine,
+                     settings.sqlite_profile,
+                     read_only)
+    return engine
+
+if settings.async_db:
+    async_engine = build_async_engine(ASYNC_DATABASE_URL)
+    AsyncSessionLocal = async_sessionmaker(bind=async_engine,
+                                           autoflush=False,
+                                           expire_on_commit=False)
+    async_read_engine = build_async_engine(ASYNC_READ_DATABASE_URL,
+                                           read_only=True)
+    AsyncReadSessionLocal = async_sessionmaker(bind=async_read_engine,
+                                               autoflush=False,
+                                               expire_on_commit=False)
+
 class Base(DeclarativeBase):
     pass
 
@@ -24,3 +183,44 @@ def get_db():
         yield db
     finally:
         db.close()
+
+def get_read_db():
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+async def get_async_read_db():
+    async with AsyncReadSessionLocal() as db:
+        yield db
+
+ASYNC_DEPENDENCIES = {get_db: get_async_db,
+                      get_read_db: get_async_read_db}
+
+def run_on_event_loop(endpoint):
+    # With async_db enabled the handler body runs through AsyncSession.run_sync,
+    # so crud/services are shared and the event loop awaits the driver instead
+    # of parking the request on the threadpool.
+    if not settings.async_db:
+        return endpoint
+
+    signature = inspect.signature(endpoint)
+    parameters = [
+        param.replace(annotation=AsyncSession,
+                      default=Depends(ASYNC_DEPENDENCIES[param.default.dependency])) if param.name == "db" else param
+        for param in signature.parameters.values()
+    ]
+
+    @functools.wraps(endpoint)
+    async def wrapper(*args, db: AsyncSession, **kwargs):
+        return await db.run_sync(lambda session: endpoint(*args,
+                                                          db=session,
+                                                          **kwargs))
+
+    wrapper.__signature__ = signature.replace(parameters=parameters)
+    return wrapper
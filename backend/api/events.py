@@ -0,0 +1,130 @@
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+import asyncio
+import threading
+
+from .config import settings
+
+CHANGES_KEY = "availability_changes"
+
+# queue markers besides the change dicts
+RESYNC = None
+KEEP_ALIVE = "keep-alive"
+
+# -------- SUBSCRIBERS --------
+class Subscriber:
+    # One per open stream. Lives on the event loop that serves the stream;
+    # offer() is only ever called there.
+    def __init__(self, book_ids: frozenset[int], queue_size: int):
+        self.book_ids = book_ids
+        self.loop = asyncio.get_running_loop()
+        self.queue: asyncio.Queue = asyncio.Queue(queue_size)
+        self.lagging = False
+        self.resyncs = 0
+
+    def offer(self, change) -> None:
+        if self.lagging:
+            # a resync is queued; the state it reads covers this change
+            return
+        try:
+            self.queue.put_nowait(change)
+        except asyncio.QueueFull:
+            # the client is not keeping up: drop its backlog and have the
+            # stream send fresh state instead of every intermediate change
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC)
+            self.lagging = True
+            self.resyncs += 1
+
+    async def next(self):
+        change = await self.queue.get()
+        if change is RESYNC:
+            self.lagging = False
+        return change
+
+class AvailabilityBroker:
+    # Fan-out of committed available_copies changes to stream subscribers.
+    # publish() may run on any thread (threadpool sessions, run_sync on the
+    # loop); delivery is handed to the subscribers' loop with one
+    # call_soon_threadsafe per change, not one per subscriber.
+    def __init__(self, queue_size: int):
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._by_book: dict[int, set[Subscriber]] = {}
+        self.published = 0
+        self.resyncs = 0
+
+    def subscribe(self, book_ids: frozenset[int]) -> Subscriber:
+        subscriber = Subscriber(book_ids,
+                                self.queue_size)
+        with self._lock:
+            for book_id in book_ids:
+                self._by_book.setdefault(book_id, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        with self._lock:
+            for book_id in subscriber.book_ids:
+                subscribers = self._by_book.get(book_id)
+                if subscribers is None:
+                    continue
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._by_book[book_id]
+            self.resyncs += subscriber.resyncs
+
+    def publish(self, change: dict) -> None:
+        with self._lock:
+            subscribers = self._by_book.get(change["book_id"])
+            loops = {subscriber.loop for subscriber in subscribers} if subscribers else ()
+            self.published += 1
+        for loop in loops:
+            try:
+                loop.call_soon_threadsafe(self._deliver,
+                                          loop,
+                                          change)
+            except RuntimeError:
+                # loop already closed (shutdown); its streams are gone
+                pass
+
+    def _deliver(self, loop: asyncio.AbstractEventLoop, change: dict) -> None:
+        with self._lock:
+            subscribers = [subscriber for subscriber in self._by_book.get(change["book_id"], ())
+                           if subscriber.loop is loop]
+        for subscriber in subscribers:
+            subscriber.offer(change)
+
+    def stats(self) -> dict:
+        with self._lock:
+            streams = {subscriber for subscribers in self._by_book.values() for subscriber in subscribers}
+            return {"subscribers": len(streams),
+                    "books": len(self._by_book),
+                    "published": self.published,
+                    "resyncs": self.resyncs + sum(subscriber.resyncs for subscriber in streams)}
+
+availability_broker = AvailabilityBroker(settings.events_queue_size)
+
+# -------- COMMIT HOOKS --------
+# Write paths note the new counts on the session; they are published only
+# once the transaction commits, and dropped if it rolls back.
+def record_availability(db: Session,
+                        book_id: int,
+                        available_copies: int,
+                        total_copies: int,
+                        version: int) -> None:
+    db.info.setdefault(CHANGES_KEY, {})[book_id] = {"book_id": book_id,
+                                                    "available_copies": available_copies,
+                                                    "total_copies": total_copies,
+                                                    "version": version}
+
+@event.listens_for(Session, "after_commit")
+def publish_committed(session: Session) -> None:
+    changes = session.info.pop(CHANGES_KEY, None)
+    if changes:
+        for change in changes.values():
+            availability_broker.publish(change)
+
+@event.listens_for(Session, "after_rollback")
+def discard_rolled_back(session: Session) -> None:
+    session.info.pop(CHANGES_KEY, None)
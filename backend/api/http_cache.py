@@ -0,0 +1,47 @@
+from fastapi import Request, Response
+import hashlib
+
+from .config import settings
+
+# -------- ETAG --------
+def make_etag(*parts) -> str:
+    digest = hashlib.blake2b(repr(parts).encode(),
+                             digest_size=12).hexdigest()
+    return f'W/"{digest}"'
+
+def rows_etag(kind: str,
+              rows,
+              expand: tuple[str, ...] = ()) -> str:
+    # every field we serialize comes from the row (and its expanded relations),
+    # so (id, version) pins the body
+    return make_etag(kind,
+                     *expand,
+                     *[(row.id, row.version, *(getattr(row, name).version for name in expand))
+                       for row in rows])
+
+def is_not_modified(request: Request,
+                    etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    candidates = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return etag.removeprefix("W/") in candidates
+
+def cache_headers(etag: str) -> dict:
+    return {"ETag": etag,
+            "Cache-Control": settings.cache_control}
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304,
+                    headers=cache_headers(etag))
+
+def conditional(request: Request,
+                response: Response,
+                etag: str) -> Response | None:
+    if is_not_modified(request,
+                       etag):
+        return not_modified(etag)
+    response.headers.update(cache_headers(etag))
+    return None
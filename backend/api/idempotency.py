@@ -0,0 +1,135 @@
+from datetime import datetime, timedelta, timezone
+from typing import Callable
+from fastapi import HTTPException, Response
+from pydantic import BaseModel
+from sqlalchemy import Row, delete, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+import hashlib
+import json
+import logging
+
+from . import crud, models
+from .config import settings
+
+logger = logging.getLogger("library.idempotency")
+
+REPLAY_HEADER = "Idempotent-Replayed"
+
+# -------- LOOKUP --------
+def fingerprint(endpoint: str,
+                payload: dict) -> str:
+    raw = json.dumps([endpoint, payload],
+                     sort_keys=True,
+                     separators=(",", ":"),
+                     default=str)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+def get_stored(db: Session,
+               key: str,
+               now: datetime) -> Row | None:
+    # columns rather than an entity, so the result survives the rollback that
+    # ends the read transaction
+    stmt = select(models.IdempotencyKey.key,
+                  models.IdempotencyKey.request_hash,
+                  models.IdempotencyKey.status_code,
+                  models.IdempotencyKey.response_body).where(models.IdempotencyKey.key == key,
+                                                             models.IdempotencyKey.expires_at > now)
+    return db.execute(stmt).first()
+
+def replay(stored: Row,
+           request_hash: str) -> Response:
+    if stored.request_hash != request_hash:
+        raise HTTPException(status_code=422,
+                            detail="Idempotency-Key was already used for a different request")
+    logger.info("idempotent_replay key=%s status=%s",
+                stored.key,
+                stored.status_code)
+    return Response(content=stored.response_body,
+                    status_code=stored.status_code,
+                    media_type="application/json",
+                    headers={REPLAY_HEADER: "true"})
+
+# -------- RECORD --------
+def claim(db: Session,
+          key: str,
+          request_hash: str,
+          now: datetime) -> None:
+    # First write of the transaction. A concurrent request with the same key
+    # blocks here (on SQLite's write lock, or on the primary key elsewhere)
+    # until this transaction ends, then either sees the stored response or,
+    # if this one rolled back, claims the key itself.
+    db.execute(delete(models.IdempotencyKey).where(models.IdempotencyKey.key == key,
+                                                   models.IdempotencyKey.expires_at <= now))
+    db.add(models.IdempotencyKey(key=key,
+                                 request_hash=request_hash,
+                                 status_code=0,
+                                 response_body="",
+                                 created_at=now,
+                                 expires_at=now + timedelta(hours=settings.idempotency_ttl_hours)))
+    db.flush()
+
+def recorder(key: str,
+             status_code: int,
+             schema: type[BaseModel]) -> Callable[[Session, object], None]:
+    # Runs inside the service's write transaction, so the response commits
+    # (or rolls back) together with the loan change it describes.
+    def record(db: Session,
+               result) -> None:
+        db.execute(update(models.IdempotencyKey)
+                   .where(models.IdempotencyKey.key == key)
+                   .values(status_code=status_code,
+                           response_body=schema.model_validate(result).model_dump_json()))
+    return record
+
+def execute(db: Session,
+            key: str | None,
+            request_hash: str,
+            status_code: int,
+            schema: type[BaseModel],
+            action: Callable[[Callable | None], object]):
+    if key is None:
+        return action(None)
+
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    # plain read in a deferred transaction: replays never take the write lock
+    stored = get_stored(db,
+                        key,
+                        now)
+    db.rollback()
+    if stored is not None:
+        return replay(stored,
+                      request_hash)
+
+    try:
+        crud.begin_write(db)
+        claim(db,
+              key,
+              request_hash,
+              now)
+    except IntegrityError:
+        # the same key committed while we waited: answer with its response
+        db.rollback()
+        stored = get_stored(db,
+                            key,
+                            now)
+        db.rollback()
+        if stored is None:
+            raise
+        return replay(stored,
+                      request_hash)
+
+    # the service joins the write transaction the claim started
+    return action(recorder(key,
+                           status_code,
+                           schema))
+
+# -------- PURGE --------
+def purge_expired(db: Session,
+                  now: datetime | None = None) -> int:
+    now = now or datetime.now(timezone.utc).replace(tzinfo=None)
+    deleted = db.execute(
+        delete(models.IdempotencyKey).where(models.IdempotencyKey.expires_at <= now)
+    ).rowcount
+    db.commit()
+    return deleted
@@ -0,0 +1,279 @@
+from datetime import datetime, timezone
+from sqlalchemy import Date, Integer, case, cast, delete, func, insert, literal, select, union_all, update
+from sqlalchemy.orm import Session
+import argparse
+import logging
+
+from . import crud, models, cache, idempotency
+from .database import SessionLocal, engine
+from .migrations import ensure_current
+from .services import FINE_PER_DAY, log_hold_ready, pass_copy_on
+from .utils import to_utc_naive
+
+logger = logging.getLogger("library.jobs")
+
+# -------- FINES --------
+def days_before(db: Session,
+                day: datetime,
+                column):
+    # whole calendar days from column's date to day, in SQL
+    if db.get_bind().dialect.name == "sqlite":
+        return cast(func.julianday(day) - func.julianday(func.date(column)),
+                    Integer)
+    return cast(literal(day), Date) - cast(column, Date)
+
+def accrue_fines(db: Session,
+                 now: datetime | None = None) -> dict:
+    # Fines grow by FINE_PER_DAY for every calendar day a loan is overdue
+    # (utils.days_overdue), so the high-water mark is the day the last run
+    # accrued up to. Loans that were already overdue then get the flat delta
+    # for the days since; only loans that fell overdue in between need the
+    # per-row date math.
+    now = to_utc_naive(now or datetime.now(timezone.utc))
+    today = datetime(now.year, now.month, now.day)
+
+    crud.begin_write(db)
+    state = db.get(models.JobState,
+                   "accrue_fines")
+    last = state.high_water_mark if state else None
+    if last is not None and last >= today:
+        db.rollback()
+        return {"as_of": today.isoformat(), "carried": 0, "newly_overdue": 0}
+
+    active = models.Loan.return_date.is_(None)
+    carried = 0
+    if last is not None:
+        carried = db.execute(
+            update(models.Loan)
+            .where(active,
+                   models.Loan.due_date < last)
+            .values(fine_amount=models.Loan.fine_amount + (today - last).days * FINE_PER_DAY)
+        ).rowcount
+
+    overdue_days = days_before(db,
+                               today,
+                               models.Loan.due_date)
+    newly_overdue = update(models.Loan).where(active,
+                                              models.Loan.due_date < today)
+    if last is not None:
+        newly_overdue = newly_overdue.where(models.Loan.due_date >= last)
+    newly = db.execute(
+        newly_overdue.values(fine_amount=overdue_days * FINE_PER_DAY)
+    ).rowcount
+
+    if state is None:
+        state = models.JobState(name="accrue_fines")
+        db.add(state)
+    state.high_water_mark = today
+    state.updated_at = now
+    db.commit()
+
+    logger.info("fines_accrued as_of=%s carried=%s newly_overdue=%s",
+                today.date().isoformat(),
+                carried,
+                newly)
+    return {"as_of": today.isoformat(), "carried": carried, "newly_overdue": newly}
+
+# -------- COUNTERS --------
+def reconcile_user_counters(db: Session,
+                            repair: bool = False) -> dict:
+    # Recomputes the users.* loan counters from the loans table and reports
+    # (or fixes) every user whose stored values drifted.
+    if repair:
+        crud.begin_write(db)
+    loans = (
+        select(models.Loan.user_id,
+               func.count().label("total_loans"),
+               func.sum(case((models.Loan.return_date.is_(None), 1), else_=0)).label("active_loans"),
+               func.sum(case((models.Loan.return_date.is_not(None), models.Loan.fine_amount), else_=0)).label("outstanding_fines"))
+        .group_by(models.Loan.user_id)
+        .subquery()
+    )
+    expected = {
+        "active_loans": func.coalesce(loans.c.active_loans, 0),
+        "total_loans": func.coalesce(loans.c.total_loans, 0),
+        "outstanding_fines": func.coalesce(loans.c.outstanding_fines, 0),
+    }
+    stmt = (
+        select(models.User.id, *(value.label(name) for name, value in expected.items()))
+        .outerjoin(loans, loans.c.user_id == models.User.id)
+        .where((models.User.active_loans != expected["active_loans"])
+               | (models.User.total_loans != expected["total_loans"])
+               | (models.User.outstanding_fines != expected["outstanding_fines"]))
+    )
+    drifted = [row._asdict() for row in db.execute(stmt)]
+
+    if repair and drifted:
+        db.execute(update(models.User),
+                   [{"id": row["id"],
+                     "active_loans": row["active_loans"],
+                     "total_loans": row["total_loans"],
+                     "outstanding_fines": row["outstanding_fines"]} for row in drifted])
+    if repair:
+        db.commit()
+        # reaches this process's cache only: run from the CLI, the API workers
+        # serve the old row until its entry expires (LIBRARY_CACHE_TTL_SECONDS)
+        for row in drifted:
+            cache.invalidate_user(row["id"])
+
+    logger.info("user_counters_reconciled drifted=%s repaired=%s",
+                len(drifted),
+                repair)
+    return {"drifted": len(drifted),
+            "repaired": len(drifted) if repair else 0,
+            "user_ids": [row["id"] for row in drifted[:100]]}
+
+# -------- HOLDS --------
+def expire_holds(db: Session,
+                 now: datetime | None = None) -> dict:
+    # Ready holds not picked up in time: each set-aside copy moves on to the
+    # next holder in the queue, or back on the shelf.
+    now = to_utc_naive(now or datetime.now(timezone.utc))
+    crud.begin_write(db)
+    expired = crud.expire_ready_holds(db,
+                                      now)
+    passed_on = [pass_copy_on(db,
+                              row.book_id,
+                              now) for row in expired]
+    db.commit()
+
+    # as in reconcile_user_counters: the API workers' caches catch up within
+    # LIBRARY_CACHE_TTL_SECONDS
+    for row in expired:
+        cache.invalidate_book(row.book_id)
+    for hold in passed_on:
+        if hold:
+            log_hold_ready(hold)
+    reallocated = sum(1 for hold in passed_on if hold)
+    logger.info("holds_expired expired=%s reallocated=%s",
+                len(expired),
+                reallocated)
+    return {"expired": len(expired), "reallocated": reallocated}
+
+# -------- STATS --------
+def day_of(db: Session,
+           column):
+    if db.get_bind().dialect.name == "sqlite":
+        return func.date(column)
+    return cast(column, Date)
+
+def rebuild_stats(db: Session,
+                  now: datetime | None = None) -> dict:
+    # Recomputes the rollups from loans in one pass: borrow and return events
+    # are unioned and grouped by (day, book) in SQL, then the finished days are
+    # rolled up into daily_stats again.
+    now = to_utc_naive(now or datetime.now(timezone.utc))
+    crud.begin_write(db)
+    db.execute(delete(models.DailyStats))
+    db.execute(delete(models.DailyBookStats))
+    db.execute(delete(models.JobState).where(models.JobState.name == crud.ROLLUP_JOB))
+
+    loan = models.Loan
+    borrowed = select(day_of(db, loan.loan_date).label("day"),
+                      loan.book_id,
+                      literal(1).label("loans"),
+                      literal(0).label("returns"),
+                      literal(0).label("late_returns"),
+                      literal(0).label("fines"))
+    returned = select(day_of(db, loan.return_date).label("day"),
+                      loan.book_id,
+                      literal(0),
+                      literal(1),
+                      case((day_of(db, loan.return_date) > day_of(db, loan.due_date), 1), else_=0),
+                      loan.fine_amount).where(loan.return_date.is_not(None))
+    events = union_all(borrowed, returned).subquery()
+
+    per_book = db.execute(
+        insert(models.DailyBookStats).from_select(
+            ["day", "book_id", *crud.STATS_COUNTS],
+            select(events.c.day,
+                   events.c.book_id,
+                   *(func.sum(events.c[name]) for name in crud.STATS_COUNTS))
+            .group_by(events.c.day, events.c.book_id)
+        )
+    ).rowcount
+    days = crud.roll_up_daily_stats(db,
+                                    crud.rollup_through(now),
+                                    now)
+    db.commit()
+
+    logger.info("stats_rebuilt days=%s book_days=%s",
+                days,
+                per_book)
+    return {"days": days, "book_days": per_book}
+
+def roll_up_stats(db: Session,
+                  now: datetime | None = None) -> dict:
+    # Daily: adds the days that have finished since the last run to
+    # daily_stats. /stats reads sum the per-book rows of any day not rolled
+    # up yet, so a missed run only makes those reads slower.
+    now = to_utc_naive(now or datetime.now(timezone.utc))
+    through = crud.rollup_through(now)
+    crud.begin_write(db)
+    days = crud.roll_up_daily_stats(db,
+                                    through,
+                                    now)
+    db.commit()
+
+    logger.info("stats_rolled_up through=%s days=%s",
+                through.isoformat(),
+                days)
+    return {"through": through.isoformat(), "days": days}
+
+# -------- CLI --------
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m api.jobs")
+    commands = parser.add_subparsers(dest="command",
+                                     required=True)
+    fines = commands.add_parser("accrue-fines",
+                                help="update fine_amount on active overdue loans")
+    fines.add_argument("--now",
+                       type=datetime.fromisoformat,
+                       help="accrue as of this UTC time (default: now)")
+    counters = commands.add_parser("reconcile-counters",
+                                   help="check users.active_loans/total_loans/outstanding_fines against loans")
+    counters.add_argument("--repair",
+                          action="store_true",
+                          help="rewrite drifted counters (default: report only)")
+    commands.add_parser("purge-idempotency-keys",
+                        help="delete stored Idempotency-Key responses past their TTL")
+    holds = commands.add_parser("expire-holds",
+                                help="expire ready holds past their pickup window and pass the copies on")
+    holds.add_argument("--now",
+                       type=datetime.fromisoformat,
+                       help="expire as of this UTC time (default: now)")
+    commands.add_parser("rebuild-stats",
+                        help="recompute the /stats rollup tables from loans")
+    rollup = commands.add_parser("roll-up-stats",
+                                 help="add the days finished since the last run to the daily_stats totals")
+    rollup.add_argument("--now",
+                        type=datetime.fromisoformat,
+                        help="roll up as of this UTC time (default: now)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO,
+                        format="%(asctime)s | %(levelname)s | %(name)s | %(message)s")
+    ensure_current(engine)
+    with SessionLocal() as db:
+        if args.command == "accrue-fines":
+            print(accrue_fines(db,
+                               args.now))
+        elif args.command == "reconcile-counters":
+            print(reconcile_user_counters(db,
+                                          args.repair))
+        elif args.command == "purge-idempotency-keys":
+            deleted = idempotency.purge_expired(db)
+            logger.info("idempotency_keys_purged deleted=%s",
+                        deleted)
+            print({"deleted": deleted})
+        elif args.command == "expire-holds":
+            print(expire_holds(db,
+                               args.now))
+        elif args.command == "rebuild-stats":
+            print(rebuild_stats(db))
+        elif args.command == "roll-up-stats":
+            print(roll_up_stats(db,
+                                args.now))
+
+if __name__ == "__main__":
+    main()
@@ -1,31 +1,131 @@
-import logging
-from logging.handlers import RotatingFileHandler
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from pathlib import Path
+import atexit
+import json
+import logging
+import queue
+import random
+import re
 import sys
 
+from .config import settings
+
 LOG_DIR = Path(__file__).resolve().parents[2] / "logs"
-LOG_DIR.mkdir(exist_ok=True)
 
 LOG_FILE = LOG_DIR / "app.log"
 
-def setup_logging() -> None:
-    formatter = logging.Formatter(
-        "%(asctime)s | %(levelname)s | %(name)s | %(message)s"
-    )
+TEXT_FORMAT = "%(asctime)s | %(levelname)s | %(name)s | %(message)s"
+
+_listener: QueueListener | None = None
+
+# -------- FORMAT --------
+_FIELD = re.compile(r" (?=\w+=)")
+
+_CONSTANTS = {"None": None, "True": True, "False": False}
+
+def _parse_value(value: str):
+    if value in _CONSTANTS:
+        return _CONSTANTS[value]
+    for cast in (int, float):
+        try:
+            return cast(value)
+        except ValueError:
+            pass
+    return value
+
+def parse_fields(message: str) -> tuple[str, dict]:
+    # "loan_created loan_id=5 user_id=1" -> ("loan_created", {"loan_id": 5, "user_id": 1});
+    # a value runs until the next " key=", so values with spaces survive
+    head, *pairs = _FIELD.split(message)
+    fields = {}
+    for pair in pairs:
+        key, _, value = pair.partition("=")
+        fields[key] = _parse_value(value)
+    return head, fields
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        event, fields = parse_fields(record.getMessage())
+        data = {"ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+                "level": record.levelname,
+                "logger": record.name,
+                "event": event,
+                **fields}
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str)
+
+# -------- FILTER --------
+class SamplingFilter(logging.Filter):
+    # Keeps a fraction of the records below WARNING for the configured loggers
+    # (and their children); warnings and errors always pass.
+    def __init__(self, rates: dict[str, float]):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        name = record.name
+        while name:
+            if name in self.rates:
+                return random.random() < self.rates[name]
+            name = name.rpartition(".")[0]
+        return True
+
+# -------- SETUP --------
+def build_handlers(log_file: Path = LOG_FILE,
+                   stream=sys.stdout) -> list[logging.Handler]:
+    formatter = JsonFormatter() if settings.log_format == "json" else logging.Formatter(TEXT_FORMAT)
 
     file_handler = RotatingFileHandler(
-        LOG_FILE,
-        maxBytes=5000000, 
+        log_file,
+        maxBytes=5000000,
         backupCount=2,
         encoding="utf-8",
     )
     file_handler.setFormatter(formatter)
 
-    console_handler = logging.StreamHandler(sys.stdout)
+    console_handler = logging.StreamHandler(stream)
     console_handler.setFormatter(formatter)
+    return [file_handler, console_handler]
+
+def stop_logging() -> None:
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+def setup_logging(log_file: Path = LOG_FILE,
+                  stream=sys.stdout) -> None:
+    global _listener
+    stop_logging()
+    log_file.parent.mkdir(exist_ok=True)
+    handlers = build_handlers(log_file,
+                              stream)
 
     root = logging.getLogger()
-    root.setLevel(logging.INFO)
+    root.setLevel(settings.log_level)
+    for handler in root.handlers:
+        handler.close()
     root.handlers.clear()
-    root.addHandler(file_handler)
-    root.addHandler(console_handler)
+
+    if settings.log_queue:
+        # request threads only enqueue; formatting, file I/O and rotation run
+        # on the listener thread
+        queue_handler = QueueHandler(queue.SimpleQueue())
+        _listener = QueueListener(queue_handler.queue,
+                                  *handlers,
+                                  respect_handler_level=True)
+        _listener.start()
+        handlers = [queue_handler]
+
+    for handler in handlers:
+        handler.addFilter(SamplingFilter(settings.log_sample_rates))
+        root.addHandler(handler)
+
+    for name, level in settings.log_levels.items():
+        logging.getLogger(name).setLevel(level)
+
+atexit.register(stop_logging)
@@ -1,22 +1,62 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from .database import Base, engine
-from .routers import users_router, books_router, loans_router
-from .logging_config import setup_logging
+from fastapi.responses import ORJSONResponse, PlainTextResponse
+from .config import settings
+from .database import engine, read_engine, async_engine, async_read_engine
+from .migrations import ensure_current
+from .metrics import MetricsMiddleware, render
+from .cache import entity_cache
+from .events import availability_broker
+from .routers import users_router, books_router, loans_router, stats_router
+from .logging_config import setup_logging, stop_logging
+import gc
 
-def create_api() -> FastAPI:
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Importing the app does no I/O: logging, the schema check and the first
+    # connections happen once the server starts this worker.
     setup_logging()
-    api = FastAPI(title="Digital Library API",
-                  version="0.0.1")
+    ensure_current(engine)
+    # Modules, metadata and pools live as long as the process. Frozen, they
+    # drop out of the cyclic GC's full collections, which otherwise rescan
+    # them again and again under allocation-heavy requests (a quarter of the
+    # CPU of a bulk import).
+    gc.collect()
+    gc.freeze()
+    yield
+    stop_logging()
 
-    Base.metadata.create_all(bind=engine)
+def create_api() -> FastAPI:
+    api = FastAPI(title="Digital Library API",
+                  version="0.0.1",
+                  default_response_class=ORJSONResponse,
+                  lifespan=lifespan)
 
     @api.get("/health")
     def health():
         return {"status": "ok"}
 
+    if settings.metrics:
+        api.add_middleware(MetricsMiddleware)
+
+        @api.get("/metrics",
+                 response_class=PlainTextResponse,
+                 include_in_schema=False)
+        def metrics():
+            pools = {"sync": engine.pool,
+                     "sync_read": read_engine.pool}
+            if async_engine is not None:
+                pools["async"] = async_engine.pool
+                pools["async_read"] = async_read_engine.pool
+            return PlainTextResponse(render(pools,
+                                            entity_cache.stats(),
+                                            availability_broker.stats()),
+                                     media_type="text/plain; version=0.0.4")
+
     api.include_router(users_router)
     api.include_router(books_router)
     api.include_router(loans_router)
+    api.include_router(stats_router)
 
     return api
 
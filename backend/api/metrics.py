@@ -0,0 +1,239 @@
+from bisect import bisect_left
+from contextvars import ContextVar
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import logging
+import threading
+import time
+
+from .config import settings
+
+logger = logging.getLogger("library.metrics")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+DB_TIME_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+
+# -------- REGISTRY --------
+class Histogram:
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        index = bisect_left(self.buckets, value)
+        if index < len(self.counts):
+            self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+_lock = threading.Lock()
+request_latency: dict[tuple, Histogram] = {}
+request_queries: dict[tuple, Histogram] = {}
+request_db_seconds: dict[tuple, Histogram] = {}
+totals = {"queries": 0, "query_seconds": 0.0, "slow_queries": 0}
+in_flight = 0
+
+def _observe(series: dict,
+             labels: tuple,
+             buckets: tuple,
+             value: float) -> None:
+    histogram = series.get(labels)
+    if histogram is None:
+        histogram = series[labels] = Histogram(buckets)
+    histogram.observe(value)
+
+# -------- REQUEST --------
+class RequestStats:
+    __slots__ = ("scope", "queries", "db_seconds")
+
+    def __init__(self, scope: dict):
+        self.scope = scope
+        self.queries = 0
+        self.db_seconds = 0.0
+
+    @property
+    def route(self) -> str:
+        route = self.scope.get("route")
+        return route.path if route is not None else "unmatched"
+
+_request_stats: ContextVar[RequestStats | None] = ContextVar("request_stats",
+                                                             default=None)
+
+class MetricsMiddleware:
+    # Plain ASGI middleware: the per-request stats object lives in a contextvar,
+    # which threadpool and run_sync calls copy, so the query hooks below can
+    # find it from whichever thread runs the endpoint.
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        global in_flight
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats(scope)
+        token = _request_stats.set(stats)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        with _lock:
+            in_flight += 1
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            _request_stats.reset(token)
+            route = stats.route
+            with _lock:
+                in_flight -= 1
+                _observe(request_latency,
+                         (scope["method"], route, str(status)),
+                         LATENCY_BUCKETS,
+                         elapsed)
+                _observe(request_queries,
+                         (scope["method"], route),
+                         QUERY_BUCKETS,
+                         stats.queries)
+                _observe(request_db_seconds,
+                         (scope["method"], route),
+                         DB_TIME_BUCKETS,
+                         stats.db_seconds)
+            logger.debug("request method=%s route=%s status=%s duration_ms=%.1f queries=%s db_ms=%.1f",
+                         scope["method"],
+                         route,
+                         status,
+                         elapsed * 1000,
+                         stats.queries,
+                         stats.db_seconds * 1000)
+
+# -------- QUERIES --------
+def instrument_engine(engine: Engine) -> None:
+    # the start time lives on the statement's execution context, so a
+    # statement that raises leaves nothing behind for the next one to pick up
+    @event.listens_for(engine, "before_cursor_execute")
+    def start_timer(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context.query_start = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def stop_timer(conn, cursor, statement, parameters, context, executemany):
+        start = getattr(context, "query_start", None)
+        if start is None:
+            return
+        elapsed = time.perf_counter() - start
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.db_seconds += elapsed
+        slow = elapsed * 1000 >= settings.slow_query_ms
+        with _lock:
+            totals["queries"] += 1
+            totals["query_seconds"] += elapsed
+            if slow:
+                totals["slow_queries"] += 1
+        if slow:
+            logger.warning("slow_query duration_ms=%.1f route=%s sql=%s",
+                           elapsed * 1000,
+                           stats.route if stats is not None else None,
+                           " ".join(statement.split()))
+
+# -------- EXPOSITION --------
+def _labels(**labels) -> str:
+    values = ",".join(f'{key}="{value}"' for key, value in labels.items())
+    return "{" + values + "}" if values else ""
+
+def _histogram_lines(name: str,
+                     help_text: str,
+                     series: dict,
+                     label_names: tuple) -> list[str]:
+    lines = [f"# HELP {name} {help_text}",
+             f"# TYPE {name} histogram"]
+    for labels, histogram in sorted(series.items()):
+        base = dict(zip(label_names, labels))
+        cumulative = 0
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{_labels(**base, le=bound)} {cumulative}")
+        lines.append(f"{name}_bucket{_labels(**base, le='+Inf')} {histogram.count}")
+        lines.append(f"{name}_sum{_labels(**base)} {histogram.sum}")
+        lines.append(f"{name}_count{_labels(**base)} {histogram.count}")
+    return lines
+
+def _sample_lines(name: str,
+                  kind: str,
+                  help_text: str,
+                  samples: list[tuple[dict, float]]) -> list[str]:
+    return [f"# HELP {name} {help_text}",
+            f"# TYPE {name} {kind}",
+            *(f"{name}{_labels(**labels)} {value}" for labels, value in samples)]
+
+def render(pools: dict,
+           cache_stats: dict,
+           stream_stats: dict) -> str:
+    with _lock:
+        lines = [
+            *_histogram_lines("library_http_request_duration_seconds",
+                              "Request latency by route.",
+                              request_latency,
+                              ("method", "route", "status")),
+            *_histogram_lines("library_http_request_db_queries",
+                              "SQL statements executed per request.",
+                              request_queries,
+                              ("method", "route")),
+            *_histogram_lines("library_http_request_db_seconds",
+                              "Time spent in SQL per request.",
+                              request_db_seconds,
+                              ("method", "route")),
+            *_sample_lines("library_http_requests_in_flight", "gauge",
+                           "Requests currently being served.",
+                           [({}, in_flight)]),
+            *_sample_lines("library_db_queries_total", "counter",
+                           "SQL statements executed.",
+                           [({}, totals["queries"])]),
+            *_sample_lines("library_db_query_seconds_total", "counter",
+                           "Time spent executing SQL statements.",
+                           [({}, totals["query_seconds"])]),
+            *_sample_lines("library_db_slow_queries_total", "counter",
+                           "SQL statements slower than the slow query threshold.",
+                           [({}, totals["slow_queries"])]),
+        ]
+
+    for metric, method, help_text in (("size", "size", "Configured pool size."),
+                                      ("checked_out", "checkedout", "Connections in use."),
+                                      ("checked_in", "checkedin", "Idle connections in the pool."),
+                                      ("overflow", "overflow", "Connections opened beyond the pool size.")):
+        lines += _sample_lines(f"library_db_pool_{metric}", "gauge", help_text,
+                               [({"pool": name}, getattr(pool, method)())
+                                for name, pool in pools.items() if hasattr(pool, method)])
+
+    backend = cache_stats["backend"]
+    for key in ("hits", "misses", "evictions"):
+        lines += _sample_lines(f"library_cache_{key}_total", "counter",
+                               f"Entity cache {key}.",
+                               [({"backend": backend}, cache_stats[key])])
+    if "entries" in cache_stats:
+        lines += _sample_lines("library_cache_entries", "gauge",
+                               "Entries held in the entity cache.",
+                               [({"backend": backend}, cache_stats["entries"])])
+    lines += [
+        *_sample_lines("library_stream_subscribers", "gauge",
+                       "Open availability streams.",
+                       [({}, stream_stats["subscribers"])]),
+        *_sample_lines("library_stream_changes_published_total", "counter",
+                       "Committed availability changes published to streams.",
+                       [({}, stream_stats["published"])]),
+        *_sample_lines("library_stream_resyncs_total", "counter",
+                       "Streams that fell behind and were resent the current state.",
+                       [({}, stream_stats["resyncs"])]),
+    ]
+    return "\n".join(lines) + "\n"
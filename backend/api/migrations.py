@@ -0,0 +1,239 @@
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import Column, Date, DateTime, Integer, MetaData, String, Table, bindparam, func, insert, inspect as inspect_db, select, text, update
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.schema import CreateColumn
+from typing import Callable
+import argparse
+import logging
+
+from . import models  # models registers the tables on Base.metadata
+from .config import settings
+from .database import Base, engine
+from .search import install_fts
+
+logger = logging.getLogger("library.migrations")
+
+# -------- VERSION TABLE --------
+# Kept out of Base.metadata so the migrations below are the only thing that
+# creates application tables.
+version_metadata = MetaData()
+
+schema_version = Table("schema_version",
+                       version_metadata,
+                       Column("version", Integer, primary_key=True),
+                       Column("name", String(100), nullable=False),
+                       Column("applied_at", DateTime, nullable=False))
+
+# any constant works; it only has to be the same in every process
+POSTGRES_LOCK_ID = 7_220_417
+
+# -------- HELPERS --------
+def create_tables(conn: Connection,
+                  *names: str) -> None:
+    Base.metadata.create_all(bind=conn,
+                             tables=[Base.metadata.tables[name] for name in names])
+
+def add_missing_columns(conn: Connection,
+                        *names: str) -> None:
+    inspector = inspect_db(conn)
+    for name in names:
+        table = Base.metadata.tables[name]
+        existing = {column["name"] for column in inspector.get_columns(name)}
+        for column in table.columns:
+            if column.name not in existing:
+                ddl = CreateColumn(column).compile(dialect=conn.dialect)
+                conn.exec_driver_sql(f"ALTER TABLE {name} ADD COLUMN {ddl}")
+
+def create_missing_indexes(conn: Connection,
+                           *names: str) -> None:
+    for name in names:
+        for index in Base.metadata.tables[name].indexes:
+            index.create(bind=conn,
+                         checkfirst=True)
+
+# -------- MIGRATIONS --------
+# Append only: a migration's number and name never change once released.
+# Each runs in its own transaction, together with its schema_version row.
+BASELINE_TABLES = ("users", "books", "loans", "job_state",
+                   "daily_stats", "daily_book_stats", "idempotency_keys")
+
+def baseline(conn: Connection) -> None:
+    # Databases from before versioned migrations can be at any earlier
+    # schema; create what is missing and leave what is there.
+    create_tables(conn,
+                  *BASELINE_TABLES)
+    add_missing_columns(conn,
+                        *BASELINE_TABLES)
+    create_missing_indexes(conn,
+                           *BASELINE_TABLES)
+    install_fts(conn)
+
+def add_holds(conn: Connection) -> None:
+    create_tables(conn,
+                  "holds")
+    create_missing_indexes(conn,
+                           "holds")
+
+def backfill_loan_counters(conn: Connection) -> None:
+    # The baseline adds the users.* loan counters to older databases at 0;
+    # recompute them from loans (as reconcile-counters --repair does) so the
+    # MAX_ACTIVE_LOANS check and the decrements start from the real values.
+    users = models.User.__table__
+    loans = models.Loan.__table__
+    of_user = loans.c.user_id == users.c.id
+    conn.execute(update(users).values(
+        active_loans=select(func.count()).where(of_user,
+                                                loans.c.return_date.is_(None)).scalar_subquery(),
+        total_loans=select(func.count()).where(of_user).scalar_subquery(),
+        outstanding_fines=select(func.coalesce(func.sum(loans.c.fine_amount), 0)).where(of_user,
+                                                                                      loans.c.return_date.is_not(None)).scalar_subquery(),
+    ))
+
+# Frozen copies of jobs.rebuild_stats and crud.roll_up_daily_stats as they
+# were at version 4, so later changes to either cannot change this upgrade.
+STATS_ROLLUP_JOB = "roll_up_stats"
+STATS_ROLLUP_LAG_DAYS = 2
+
+REBUILD_DAILY_BOOK_STATS = """INSERT INTO daily_book_stats (day, book_id, loans, returns, late_returns, fines)
+    SELECT day, book_id, SUM(loans), SUM(returns), SUM(late_returns), SUM(fines)
+    FROM (SELECT {loan_day} AS day, book_id, 1 AS loans, 0 AS returns, 0 AS late_returns, 0 AS fines
+          FROM loans
+          UNION ALL
+          SELECT {return_day}, book_id, 0, 1, CASE WHEN {return_day} > {due_day} THEN 1 ELSE 0 END, fine_amount
+          FROM loans WHERE return_date IS NOT NULL) AS events
+    GROUP BY day, book_id"""
+
+ROLL_UP_DAILY_STATS = """INSERT INTO daily_stats (day, loans, returns, late_returns, fines)
+    SELECT day, SUM(loans), SUM(returns), SUM(late_returns), SUM(fines)
+    FROM daily_book_stats WHERE day <= :through
+    GROUP BY day"""
+
+def roll_up_stats(conn: Connection) -> None:
+    # daily_stats used to be upserted on every loan write; it now holds the
+    # totals of finished days only. Rebuild both rollups from loans in one
+    # pass, as python -m api.jobs rebuild-stats does, and set the mark the
+    # /stats reads start from.
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    through = now.date() - timedelta(days=STATS_ROLLUP_LAG_DAYS)
+    day = "date({})" if conn.dialect.name == "sqlite" else "CAST({} AS DATE)"
+    conn.exec_driver_sql("DELETE FROM daily_stats")
+    conn.exec_driver_sql("DELETE FROM daily_book_stats")
+    conn.exec_driver_sql(REBUILD_DAILY_BOOK_STATS.format(loan_day=day.format("loan_date"),
+                                                         return_day=day.format("return_date"),
+                                                         due_day=day.format("due_date")))
+    conn.execute(text(ROLL_UP_DAILY_STATS).bindparams(bindparam("through",
+                                                               through,
+                                                               type_=Date)))
+    conn.execute(text("DELETE FROM job_state WHERE name = :name").bindparams(name=STATS_ROLLUP_JOB))
+    conn.execute(text("INSERT INTO job_state (name, high_water_mark, updated_at) VALUES (:name, :mark, :now)")
+                 .bindparams(bindparam("mark",
+                                       datetime(through.year, through.month, through.day),
+                                       type_=DateTime),
+                             bindparam("now",
+                                       now,
+                                       type_=DateTime),
+                             name=STATS_ROLLUP_JOB))
+
+def bulk_fts_indexing(conn: Connection) -> None:
+    # Lets a bulk import switch off the per-row FTS insert trigger for its own
+    # transaction (search.PAUSE_ROW_INDEXING) and index the batch at once. The
+    # marker row only exists inside that writer's transaction.
+    if conn.dialect.name != "sqlite":
+        return
+    conn.exec_driver_sql("CREATE TABLE IF NOT EXISTS books_fts_bulk_load (started INTEGER)")
+    conn.exec_driver_sql("DROP TRIGGER IF EXISTS books_fts_ai")
+    conn.exec_driver_sql(
+        """CREATE TRIGGER books_fts_ai AFTER INSERT ON books
+        WHEN NOT EXISTS (SELECT 1 FROM books_fts_bulk_load) BEGIN
+            INSERT INTO books_fts(rowid, title, author) VALUES (new.id, new.title, new.author);
+        END"""
+    )
+
+MIGRATIONS: list[tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "baseline", baseline),
+    (2, "holds", add_holds),
+    (3, "loan_counters", backfill_loan_counters),
+    (4, "daily_stats_rollup", roll_up_stats),
+    (5, "bulk_fts_indexing", bulk_fts_indexing),
+]
+
+HEAD = MIGRATIONS[-1][0]
+
+# -------- UPGRADE --------
+def current_version(conn: Connection) -> int:
+    if not inspect_db(conn).has_table("schema_version"):
+        return 0
+    return conn.scalar(select(func.max(schema_version.c.version))) or 0
+
+def _lock(conn: Connection) -> None:
+    # one migrator at a time when several workers start together; SQLite gets
+    # the same from BEGIN IMMEDIATE
+    if conn.dialect.name == "postgresql":
+        conn.exec_driver_sql(f"SELECT pg_advisory_xact_lock({POSTGRES_LOCK_ID})")
+
+def upgrade(bind: Engine = engine,
+            target: int = HEAD) -> list[int]:
+    applied = []
+    with bind.connect() as conn:
+        conn = conn.execution_options(sqlite_begin="IMMEDIATE")
+        for version, name, migrate in MIGRATIONS:
+            if version > target:
+                break
+            with conn.begin():
+                _lock(conn)
+                # re-read under the lock: another process may have got here first
+                schema_version.create(conn,
+                                      checkfirst=True)
+                if current_version(conn) >= version:
+                    continue
+                migrate(conn)
+                conn.execute(insert(schema_version).values(version=version,
+                                                           name=name,
+                                                           applied_at=datetime.now(timezone.utc).replace(tzinfo=None)))
+            applied.append(version)
+            logger.info("migration_applied version=%s name=%s",
+                        version,
+                        name)
+    return applied
+
+def ensure_current(bind: Engine = engine) -> None:
+    # startup path: one cheap version read when the schema is already current
+    with bind.connect() as conn:
+        version = current_version(conn)
+    if version >= HEAD:
+        return
+    if not settings.migrate_on_startup:
+        raise RuntimeError(f"database schema is at version {version}, expected {HEAD}; "
+                           "run python -m api.migrations upgrade")
+    upgrade(bind)
+
+# -------- CLI --------
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m api.migrations")
+    commands = parser.add_subparsers(dest="command",
+                                     required=True)
+    up = commands.add_parser("upgrade",
+                             help="apply pending migrations")
+    up.add_argument("--to",
+                    type=int,
+                    default=HEAD,
+                    help="stop after this version (default: latest)")
+    commands.add_parser("current",
+                        help="show the applied and pending migrations")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO,
+                        format="%(asctime)s | %(levelname)s | %(name)s | %(message)s")
+    if args.command == "upgrade":
+        print({"applied": upgrade(engine,
+                                  args.to),
+               "head": HEAD})
+    elif args.command == "current":
+        with engine.connect() as conn:
+            version = current_version(conn)
+        print({"version": version,
+               "head": HEAD,
+               "pending": [name for number, name, _ in MIGRATIONS if number > version]})
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,5 @@
-from datetime import datetime, timezone
-from sqlalchemy import String, Integer, DateTime, ForeignKey
+from datetime import date, datetime, timezone
+from sqlalchemy import String, Integer, Date, DateTime, ForeignKey, Index, Text, literal_column, text
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from .database import Base
 
@@ -22,6 +22,28 @@ class User(Base):
                                                  default=datetime.now(timezone.utc),
                                                  nullable=False)
 
+    # denormalized loan counters, kept in step by services.borrow_book/return_loan
+    active_loans: Mapped[int] = mapped_column(Integer,
+                                              default=0,
+                                              server_default=text("0"),
+                                              nullable=False)
+
+    total_loans: Mapped[int] = mapped_column(Integer,
+                                             default=0,
+                                             server_default=text("0"),
+                                             nullable=False)
+
+    outstanding_fines: Mapped[int] = mapped_column(Integer,
+                                                   default=0,
+                                                   server_default=text("0"),
+                                                   nullable=False)
+
+    version: Mapped[int] = mapped_column(Integer,
+                                         default=1,
+                                         server_default=text("1"),
+                                         onupdate=text("version + 1"),
+                                         nullable=False)
+
     loans: Mapped[list["Loan"]] = relationship(back_populates="user")
 
 # -------- BOOK --------
@@ -45,11 +67,30 @@ class Book(Base):
                                                   default=1,
                                                   nullable=False)
 
+    version: Mapped[int] = mapped_column(Integer,
+                                         default=1,
+                                         server_default=text("1"),
+                                         onupdate=text("version + 1"),
+                                         nullable=False)
+
     loans: Mapped[list["Loan"]] = relationship(back_populates="book")
 
 # -------- LOAN --------
 class Loan(Base):
     __tablename__ = "loans"
+    __table_args__ = (
+        Index("ix_loans_loan_date_id", "loan_date", "id"),
+        Index("ix_loans_user_id_return_date", "user_id", "return_date"),
+        Index("ix_loans_active_loan_date",
+              "loan_date",
+              "id",
+              sqlite_where=text("return_date IS NULL"),
+              postgresql_where=text("return_date IS NULL")),
+        Index("ix_loans_active_due_date",
+              "due_date",
+              sqlite_where=text("return_date IS NULL"),
+              postgresql_where=text("return_date IS NULL")),
+    )
 
     id: Mapped[int] = mapped_column(Integer,
                                     primary_key=True)
@@ -76,6 +117,170 @@ class Loan(Base):
                                              default=0,
                                              nullable=False)
 
+    version: Mapped[int] = mapped_column(Integer,
+                                         default=1,
+                                         server_default=text("1"),
+                                         onupdate=text("version + 1"),
+                                         nullable=False)
+
     user: Mapped["User"] = relationship(back_populates="loans")
 
     book: Mapped["Book"] = relationship(back_populates="loans")
+
+# -------- HOLD --------
+# waiting -> ready (a returned copy is set aside until expires_at) -> fulfilled
+# when borrowed; or cancelled / expired. At most one open (waiting or ready)
+# hold per user and book.
+class Hold(Base):
+    __tablename__ = "holds"
+
+    id: Mapped[int] = mapped_column(Integer,
+                                    primary_key=True)
+
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"),
+                                         nullable=False)
+
+    book_id: Mapped[int] = mapped_column(ForeignKey("books.id"),
+                                         nullable=False)
+
+    # higher is served first; equal priorities are served in request order
+    priority: Mapped[int] = mapped_column(Integer,
+                                          default=0,
+                                          server_default=text("0"),
+                                          nullable=False)
+
+    status: Mapped[str] = mapped_column(String(16),
+                                        default="waiting",
+                                        nullable=False)
+
+    created_at: Mapped[datetime] = mapped_column(DateTime,
+                                                 nullable=False)
+
+    ready_at: Mapped[datetime | None] = mapped_column(DateTime,
+                                                      nullable=True)
+
+    expires_at: Mapped[datetime | None] = mapped_column(DateTime,
+                                                        nullable=True)
+
+# SQLite only uses a partial index when the query repeats the index's WHERE
+# term with the same constants, so crud filters on these rather than on bound
+# parameters.
+HOLD_WAITING = Hold.status == literal_column("'waiting'")
+HOLD_READY = Hold.status == literal_column("'ready'")
+HOLD_OPEN = Hold.status.in_([literal_column("'waiting'"), literal_column("'ready'")])
+
+# the queue: the next waiting hold for a book is the first entry of this index
+Index("ix_holds_queue",
+      Hold.book_id,
+      Hold.priority.desc(),
+      Hold.id,
+      sqlite_where=HOLD_WAITING,
+      postgresql_where=HOLD_WAITING)
+
+Index("ix_holds_open_user_book",
+      Hold.user_id,
+      Hold.book_id,
+      unique=True,
+      sqlite_where=HOLD_OPEN,
+      postgresql_where=HOLD_OPEN)
+
+Index("ix_holds_ready_expires_at",
+      Hold.expires_at,
+      sqlite_where=HOLD_READY,
+      postgresql_where=HOLD_READY)
+
+# -------- JOB STATE --------
+class JobState(Base):
+    __tablename__ = "job_state"
+
+    name: Mapped[str] = mapped_column(String(50),
+                                      primary_key=True)
+
+    high_water_mark: Mapped[datetime] = mapped_column(DateTime,
+                                                      nullable=False)
+
+    updated_at: Mapped[datetime] = mapped_column(DateTime,
+                                                 nullable=False)
+
+# -------- STATS --------
+# daily_book_stats is kept in step by services.borrow_book/return_loan
+# (crud.record_loan_event); daily_stats holds its per-day totals for finished
+# days, written by jobs.roll_up_stats. Both are rebuilt from loans by
+# jobs.rebuild_stats. Days are UTC dates.
+class DailyStats(Base):
+    __tablename__ = "daily_stats"
+
+    day: Mapped[date] = mapped_column(Date,
+                                      primary_key=True)
+
+    loans: Mapped[int] = mapped_column(Integer,
+                                       default=0,
+                                       server_default=text("0"),
+                                       nullable=False)
+
+    returns: Mapped[int] = mapped_column(Integer,
+                                         default=0,
+                                         server_default=text("0"),
+                                         nullable=False)
+
+    late_returns: Mapped[int] = mapped_column(Integer,
+                                              default=0,
+                                              server_default=text("0"),
+                                              nullable=False)
+
+    fines: Mapped[int] = mapped_column(Integer,
+                                       default=0,
+                                       server_default=text("0"),
+                                       nullable=False)
+
+class DailyBookStats(Base):
+    __tablename__ = "daily_book_stats"
+
+    day: Mapped[date] = mapped_column(Date,
+                                      primary_key=True)
+
+    book_id: Mapped[int] = mapped_column(ForeignKey("books.id"),
+                                         primary_key=True)
+
+    loans: Mapped[int] = mapped_column(Integer,
+                                       default=0,
+                                       server_default=text("0"),
+                                       nullable=False)
+
+    returns: Mapped[int] = mapped_column(Integer,
+                                         default=0,
+                                         server_default=text("0"),
+                                         nullable=False)
+
+    late_returns: Mapped[int] = mapped_column(Integer,
+                                              default=0,
+                                              server_default=text("0"),
+                                              nullable=False)
+
+    fines: Mapped[int] = mapped_column(Integer,
+                                       default=0,
+                                       server_default=text("0"),
+                                       nullable=False)
+
+# -------- IDEMPOTENCY --------
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+
+    key: Mapped[str] = mapped_column(String(255),
+                                     primary_key=True)
+
+    request_hash: Mapped[str] = mapped_column(String(64),
+                                              nullable=False)
+
+    status_code: Mapped[int] = mapped_column(Integer,
+                                             nullable=False)
+
+    response_body: Mapped[str] = mapped_column(Text,
+                                               nullable=False)
+
+    created_at: Mapped[datetime] = mapped_column(DateTime,
+                                                 nullable=False)
+
+    expires_at: Mapped[datetime] = mapped_column(DateTime,
+                                                 nullable=False,
+                                                 index=True)
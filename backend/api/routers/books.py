@@ -1,20 +1,31 @@
-from fastapi import APIRouter, Depends, HTTPException
+from typing import AsyncIterator
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
+import asyncio
+import json
 import logging
 
-from ..database import get_db
-from .. import schemas, crud
-from ..utils import clamp_pagination
+from ..config import settings
+from ..database import get_db, get_read_db, run_on_event_loop, ReadSessionLocal, AsyncReadSessionLocal
+from .. import schemas, crud, bulk, cache, events, services
+from ..utils import clamp_pagination, encode_cursor, decode_id_cursor, decode_search_cursor, json_response, order_by_ids, parse_ids, schema_rows
+from ..search import build_match_query
+from ..http_cache import conditional, make_etag, rows_etag
 
 logger = logging.getLogger("library.api")
 
 router = APIRouter(prefix="/books",
                    tags=["books"])
 
+STREAM_RETRY_MS = 3000
+
 # -------- CREATE --------
 @router.post("",
              response_model=schemas.BookOut,
              status_code=201)
+@run_on_event_loop
 def create_book(payload: schemas.BookCreate,
                 db: Session = Depends(get_db)):
      book = crud.create_book(db,
@@ -26,45 +37,302 @@ def create_book(payload: schemas.BookCreate,
                  book.title)
      return book
 
+# -------- BULK CREATE --------
+@router.post("/bulk",
+             response_model=schemas.BulkResult)
+async def create_books_bulk(request: Request,
+                            response: Response,
+                            db: Session = Depends(get_db)):
+    result = await bulk.import_records(request,
+                                       db,
+                                       schemas.BookCreate,
+                                       bulk.insert_books)
+    logger.info("books_imported created=%s invalid=%s",
+                result["created"],
+                result["invalid"])
+    # one result per row, built here: skip response_model validation
+    return json_response(result,
+                         response)
+
 # -------- LIST --------
 @router.get("",
             response_model=list[schemas.BookOut])
-def list_books(skip: int = 0,
+@run_on_event_loop
+def list_books(request: Request,
+               response: Response,
+               skip: int = 0,
                limit: int = 20,
-               db: Session = Depends(get_db)):
+               after: str | None = None,
+               ids: str | None = None,
+               db: Session = Depends(get_read_db)):
+    if ids is not None:
+        return books_by_ids(request,
+                            response,
+                            ids,
+                            db)
     skip, limit = clamp_pagination(skip, limit)
-    return crud.list_books(db,
-                           skip,
-                           limit)
+    try:
+        after_id = decode_id_cursor(after) if after else None
+    except ValueError:
+        raise HTTPException(status_code=400,
+                            detail="Invalid cursor")
+    books = crud.list_books(db,
+                            skip,
+                            limit,
+                            after_id=after_id)
+    not_modified = conditional(request,
+                               response,
+                               rows_etag("books", books))
+    if not_modified:
+        return not_modified
+    if len(books) == limit:
+        response.headers["X-Next-Cursor"] = encode_cursor(books[-1].id)
+    return json_response(schema_rows(books,
+                                     schemas.BookOut),
+                         response)
+
+# -------- SEARCH --------
+@router.get("/search",
+            response_model=list[schemas.BookOut])
+@run_on_event_loop
+def search_books(request: Request,
+                 response: Response,
+                 q: str = Query(min_length=1,
+                                max_length=200),
+                 limit: int = 20,
+                 after: str | None = None,
+                 db: Session = Depends(get_read_db)):
+    _, limit = clamp_pagination(0, limit)
+    try:
+        after_key = decode_search_cursor(after) if after else None
+    except ValueError:
+        raise HTTPException(status_code=400,
+                            detail="Invalid cursor")
+    match = build_match_query(q,
+                              db.get_bind().dialect.name)
+    if match is None:
+        return []
+    results = crud.search_books(db,
+                                match,
+                                limit,
+                                after=after_key)
+    books = [book for book, _ in results]
+    not_modified = conditional(request,
+                               response,
+                               rows_etag("search", books))
+    if not_modified:
+        return not_modified
+    if len(results) == limit:
+        book, rank = results[-1]
+        response.headers["X-Next-Cursor"] = encode_cursor(rank,
+                                                          book.id)
+    return books
+
+# -------- MULTI-GET --------
+# Declared before /{book_id}, like the stream below.
+def books_by_ids(request: Request,
+                 response: Response,
+                 ids: str,
+                 db: Session):
+    # GET /books?ids=3,1,2: one IN query, items in request order, pagination ignored
+    try:
+        book_ids = parse_ids(ids,
+                             schemas.MAX_QUERY_IDS)
+    except ValueError as exc:
+        raise HTTPException(status_code=400,
+                            detail=str(exc))
+    books, missing = order_by_ids(crud.get_books_by_ids(db,
+                                                        book_ids),
+                                  book_ids)
+    not_modified = conditional(request,
+                               response,
+                               rows_etag("books", books))
+    if not_modified:
+        return not_modified
+    if missing:
+        response.headers["X-Missing-Ids"] = ",".join(map(str, missing))
+    return json_response(schema_rows(books,
+                                     schemas.BookOut),
+                         response)
+
+@router.post("/lookup",
+             response_model=schemas.BookLookupOut)
+@run_on_event_loop
+def lookup_books(payload: schemas.IdsLookup,
+                 response: Response,
+                 db: Session = Depends(get_read_db)):
+    book_ids = list(dict.fromkeys(payload.ids))
+    books, missing = order_by_ids(crud.get_books_by_ids(db,
+                                                        book_ids),
+                                  book_ids)
+    return json_response({"items": schema_rows(books,
+                                               schemas.BookOut),
+                          "missing": missing},
+                         response)
+
+def availability_items(rows) -> list[dict]:
+    return [{"book_id": row.book_id,
+             "available_copies": row.available_copies,
+             "total_copies": row.total_copies} for row in rows]
+
+@router.get("/availability",
+            response_model=list[schemas.AvailabilityOut])
+@run_on_event_loop
+def availability_many(ids: str,
+                      request: Request,
+                      response: Response,
+                      db: Session = Depends(get_read_db)):
+    try:
+        book_ids = parse_ids(ids,
+                             schemas.MAX_QUERY_IDS)
+    except ValueError as exc:
+        raise HTTPException(status_code=400,
+                            detail=str(exc))
+    rows, missing = order_by_ids(crud.get_availability(db,
+                                                       book_ids),
+                                 book_ids,
+                                 key="book_id")
+    not_modified = conditional(request,
+                               response,
+                               make_etag("availability", *[(row.book_id, row.version) for row in rows]))
+    if not_modified:
+        return not_modified
+    if missing:
+        response.headers["X-Missing-Ids"] = ",".join(map(str, missing))
+    return json_response(availability_items(rows),
+                         response)
+
+@router.post("/availability/lookup",
+             response_model=schemas.AvailabilityLookupOut)
+@run_on_event_loop
+def lookup_availability(payload: schemas.IdsLookup,
+                        response: Response,
+                        db: Session = Depends(get_read_db)):
+    book_ids = list(dict.fromkeys(payload.ids))
+    rows, missing = order_by_ids(crud.get_availability(db,
+                                                       book_ids),
+                                 book_ids,
+                                 key="book_id")
+    return json_response({"items": availability_items(rows),
+                          "missing": missing},
+                         response)
+
+# -------- AVAILABILITY STREAM --------
+# Declared before /{book_id}, which would otherwise read "availability" as an id.
+def _read_availability_sync(book_ids: list[int]) -> list:
+    with ReadSessionLocal() as db:
+        return crud.get_availability(db,
+                                     book_ids)
+
+async def read_availability(book_ids: list[int]) -> list:
+    if AsyncReadSessionLocal is not None:
+        async with AsyncReadSessionLocal() as db:
+            return await db.run_sync(crud.get_availability,
+                                     book_ids)
+    return await run_in_threadpool(_read_availability_sync,
+                                   book_ids)
+
+def sse(event: str,
+        data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+def public(change: dict) -> dict:
+    # the version only orders changes; clients get the same shape as
+    # GET /books/{book_id}/availability
+    return {"book_id": change["book_id"],
+            "available_copies": change["available_copies"],
+            "total_copies": change["total_copies"]}
+
+async def availability_events(book_ids: list[int]) -> AsyncIterator[str]:
+    # Subscribe first, then send the current state: a change committed in
+    # between shows up in both, and the version check drops the repeat (and
+    # anything older than what the client already has).
+    subscriber = events.availability_broker.subscribe(frozenset(book_ids))
+    sent: dict[int, int] = {}
+
+    def fresh(change: dict) -> bool:
+        if change["version"] <= sent.get(change["book_id"], 0):
+            return False
+        sent[change["book_id"]] = change["version"]
+        return True
+
+    async def current_state() -> list[str]:
+        changes = [row._asdict() for row in await read_availability(book_ids)]
+        return [sse("availability", public(change)) for change in changes if fresh(change)]
+
+    # the keep-alive is a timer that drops a marker into the queue, so an idle
+    # stream costs one pending get() and no extra task
+    loop = asyncio.get_running_loop()
+    keep_alive = None
+    try:
+        yield f"retry: {STREAM_RETRY_MS}\n\n"
+        for message in await current_state():
+            yield message
+        while True:
+            keep_alive = loop.call_later(settings.events_heartbeat_seconds,
+                                         subscriber.offer,
+                                         events.KEEP_ALIVE)
+            change = await subscriber.next()
+            keep_alive.cancel()
+            if change is events.KEEP_ALIVE:
+                # comment line: keeps proxies from closing an idle stream
+                yield ": keep-alive\n\n"
+            elif change is events.RESYNC:
+                # the queue overflowed and was dropped; catch up from the database
+                for message in await current_state():
+                    yield message
+            elif fresh(change):
+                yield sse("availability", public(change))
+    finally:
+        if keep_alive is not None:
+            keep_alive.cancel()
+        events.availability_broker.unsubscribe(subscriber)
+
+@router.get("/availability/stream")
+async def availability_stream(ids: str):
+    try:
+        book_ids = parse_ids(ids,
+                             settings.events_max_books)
+    except ValueError as exc:
+        raise HTTPException(status_code=400,
+                            detail=str(exc))
+    return StreamingResponse(availability_events(book_ids),
+                             media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache",
+                                      "X-Accel-Buffering": "no"})
 
 # -------- GET INFO --------
 @router.get("/{book_id}",
             response_model=schemas.BookOut)
+@run_on_event_loop
 def get_book(book_id: int,
-             db: Session = Depends(get_db)):
-    book = crud.get_book(db,
-                         book_id)
+             request: Request,
+             response: Response,
+             db: Session = Depends(get_read_db)):
+    book = cache.cached_book(db,
+                             book_id)
     if not book:
         raise HTTPException(status_code=404,
                             detail="Book not found")
+    not_modified = conditional(request,
+                               response,
+                               make_etag("book", book["id"], book["version"]))
+    if not_modified:
+        return not_modified
     return book
 
 # -------- UPDATE --------
 @router.put("/{book_id}",
             response_model=schemas.BookOut)
+@run_on_event_loop
 def update_book(book_id: int,
                 payload: schemas.BookUpdate,
                 db: Session = Depends(get_db)):
-    book = crud.get_book(db,
-                         book_id)
-    if not book:
-        raise HTTPException(status_code=404,
-                            detail="Book not found")
-    updated = crud.update_book(db,
-                               book,
-                               payload.title,
-                               payload.author,
-                               payload.total_copies)
+    updated = services.update_book(db,
+                                   book_id,
+                                   payload.title,
+                                   payload.author,
+                                   payload.total_copies)
     logger.info("book_updated book_id=%s title=%s",
                 updated.id,
                 updated.title)
@@ -72,13 +340,55 @@ def update_book(book_id: int,
 
 # -------- CHECK AVAILABILITY --------
 @router.get("/{book_id}/availability")
+@run_on_event_loop
 def availability(book_id: int,
-                 db: Session = Depends(get_db)):
-    book = crud.get_book(db,
-                         book_id)
+                 request: Request,
+                 response: Response,
+                 db: Session = Depends(get_read_db)):
+    book = cache.cached_book(db,
+                             book_id)
     if not book:
         raise HTTPException(status_code=404,
                             detail="Book not found")
-    return {"book_id": book.id,
-            "available_copies": book.available_copies,
-            "total_copies": book.total_copies}
+    not_modified = conditional(request,
+                               response,
+                               make_etag("availability", book["id"], book["version"]))
+    if not_modified:
+        return not_modified
+    return {"book_id": book["id"],
+            "available_copies": book["available_copies"],
+            "total_copies": book["total_copies"]}
+
+# -------- HOLDS --------
+@router.post("/{book_id}/holds",
+             response_model=schemas.HoldOut,
+             status_code=201)
+@run_on_event_loop
+def place_hold(book_id: int,
+               payload: schemas.HoldCreate,
+               db: Session = Depends(get_db)):
+    return services.place_hold(db,
+                               payload.user_id,
+                               book_id)
+
+@router.get("/{book_id}/holds",
+            response_model=list[schemas.HoldOut])
+@run_on_event_loop
+def list_holds(book_id: int,
+               db: Session = Depends(get_read_db)):
+    if not cache.cached_book(db,
+                             book_id):
+        raise HTTPException(status_code=404,
+                            detail="Book not found")
+    return crud.list_book_holds(db,
+                                book_id)
+
+@router.delete("/{book_id}/holds/{hold_id}",
+               response_model=schemas.HoldOut)
+@run_on_event_loop
+def cancel_hold(book_id: int,
+                hold_id: int,
+                db: Session = Depends(get_db)):
+    return services.cancel_hold(db,
+                                book_id,
+                                hold_id)
@@ -1,95 +1,166 @@
-from datetime import datetime, timezone
+from datetime import datetime
+from typing import Iterator
 import csv
+import zlib
 from io import StringIO
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, Response
 from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 
-from ..database import get_db
-from .. import schemas, crud
+from ..database import get_db, get_read_db, run_on_event_loop, ReadSessionLocal
+from .. import schemas, crud, idempotency
 from ..services import borrow_book, return_loan
-from ..utils import clamp_pagination
+from ..utils import clamp_pagination, encode_cursor, decode_loan_cursor, expand_rows, json_response, parse_expand, to_utc_naive
+from ..http_cache import conditional, rows_etag
 
 router = APIRouter(prefix="/loans",
                    tags=["loans"])
 
+EXPORT_BATCH_SIZE = 2000
+
 # -------- BORROW --------
 @router.post("",
              response_model=schemas.LoanOut,
              status_code=201)
+@run_on_event_loop
 def create_loan(payload: schemas.LoanCreate,
+                idempotency_key: str | None = Header(default=None,
+                                                     max_length=255),
                 db: Session = Depends(get_db)):
-    return borrow_book(db,
-                       payload.user_id,
-                       payload.book_id)
+    return idempotency.execute(db,
+                               idempotency_key,
+                               idempotency.fingerprint("POST /loans", payload.model_dump()),
+                               201,
+                               schemas.LoanOut,
+                               lambda before_commit: borrow_book(db,
+                                                                 payload.user_id,
+                                                                 payload.book_id,
+                                                                 before_commit=before_commit))
 
 # -------- RETURN --------
 @router.post("/{loan_id}/return",
              response_model=schemas.LoanOut)
+@run_on_event_loop
 def do_return(loan_id: int,
+              idempotency_key: str | None = Header(default=None,
+                                                   max_length=255),
               db: Session = Depends(get_db)):
-    return return_loan(db,
-                       loan_id)
+    return idempotency.execute(db,
+                               idempotency_key,
+                               idempotency.fingerprint("POST /loans/{loan_id}/return", {"loan_id": loan_id}),
+                               200,
+                               schemas.LoanOut,
+                               lambda before_commit: return_loan(db,
+                                                                 loan_id,
+                                                                 before_commit=before_commit))
 
 # -------- LIST --------
 @router.get("",
-            response_model=list[schemas.LoanOut])
-def list_loans(status: str = "all",
+            response_model=list[schemas.LoanExpandedOut])
+@run_on_event_loop
+def list_loans(request: Request,
+               response: Response,
+               status: schemas.LoanStatus = "all",
                skip: int = 0,
                limit: int = 20,
-               db: Session = Depends(get_db)):
+               after: str | None = None,
+               expand: str | None = None,
+               db: Session = Depends(get_read_db)):
     skip, limit = clamp_pagination(skip, limit)
+    try:
+        after_key = decode_loan_cursor(after) if after else None
+    except ValueError:
+        raise HTTPException(status_code=400,
+                            detail="Invalid cursor")
+    try:
+        expand = parse_expand(expand,
+                              schemas.LOAN_EXPANDS)
+    except ValueError as exc:
+        raise HTTPException(status_code=400,
+                            detail=str(exc))
     loans = crud.list_loans(db,
                             skip,
-                            limit)
-
-    if status == "all":
-        return loans
-
-    now = datetime.now(timezone.utc)
-    if status == "active":
-        return [l for l in loans if l.return_date is None]
-    if status == "overdue":
-        return [l for l in loans if l.return_date is None and l.due_date < now]
-
-    return loans
+                            limit,
+                            after=after_key,
+                            status=status,
+                            expand=expand)
+    not_modified = conditional(request,
+                               response,
+                               rows_etag("loans", loans, expand))
+    if not_modified:
+        return not_modified
+    if len(loans) == limit:
+        response.headers["X-Next-Cursor"] = encode_cursor(loans[-1].loan_date,
+                                                          loans[-1].id)
+    return json_response(expand_rows(loans,
+                                     schemas.LoanOut,
+                                     {name: schemas.LOAN_EXPANDS[name] for name in expand}),
+                         response)
 
 # -------- EXPORT --------
-@router.get("/export/csv")
-def export_loans_csv(db: Session = Depends(get_db)):
-    loans = crud.list_loans(db,
-                            skip=0,
-                            limit=1000)
+EXPORT_COLUMNS = ["loan_id",
+                  "user_id",
+                  "book_id",
+                  "loan_date",
+                  "due_date",
+                  "return_date",
+                  "fine_amount"]
 
+def _csv_chunks(status: str,
+                user_id: int | None,
+                date_from: datetime | None,
+                date_to: datetime | None) -> Iterator[bytes]:
     buffer = StringIO()
     writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    yield buffer.getvalue().encode()
 
-    writer.writerow([
-        "loan_id",
-        "user_id",
-        "book_id",
-        "loan_date",
-        "due_date",
-        "return_date",
-        "fine_amount",
-    ])
+    with ReadSessionLocal() as db:
+        for rows in crud.iter_loan_rows(db,
+                                        status=status,
+                                        user_id=user_id,
+                                        date_from=date_from,
+                                        date_to=date_to,
+                                        batch_size=EXPORT_BATCH_SIZE):
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerows(
+                (loan_id,
+                 loan_user_id,
+                 book_id,
+                 loan_date.isoformat(),
+                 due_date.isoformat(),
+                 return_date.isoformat() if return_date else "",
+                 fine_amount)
+                for loan_id, loan_user_id, book_id, loan_date, due_date, return_date, fine_amount in rows
+            )
+            yield buffer.getvalue().encode()
 
-    for loan in loans:
-        writer.writerow([
-            loan.id,
-            loan.user_id,
-            loan.book_id,
-            loan.loan_date.isoformat(),
-            loan.due_date.isoformat(),
-            loan.return_date.isoformat() if loan.return_date else "",
-            loan.fine_amount,
-        ])
+def _gzip_chunks(chunks: Iterator[bytes]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
 
-    buffer.seek(0)
+@router.get("/export/csv")
+def export_loans_csv(status: schemas.LoanStatus = "all",
+                     user_id: int | None = None,
+                     date_from: datetime | None = None,
+                     date_to: datetime | None = None,
+                     gzip: bool = False):
+    chunks = _csv_chunks(status,
+                         user_id,
+                         to_utc_naive(date_from),
+                         to_utc_naive(date_to))
+    headers = {"Content-Disposition": "attachment; filename=loans.csv"}
+    if gzip:
+        chunks = _gzip_chunks(chunks)
+        headers["Content-Encoding"] = "gzip"
 
     return StreamingResponse(
-        buffer,
+        chunks,
         media_type="text/csv",
-        headers={"Content-Disposition": "attachment; filename=loans.csv"},
+        headers=headers,
     )
-
@@ -0,0 +1,123 @@
+from datetime import date, datetime, timedelta, timezone
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+import logging
+
+from ..database import get_read_db, run_on_event_loop
+from .. import schemas, crud
+
+logger = logging.getLogger("library.api")
+
+router = APIRouter(prefix="/stats",
+                   tags=["stats"])
+
+DEFAULT_DAYS = 30
+DEFAULT_MONTHS = 12
+MAX_DAYS = 3660
+
+# -------- RANGE --------
+def date_range(date_from: date | None,
+               date_to: date | None,
+               default_from) -> tuple[date, date]:
+    # inclusive UTC days; reports read one rollup row per day, so the span is capped
+    date_to = date_to or datetime.now(timezone.utc).date()
+    date_from = date_from or default_from(date_to)
+    if date_from > date_to:
+        raise HTTPException(status_code=400,
+                            detail="date_from must not be after date_to")
+    if (date_to - date_from).days >= MAX_DAYS:
+        raise HTTPException(status_code=400,
+                            detail=f"Date range is limited to {MAX_DAYS} days")
+    return date_from, date_to
+
+def last_days(date_to: date) -> date:
+    return date_to - timedelta(days=DEFAULT_DAYS - 1)
+
+def last_months(date_to: date) -> date:
+    month = date_to.year * 12 + date_to.month - DEFAULT_MONTHS
+    return date(month // 12, month % 12 + 1, 1)
+
+def rate(part: int,
+         whole: int) -> float:
+    return round(part / whole, 4) if whole else 0.0
+
+# -------- TOP BOOKS --------
+@router.get("/top-books",
+            response_model=list[schemas.TopBookOut])
+@run_on_event_loop
+def top_books(date_from: date | None = None,
+              date_to: date | None = None,
+              limit: int = Query(default=10, ge=1, le=100),
+              db: Session = Depends(get_read_db)):
+    date_from, date_to = date_range(date_from,
+                                    date_to,
+                                    last_days)
+    return crud.top_borrowed_books(db,
+                                   date_from,
+                                   date_to,
+                                   limit)
+
+# -------- DAILY --------
+@router.get("/loans-per-day",
+            response_model=list[schemas.DailyStatsOut])
+@run_on_event_loop
+def loans_per_day(date_from: date | None = None,
+                  date_to: date | None = None,
+                  db: Session = Depends(get_read_db)):
+    date_from, date_to = date_range(date_from,
+                                    date_to,
+                                    last_days)
+    rows = {row.day: row for row in crud.get_daily_stats(db,
+                                                         date_from,
+                                                         date_to)}
+    # days without activity have no rollup row; report them as zeros
+    days = []
+    for offset in range((date_to - date_from).days + 1):
+        day = date_from + timedelta(days=offset)
+        row = rows.get(day)
+        days.append({"day": day,
+                     "loans": row.loans if row else 0,
+                     "returns": row.returns if row else 0,
+                     "late_returns": row.late_returns if row else 0,
+                     "fines": row.fines if row else 0})
+    return days
+
+# -------- MONTHLY --------
+@router.get("/monthly",
+            response_model=list[schemas.MonthlyStatsOut])
+@run_on_event_loop
+def monthly(date_from: date | None = None,
+            date_to: date | None = None,
+            db: Session = Depends(get_read_db)):
+    date_from, date_to = date_range(date_from,
+                                    date_to,
+                                    last_months)
+    months = {}
+    for row in crud.get_daily_stats(db,
+                                    date_from,
+                                    date_to):
+        month = months.setdefault(row.day.strftime("%Y-%m"),
+                                  {"loans": 0, "returns": 0, "late_returns": 0, "fines": 0})
+        month["loans"] += row.loans
+        month["returns"] += row.returns
+        month["late_returns"] += row.late_returns
+        month["fines"] += row.fines
+    return [{"month": name,
+             **counts,
+             "overdue_rate": rate(counts["late_returns"],
+                                  counts["returns"])}
+            for name, counts in months.items()]
+
+# -------- OVERDUE --------
+@router.get("/overdue",
+            response_model=schemas.OverdueOut)
+@run_on_event_loop
+def overdue(db: Session = Depends(get_read_db)):
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    active, overdue_loans = crud.count_open_loans(db,
+                                                  now)
+    return {"as_of": now,
+            "active_loans": active,
+            "overdue_loans": overdue_loans,
+            "overdue_rate": rate(overdue_loans,
+                                 active)}
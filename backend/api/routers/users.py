@@ -1,10 +1,11 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
 from sqlalchemy.orm import Session
 import logging
 
-from ..database import get_db
-from .. import schemas, crud
-from ..utils import clamp_pagination
+from ..database import get_db, get_read_db, run_on_event_loop
+from .. import schemas, crud, bulk, cache
+from ..utils import clamp_pagination, encode_cursor, decode_id_cursor, expand_rows, json_response, order_by_ids, parse_expand, parse_ids, schema_rows
+from ..http_cache import conditional, make_etag, rows_etag
 
 logger = logging.getLogger("library.api")
 
@@ -15,6 +16,7 @@ router = APIRouter(prefix="/users",
 @router.post("",
              response_model=schemas.UserOut,
              status_code=201)
+@run_on_event_loop
 def create_user(payload: schemas.UserCreate,
                 db: Session = Depends(get_db)):
     if crud.get_user_by_email(db,
@@ -30,33 +32,150 @@ def create_user(payload: schemas.UserCreate,
                 user.email)
     return user
 
+# -------- BULK CREATE --------
+@router.post("/bulk",
+             response_model=schemas.BulkResult)
+async def create_users_bulk(request: Request,
+                            response: Response,
+                            db: Session = Depends(get_db)):
+    result = await bulk.import_records(request,
+                                       db,
+                                       schemas.UserCreate,
+                                       bulk.insert_users)
+    logger.info("users_imported created=%s duplicates=%s invalid=%s",
+                result["created"],
+                result["duplicates"],
+                result["invalid"])
+    # one result per row, built here: skip response_model validation
+    return json_response(result,
+                         response)
+
 # -------- LIST --------
 @router.get("",
             response_model=list[schemas.UserOut])
-def list_users(skip: int = 0,
+@run_on_event_loop
+def list_users(request: Request,
+               response: Response,
+               skip: int = 0,
                limit: int = 20,
-               db: Session = Depends(get_db)):
+               after: str | None = None,
+               ids: str | None = None,
+               db: Session = Depends(get_read_db)):
+    if ids is not None:
+        return users_by_ids(request,
+                            response,
+                            ids,
+                            db)
     skip, limit = clamp_pagination(skip,
                                    limit)
-    return crud.list_users(db,
-                           skip,
-                           limit)
+    try:
+        after_id = decode_id_cursor(after) if after else None
+    except ValueError:
+        raise HTTPException(status_code=400,
+                            detail="Invalid cursor")
+    users = crud.list_users(db,
+                            skip,
+                            limit,
+                            after_id=after_id)
+    not_modified = conditional(request,
+                               response,
+                               rows_etag("users", users))
+    if not_modified:
+        return not_modified
+    if len(users) == limit:
+        response.headers["X-Next-Cursor"] = encode_cursor(users[-1].id)
+    return json_response(schema_rows(users,
+                                     schemas.UserOut),
+                         response)
+
+# -------- MULTI-GET --------
+def users_by_ids(request: Request,
+                 response: Response,
+                 ids: str,
+                 db: Session):
+    # GET /users?ids=3,1,2: one IN query, items in request order, pagination ignored
+    try:
+        user_ids = parse_ids(ids,
+                             schemas.MAX_QUERY_IDS)
+    except ValueError as exc:
+        raise HTTPException(status_code=400,
+                            detail=str(exc))
+    users, missing = order_by_ids(crud.get_users_by_ids(db,
+                                                        user_ids),
+                                  user_ids)
+    not_modified = conditional(request,
+                               response,
+                               rows_etag("users", users))
+    if not_modified:
+        return not_modified
+    if missing:
+        response.headers["X-Missing-Ids"] = ",".join(map(str, missing))
+    return json_response(schema_rows(users,
+                                     schemas.UserOut),
+                         response)
+
+@router.post("/lookup",
+             response_model=schemas.UserLookupOut)
+@run_on_event_loop
+def lookup_users(payload: schemas.IdsLookup,
+                 response: Response,
+                 db: Session = Depends(get_read_db)):
+    user_ids = list(dict.fromkeys(payload.ids))
+    users, missing = order_by_ids(crud.get_users_by_ids(db,
+                                                        user_ids),
+                                  user_ids)
+    return json_response({"items": schema_rows(users,
+                                               schemas.UserOut),
+                          "missing": missing},
+                         response)
 
 # -------- GET INFO --------
 @router.get("/{user_id}",
             response_model=schemas.UserOut)
+@run_on_event_loop
 def get_user(user_id: int,
-             db: Session = Depends(get_db)):
-    user = crud.get_user(db,
-                         user_id)
+             request: Request,
+             response: Response,
+             db: Session = Depends(get_read_db)):
+    user = cache.cached_user(db,
+                             user_id)
     if not user:
         raise HTTPException(status_code=404,
                             detail="User not found")
+    not_modified = conditional(request,
+                               response,
+                               make_etag("user", user["id"], user["version"]))
+    if not_modified:
+        return not_modified
     return user
 
+# -------- SUMMARY --------
+@router.get("/{user_id}/summary",
+            response_model=schemas.UserSummary)
+@run_on_event_loop
+def user_summary(user_id: int,
+                 request: Request,
+                 response: Response,
+                 db: Session = Depends(get_read_db)):
+    user = cache.cached_user(db,
+                             user_id)
+    if not user:
+        raise HTTPException(status_code=404,
+                            detail="User not found")
+    not_modified = conditional(request,
+                               response,
+                               make_etag("user_summary", user["id"], user["version"]))
+    if not_modified:
+        return not_modified
+    return {"user_id": user["id"],
+            "active_loans": user["active_loans"],
+            "total_loans": user["total_loans"],
+            "outstanding_fines": user["outstanding_fines"]}
+
 # -------- UPDATE --------
 @router.put("/{user_id}",
             response_model=schemas.UserOut)
+@run_on_event_loop
 def update_user(user_id: int,
                 payload: schemas.UserUpdate,
                 db: Session = Depends(get_db)):
@@ -80,14 +199,34 @@ def update_user(user_id: int,
 
 # -------- LIST USER LOANS --------
 @router.get("/{user_id}/loans",
-            response_model=list[schemas.LoanOut])
+            response_model=list[schemas.LoanExpandedOut])
+@run_on_event_loop
 def user_loans(user_id: int,
+               request: Request,
+               response: Response,
                active_only: bool | None = None,
-               db: Session = Depends(get_db)):
-    if not crud.get_user(db,
-                         user_id):
+               expand: str | None = None,
+               db: Session = Depends(get_read_db)):
+    try:
+        expand = parse_expand(expand,
+                              schemas.LOAN_EXPANDS)
+    except ValueError as exc:
+        raise HTTPException(status_code=400,
+                            detail=str(exc))
+    if not cache.cached_user(db,
+                             user_id):
         raise HTTPException(status_code=404,
                             detail="User not found")
-    return crud.list_user_loans(db,
-                                user_id=user_id,
-                                active_only=active_only)
+    loans = crud.list_user_loans(db,
+                                 user_id=user_id,
+                                 active_only=active_only,
+                                 expand=expand)
+    not_modified = conditional(request,
+                               response,
+                               rows_etag("user_loans", loans, expand))
+    if not_modified:
+        return not_modified
+    return json_response(expand_rows(loans,
+                                     schemas.LoanOut,
+                                     {name: schemas.LOAN_EXPANDS[name] for name in expand}),
+                         response)
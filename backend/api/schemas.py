@@ -1,18 +1,49 @@
-from datetime import datetime
-from pydantic import BaseModel, EmailStr, Field
-from typing import Optional
+from datetime import date, datetime
+from pydantic import AfterValidator, BaseModel, Field, WithJsonSchema
+from pydantic.networks import validate_email
+from pydantic_core import PydanticCustomError
+from typing import Annotated, Literal
+import functools
+import re
+
+# -------- EMAIL --------
+# EmailStr runs email_validator's IDNA checks on the domain of every address,
+# which is most of the cost of a bulk user import. Plain dot-atom addresses
+# check each distinct domain once; anything else goes through EmailStr's
+# validation unchanged.
+DOT_ATOM = re.compile(r"[A-Za-z0-9!#$%&'*+/=?^_`{|}~-]+(?:\.[A-Za-z0-9!#$%&'*+/=?^_`{|}~-]+)*")
+
+@functools.lru_cache(maxsize=4096)
+def _normalized_domain(domain: str) -> str | None:
+    try:
+        return validate_email(f"a@{domain}")[1].rpartition("@")[2]
+    except PydanticCustomError:
+        return None
+
+def check_email(value: str) -> str:
+    local, at, domain = value.strip().rpartition("@")
+    if at and len(local) <= 64 and DOT_ATOM.fullmatch(local):
+        domain = _normalized_domain(domain)
+        if domain is not None and len(local) + len(domain) < 254:
+            return f"{local}@{domain}"
+    # invalid or unusual: the full validator decides, with its own message
+    return validate_email(value)[1]
+
+Email = Annotated[str,
+                  AfterValidator(check_email),
+                  WithJsonSchema({"type": "string", "format": "email"})]
 
 # -------- USERS --------
 class UserCreate(BaseModel):
     name: str = Field(min_length=1,
                       max_length=120)
-    email: EmailStr
+    email: Email
 
 class UserUpdate(BaseModel):
     name: str | None = Field(default=None,
                              min_length=1,
                              max_length=120)
-    email: EmailStr | None = None
+    email: Email | None = None
 
 class UserOut(BaseModel):
     id: int
@@ -22,6 +53,11 @@ class UserOut(BaseModel):
 
     model_config = {"from_attributes": True}
 
+class UserSummary(BaseModel):
+    user_id: int
+    active_loans: int
+    total_loans: int
+    outstanding_fines: int
 
 # -------- BOOKS --------
 class BookCreate(BaseModel):
@@ -51,8 +87,15 @@ class BookOut(BaseModel):
 
     model_config = {"from_attributes": True}
 
+class AvailabilityOut(BaseModel):
+    book_id: int
+    available_copies: int
+    total_copies: int
+
 
 # -------- LOANS --------
+LoanStatus = Literal["all", "active", "overdue", "returned"]
+
 class LoanCreate(BaseModel):
     user_id: int
     book_id: int
@@ -67,3 +110,91 @@ class LoanOut(BaseModel):
     fine_amount: int
 
     model_config = {"from_attributes": True}
+
+class LoanExpandedOut(LoanOut):
+    book: BookOut | None = None
+    user: UserOut | None = None
+
+LOAN_EXPANDS = {"book": BookOut,
+                "user": UserOut}
+
+
+# -------- HOLDS --------
+HoldStatus = Literal["waiting", "ready", "fulfilled", "cancelled", "expired"]
+
+class HoldCreate(BaseModel):
+    user_id: int
+
+class HoldOut(BaseModel):
+    id: int
+    user_id: int
+    book_id: int
+    priority: int
+    status: HoldStatus
+    created_at: datetime
+    ready_at: datetime | None
+    expires_at: datetime | None
+
+    model_config = {"from_attributes": True}
+
+# -------- LOOKUP --------
+# ids per GET ?ids=1,2,3 (kept to a URL length proxies accept) and per POST body
+MAX_QUERY_IDS = 200
+MAX_LOOKUP_IDS = 1000
+
+class IdsLookup(BaseModel):
+    ids: list[int] = Field(min_length=1,
+                           max_length=MAX_LOOKUP_IDS)
+
+class BookLookupOut(BaseModel):
+    items: list[BookOut]
+    missing: list[int]
+
+class UserLookupOut(BaseModel):
+    items: list[UserOut]
+    missing: list[int]
+
+class AvailabilityLookupOut(BaseModel):
+    items: list[AvailabilityOut]
+    missing: list[int]
+
+# -------- BULK --------
+class BulkRowResult(BaseModel):
+    row: int
+    status: Literal["created", "duplicate", "invalid"]
+    id: int | None = None
+    error: str | None = None
+
+class BulkResult(BaseModel):
+    created: int
+    duplicates: int
+    invalid: int
+    results: list[BulkRowResult]
+
+# -------- STATS --------
+class DailyStatsOut(BaseModel):
+    day: date
+    loans: int
+    returns: int
+    late_returns: int
+    fines: int
+
+class MonthlyStatsOut(BaseModel):
+    month: str
+    loans: int
+    returns: int
+    late_returns: int
+    overdue_rate: float
+    fines: int
+
+class TopBookOut(BaseModel):
+    book_id: int
+    title: str
+    author: str
+    loans: int
+
+class OverdueOut(BaseModel):
+    as_of: datetime
+    active_loans: int
+    overdue_loans: int
+    overdue_rate: float
@@ -0,0 +1,92 @@
+from sqlalchemy import func, literal_column
+from sqlalchemy.engine import Connection
+import re
+
+# -------- FTS5 --------
+# External-content FTS5 index over books(title, author). Triggers keep it in
+# sync with every write path (ORM, raw SQL), except bulk imports, which index
+# each batch in one statement (index_books_in_bulk). The update trigger only
+# fires on title/author, so borrow/return copy counters never touch it.
+FTS_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+        title,
+        author,
+        content='books',
+        content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS books_fts_ai AFTER INSERT ON books BEGIN
+        INSERT INTO books_fts(rowid, title, author) VALUES (new.id, new.title, new.author);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS books_fts_ad AFTER DELETE ON books BEGIN
+        INSERT INTO books_fts(books_fts, rowid, title, author) VALUES ('delete', old.id, old.title, old.author);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS books_fts_au AFTER UPDATE OF title, author ON books BEGIN
+        INSERT INTO books_fts(books_fts, rowid, title, author) VALUES ('delete', old.id, old.title, old.author);
+        INSERT INTO books_fts(rowid, title, author) VALUES (new.id, new.title, new.author);
+    END""",
+]
+
+# Migration 5 guards books_fts_ai with "WHEN NOT EXISTS (SELECT 1 FROM
+# books_fts_bulk_load)": one index insert per row brings an executemany of 50k
+# books from ~450k to ~17k rows/s, one INSERT ... SELECT per batch does not.
+PAUSE_ROW_INDEXING = "INSERT INTO books_fts_bulk_load DEFAULT VALUES"
+RESUME_ROW_INDEXING = "DELETE FROM books_fts_bulk_load"
+INDEX_BOOKS_FROM = """INSERT INTO books_fts(rowid, title, author)
+    SELECT id, title, author FROM books WHERE id >= :first_id"""
+
+TITLE_WEIGHT = 2.0
+AUTHOR_WEIGHT = 1.0
+
+# -------- POSTGRES --------
+# Same search on PostgreSQL: a weighted tsvector over title (A) and author (B)
+# with a GIN expression index. The expression must match search_document()
+# exactly for the planner to use the index. ts_rank's default weights put A at
+# 2.5x B, close to TITLE_WEIGHT / AUTHOR_WEIGHT.
+POSTGRES_DDL = [
+    """CREATE INDEX IF NOT EXISTS ix_books_search ON books USING gin (
+        (setweight(to_tsvector('simple', title), 'A') || setweight(to_tsvector('simple', author), 'B'))
+    )""",
+]
+
+def search_document(title, author):
+    return func.setweight(func.to_tsvector(literal_column("'simple'"), title),
+                          literal_column("'A'")).op("||")(
+        func.setweight(func.to_tsvector(literal_column("'simple'"), author),
+                       literal_column("'B'")))
+
+def install_fts(conn: Connection) -> None:
+    # runs inside the caller's migration transaction
+    if conn.dialect.name == "postgresql":
+        for ddl in POSTGRES_DDL:
+            conn.exec_driver_sql(ddl)
+        return
+    if conn.dialect.name != "sqlite":
+        return
+    exists = conn.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'books_fts'"
+    ).first()
+    for ddl in FTS_DDL:
+        conn.exec_driver_sql(ddl)
+    if not exists:
+        # index the rows that were already in the catalog
+        conn.exec_driver_sql("INSERT INTO books_fts(books_fts) VALUES ('rebuild')")
+
+def build_match_query(q: str,
+                      dialect: str = "sqlite") -> str | None:
+    # Every word must match; the last one also as a prefix so search-as-you-type
+    # works: "harry pot" -> "harry" "pot"*. One-letter prefixes would expand to a
+    # large part of the vocabulary, so they only match whole words.
+    words = re.findall(r"\w+", q)
+    if not words:
+        return None
+    if dialect == "postgresql":
+        terms = [f"'{word}'" for word in words]
+        if len(words[-1]) >= 2:
+            terms[-1] += ":*"
+        return " & ".join(terms)
+    terms = [f'"{word}"' for word in words]
+    if len(words[-1]) >= 2:
+        terms[-1] += "*"
+    return " ".join(terms)
@@ -1,9 +1,11 @@
 from datetime import datetime, timedelta, timezone
+from typing import Callable
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from fastapi import HTTPException, status
 import logging
 
-from . import crud, models
+from . import crud, models, cache
 from .utils import days_overdue
 
 logger = logging.getLogger("library.services")
@@ -11,40 +13,68 @@ logger = logging.getLogger("library.services")
 LOAN_DAYS = 14
 FINE_PER_DAY = 2
 MAX_ACTIVE_LOANS = 3
+HOLD_PICKUP_DAYS = 3
+MAX_OPEN_HOLDS = 5
 
 # -------- BORROW --------
 def borrow_book(db: Session,
                 user_id: int,
-                book_id: int) -> models.Loan:
-    user = crud.get_user(db,
-                         user_id)
-    if not user:
-        raise HTTPException(status_code=404,
-                            detail="User not found")
-
-    book = crud.get_book(db,
-                         book_id)
-    if not book:
-        raise HTTPException(status_code=404,
-                            detail="Book not found")
+                book_id: int,
+                before_commit: Callable[[Session, models.Loan], None] | None = None) -> models.Loan:
+    crud.begin_write(db)
+    now = datetime.now(timezone.utc)
 
-    if book.available_copies <= 0:
+    # a copy set aside for this user's ready hold is already off the shelf
+    if not crud.fulfill_ready_hold(db,
+                                   user_id,
+                                   book_id,
+                                   now) and not crud.reserve_copy(db,
+                                                                  book_id):
+        db.rollback()
+        if not crud.get_user(db,
+                             user_id):
+            raise HTTPException(status_code=404,
+                                detail="User not found")
+        if not crud.get_book(db,
+                             book_id):
+            raise HTTPException(status_code=404,
+                                detail="Book not found")
         raise HTTPException(status_code=409,
                             detail="No available copies")
 
-    active_count = crud.count_active_loans_for_user(db,
-                                                    user_id)
-    if active_count >= MAX_ACTIVE_LOANS:
+    if not crud.claim_loan_slot(db,
+                                user_id,
+                                MAX_ACTIVE_LOANS):
+        db.rollback()
+        if not crud.get_user(db,
+                             user_id):
+            raise HTTPException(status_code=404,
+                                detail="User not found")
         raise HTTPException(status_code=409,
                             detail="User reached max active loans")
 
-    due_date = datetime.now(timezone.utc) + timedelta(days=LOAN_DAYS) 
+    # borrowed without waiting for their turn: leave the queue
+    crud.fulfill_waiting_hold(db,
+                              user_id,
+                              book_id)
+    due_date = now + timedelta(days=LOAN_DAYS)
 
-    book.available_copies -= 1
     loan = crud.create_loan(db,
                             user_id=user_id,
                             book_id=book_id,
+                            loan_date=now,
                             due_date=due_date)
+    crud.record_loan_event(db,
+                           book_id,
+                           now.date(),
+                           loans=1)
+    if before_commit:
+        before_commit(db,
+                      loan)
+
+    db.commit()
+    cache.invalidate_book(book_id)
+    cache.invalidate_user(user_id)
     
     logger.info(
         "loan_created loan_id=%s user_id=%s book_id=%s due_date=%s",
@@ -58,33 +88,57 @@ def borrow_book(db: Session,
 
 # -------- RETURN --------
 def return_loan(db: Session,
-                loan_id: int) -> models.Loan:
+                loan_id: int,
+                before_commit: Callable[[Session, models.Loan], None] | None = None) -> models.Loan:
+    crud.begin_write(db)
+
     loan = crud.get_loan(db,
-                         loan_id)
+                         loan_id,
+                         for_update=True)
     if not loan:
+        db.rollback()
         raise HTTPException(status_code=404,
                             detail="Loan not found")
     if loan.return_date is not None:
+        db.rollback()
         raise HTTPException(status_code=status.HTTP_409_CONFLICT,
                             detail="Loan already returned")
 
-    book = crud.get_book(db,
-                         loan.book_id)
-    if not book:
-        raise HTTPException(status_code=404,
-                            detail="Book not found")
-
     now = datetime.now(timezone.utc)
     overdue_days = days_overdue(loan.due_date,
                                 now)
-    loan.return_date = now
-    loan.fine_amount = overdue_days * FINE_PER_DAY
+    fine_amount = overdue_days * FINE_PER_DAY
 
-    book.available_copies = min(book.available_copies + 1,
-                                book.total_copies)
+    if not crud.mark_loan_returned(db,
+                                   loan_id,
+                                   return_date=now,
+                                   fine_amount=fine_amount):
+        db.rollback()
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                            detail="Loan already returned")
+    hold = pass_copy_on(db,
+                        loan.book_id,
+                        now)
+    if not crud.release_loan_slot(db,
+                                  loan.user_id,
+                                  fine_amount):
+        logger.warning("loan_counter_drift user_id=%s loan_id=%s active_loans=0",
+                       loan.user_id,
+                       loan_id)
+    crud.record_loan_event(db,
+                           loan.book_id,
+                           now.date(),
+                           returns=1,
+                           late_returns=int(overdue_days > 0),
+                           fines=fine_amount)
+    db.refresh(loan)
+    if before_commit:
+        before_commit(db,
+                      loan)
 
     db.commit()
-    db.refresh(loan)
+    cache.invalidate_book(loan.book_id)
+    cache.invalidate_user(loan.user_id)
     
     logger.info(
         "loan_returned loan_id=%s user_id=%s book_id=%s fine=%s overdue_days=%s",
@@ -94,5 +148,147 @@ def return_loan(db: Session,
         loan.fine_amount,
         overdue_days
         )
+    if hold:
+        log_hold_ready(hold)
 
     return loan
+
+# -------- BOOKS --------
+def update_book(db: Session,
+                book_id: int,
+                title: str | None,
+                author: str | None,
+                total_copies: int | None) -> models.Book:
+    crud.begin_write(db)
+
+    # row lock: the copy counts are recomputed from the current row
+    book = crud.get_book_for_update(db,
+                                    book_id)
+    if not book:
+        db.rollback()
+        raise HTTPException(status_code=404,
+                            detail="Book not found")
+    added = crud.update_book(db,
+                             book,
+                             title,
+                             author,
+                             total_copies)
+    # new copies serve the hold queue before the shelf, like returned ones
+    now = datetime.now(timezone.utc)
+    holds = [pass_copy_on(db,
+                          book_id,
+                          now) for _ in range(added)]
+    db.commit()
+    cache.invalidate_book(book_id)
+    db.refresh(book)
+
+    for hold in holds:
+        if hold:
+            log_hold_ready(hold)
+    return book
+
+# -------- HOLDS --------
+def pass_copy_on(db: Session,
+                 book_id: int,
+                 now: datetime) -> models.Hold | None:
+    # a copy coming back goes to the first holder in the book's queue who can
+    # borrow it, or back on the shelf when there is none
+    hold = crud.allocate_next_hold(db,
+                                   book_id,
+                                   now,
+                                   expires_at=now + timedelta(days=HOLD_PICKUP_DAYS),
+                                   max_active_loans=MAX_ACTIVE_LOANS)
+    if hold is None:
+        crud.release_copy(db,
+                          book_id)
+    return hold
+
+def log_hold_ready(hold: models.Hold) -> None:
+    logger.info("hold_ready hold_id=%s user_id=%s book_id=%s expires_at=%s",
+                hold.id,
+                hold.user_id,
+                hold.book_id,
+                hold.expires_at.isoformat())
+
+def place_hold(db: Session,
+               user_id: int,
+               book_id: int) -> models.Hold:
+    crud.begin_write(db)
+
+    # row lock so a concurrent return cannot shelve a copy between the
+    # availability check and the insert
+    book = crud.get_book_for_update(db,
+                                    book_id)
+    if not book:
+        db.rollback()
+        raise HTTPException(status_code=404,
+                            detail="Book not found")
+    if not crud.get_user(db,
+                         user_id):
+        db.rollback()
+        raise HTTPException(status_code=404,
+                            detail="User not found")
+    if book.available_copies > 0:
+        db.rollback()
+        raise HTTPException(status_code=409,
+                            detail="Book has available copies")
+    if crud.count_open_holds(db,
+                             user_id) >= MAX_OPEN_HOLDS:
+        db.rollback()
+        raise HTTPException(status_code=409,
+                            detail="User reached max open holds")
+
+    try:
+        hold = crud.create_hold(db,
+                                user_id,
+                                book_id,
+                                datetime.now(timezone.utc))
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=409,
+                            detail="User already holds this book")
+    db.commit()
+
+    logger.info("hold_placed hold_id=%s user_id=%s book_id=%s",
+                hold.id,
+                user_id,
+                book_id)
+    return hold
+
+def cancel_hold(db: Session,
+                book_id: int,
+                hold_id: int) -> models.Hold:
+    crud.begin_write(db)
+
+    hold = crud.get_hold(db,
+                         hold_id,
+                         for_update=True)
+    if not hold or hold.book_id != book_id:
+        db.rollback()
+        raise HTTPException(status_code=404,
+                            detail="Hold not found")
+    previous = crud.close_hold(db,
+                               hold_id,
+                               "cancelled")
+    if previous is None:
+        db.rollback()
+        raise HTTPException(status_code=409,
+                            detail="Hold is no longer open")
+
+    now = datetime.now(timezone.utc)
+    next_hold = pass_copy_on(db,
+                             book_id,
+                             now) if previous == "ready" else None
+    db.refresh(hold)
+    db.commit()
+    if previous == "ready":
+        cache.invalidate_book(book_id)
+
+    logger.info("hold_cancelled hold_id=%s user_id=%s book_id=%s was=%s",
+                hold.id,
+                hold.user_id,
+                book_id,
+                previous)
+    if next_hold:
+        log_hold_ready(next_hold)
+    return hold
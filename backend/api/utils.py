@@ -1,4 +1,8 @@
-from datetime import datetime
+from datetime import datetime, timezone
+from fastapi import Response
+from fastapi.responses import ORJSONResponse
+import base64
+import json
 
 # -------- VIEW --------
 def clamp_pagination(skip: int,
@@ -7,6 +11,100 @@ def clamp_pagination(skip: int,
     limit = min(max(limit, 1), 100)
     return skip, limit
 
+def encode_cursor(*values) -> str:
+    raw = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values],
+                     separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> list:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except ValueError:
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list) or not values:
+        raise ValueError("Invalid cursor")
+    return values
+
+def decode_id_cursor(cursor: str) -> int:
+    values = decode_cursor(cursor)
+    if len(values) != 1 or not isinstance(values[0], int):
+        raise ValueError("Invalid cursor")
+    return values[0]
+
+def decode_loan_cursor(cursor: str) -> tuple[datetime, int]:
+    values = decode_cursor(cursor)
+    if len(values) != 2 or not isinstance(values[0], str) or not isinstance(values[1], int):
+        raise ValueError("Invalid cursor")
+    return datetime.fromisoformat(values[0]), values[1]
+
+def decode_search_cursor(cursor: str) -> tuple[float, int]:
+    values = decode_cursor(cursor)
+    if len(values) != 2 or not isinstance(values[0], (int, float)) or not isinstance(values[1], int):
+        raise ValueError("Invalid cursor")
+    return float(values[0]), values[1]
+
+def parse_expand(value: str | None,
+                 allowed) -> tuple[str, ...]:
+    names = {name.strip() for name in (value or "").split(",") if name.strip()}
+    unknown = names - set(allowed)
+    if unknown:
+        raise ValueError(f"Cannot expand: {', '.join(sorted(unknown))}")
+    return tuple(sorted(names))
+
+def parse_ids(value: str,
+              limit: int) -> list[int]:
+    # "3,1,3" -> [3, 1]: request order, duplicates dropped
+    try:
+        ids = list(dict.fromkeys(int(part) for part in value.split(",") if part.strip()))
+    except ValueError:
+        raise ValueError("ids must be comma-separated integers")
+    if not ids:
+        raise ValueError("ids must not be empty")
+    if len(ids) > limit:
+        raise ValueError(f"At most {limit} ids per request")
+    return ids
+
+def order_by_ids(rows,
+                 ids: list[int],
+                 key: str = "id") -> tuple[list, list[int]]:
+    # rows of an IN (...) query back in request order, plus the ids not found
+    found = {getattr(row, key): row for row in rows}
+    return [found[i] for i in ids if i in found], [i for i in ids if i not in found]
+
+def expand_rows(rows,
+                schema,
+                expand: dict) -> list[dict]:
+    # builds plain dicts so relations are only touched when asked for (and
+    # eager-loaded); reading them off the ORM object would lazy-load per row
+    fields = list(schema.model_fields)
+    items = []
+    for row in rows:
+        item = {name: getattr(row, name) for name in fields}
+        for name, nested in expand.items():
+            related = getattr(row, name)
+            item[name] = {field: getattr(related, field) for field in nested.model_fields}
+        items.append(item)
+    return items
+
+def schema_rows(rows,
+                schema) -> list[dict]:
+    # rows come from crud.*_COLUMNS; extra trailing columns (version) are dropped
+    fields = list(schema.model_fields)
+    return [dict(zip(fields, row)) for row in rows]
+
+def json_response(content,
+                  response: Response) -> ORJSONResponse:
+    # DB rows are already trusted, so skip response_model validation and keep
+    # the headers set on the injected response (ETag, X-Next-Cursor)
+    return ORJSONResponse(content,
+                          headers=dict(response.headers))
+
+def to_utc_naive(value: datetime | None) -> datetime | None:
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
 # -------- FINE --------
 def days_overdue(due_date: datetime,
                  returned_at: datetime) -> int:
@@ -0,0 +1,101 @@
+"""Availability stream fan-out: hold many idle SSE connections open on one event
+loop, publish changes for a book they all watch, and time delivery to every stream.
+
+Run from backend/:  python -m benchmarks.availability_stream --streams 5000 --changes 20
+
+Streams are driven as in-process ASGI calls (no sockets), against the books in
+data/library.db. Changes are published from a worker thread, as a threadpool
+request would after commit.
+"""
+import argparse
+import asyncio
+import logging
+import resource
+import time
+
+from api import events
+from api.main import api
+from .common import percentile, report, summarize
+
+class Stream:
+    def __init__(self, book_ids: str):
+        self.scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+                      "method": "GET", "scheme": "http", "path": "/books/availability/stream",
+                      "raw_path": b"/books/availability/stream", "root_path": "",
+                      "query_string": f"ids={book_ids}".encode(), "headers": [],
+                      "client": ("127.0.0.1", 0), "server": ("bench", 80)}
+        self.closed = asyncio.Event()
+        self.ready = asyncio.Event()
+        self.received: list[float] = []
+        self.expected = 0
+
+    async def receive(self):
+        await self.closed.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(self, message):
+        if message["type"] != "http.response.body":
+            return
+        body = message.get("body", b"")
+        if body.startswith(b"event:"):
+            if self.ready.is_set():
+                self.received.append(time.perf_counter())
+            else:
+                self.expected -= 1
+                if self.expected <= 0:
+                    self.ready.set()
+
+def timed_publish(change: dict) -> tuple[float, float]:
+    began = time.perf_counter()
+    events.availability_broker.publish(change)
+    return began, time.perf_counter() - began
+
+async def run(streams: int, changes: int, book_id: int) -> None:
+    async with api.router.lifespan_context(api):
+        logging.getLogger().setLevel(logging.ERROR)
+        before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        opened = []
+        started = time.perf_counter()
+        for _ in range(streams):
+            stream = Stream(str(book_id))
+            stream.expected = 1
+            opened.append((stream, asyncio.create_task(api(stream.scope, stream.receive, stream.send))))
+        await asyncio.gather(*(stream.ready.wait() for stream, _ in opened))
+        connect_seconds = time.perf_counter() - started
+        await asyncio.sleep(0.5)
+        # ru_maxrss is in KiB on Linux
+        per_stream = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before) * 1024 / streams
+        report({"name": "stream.connect", "streams": streams,
+                "seconds": round(connect_seconds, 2),
+                "bytes_per_stream": round(per_stream),
+                "subscribers": events.availability_broker.stats()["subscribers"]})
+
+        delivery, publish = [], []
+        for change in range(changes):
+            sent_at, elapsed = await asyncio.to_thread(timed_publish,
+                                                       {"book_id": book_id, "available_copies": change % 3,
+                                                        "total_copies": 3, "version": 10**9 + change})
+            publish.append(elapsed)
+            while sum(len(stream.received) for stream, _ in opened) < streams * (change + 1):
+                await asyncio.sleep(0.001)
+            delivery.extend(stream.received[-1] - sent_at for stream, _ in opened)
+        report(summarize("stream.publish", publish, sum(publish)))
+        report({**summarize("stream.delivery", delivery, 1), "streams": streams,
+                "last_stream_p100_ms": round(percentile(delivery, 100) * 1000, 3)})
+
+        for stream, _ in opened:
+            stream.closed.set()
+        await asyncio.gather(*(task for _, task in opened), return_exceptions=True)
+        report({"name": "stream.closed",
+                "subscribers": events.availability_broker.stats()["subscribers"]})
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--streams", type=int, default=2000)
+    parser.add_argument("--changes", type=int, default=20)
+    parser.add_argument("--book-id", type=int, default=1)
+    args = parser.parse_args()
+    asyncio.run(run(args.streams, args.changes, args.book_id))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Concurrent borrow/return stress run that checks the loan invariants afterwards.
+
+Run from backend/:  python -m benchmarks.borrow_contention --threads 32
+Exits non-zero if copies go negative, copies leak, or a user exceeds MAX_ACTIVE_LOANS.
+Lock timeouts (busy_timeout exceeded) are reported as errors but are not violations.
+"""
+from fastapi import HTTPException
+from sqlalchemy import func, insert, select
+import argparse
+import random
+import sys
+import threading
+import time
+
+from api import models, services
+from .common import report, summarize, temp_database
+
+def check_invariants(Session) -> list[str]:
+    violations = []
+    with Session() as db:
+        active = dict(db.execute(
+            select(models.Loan.book_id, func.count())
+            .where(models.Loan.return_date.is_(None))
+            .group_by(models.Loan.book_id)
+        ).all())
+        for book in db.scalars(select(models.Book)):
+            if book.available_copies < 0:
+                violations.append(f"book {book.id} has {book.available_copies} available copies")
+            if book.available_copies + active.get(book.id, 0) != book.total_copies:
+                violations.append(f"book {book.id} copies leaked: available={book.available_copies} "
+                                  f"active={active.get(book.id, 0)} total={book.total_copies}")
+        per_user = db.execute(
+            select(models.Loan.user_id, func.count())
+            .where(models.Loan.return_date.is_(None))
+            .group_by(models.Loan.user_id)
+        ).all()
+        for user_id, count in per_user:
+            if count > services.MAX_ACTIVE_LOANS:
+                violations.append(f"user {user_id} has {count} active loans")
+        per_user = dict(per_user)
+        for user in db.scalars(select(models.User)):
+            if user.active_loans != per_user.get(user.id, 0):
+                violations.append(f"user {user.id} counter drifted: active_loans={user.active_loans} "
+                                  f"actual={per_user.get(user.id, 0)}")
+    return violations
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--ops", type=int, default=200, help="operations per thread")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--books", type=int, default=4)
+    parser.add_argument("--copies", type=int, default=3)
+    parser.add_argument("--profile", default="production")
+    args = parser.parse_args()
+
+    engine, Session = temp_database(args.profile)
+    with Session() as db:
+        db.execute(insert(models.User),
+                   [{"name": f"user {i}", "email": f"user{i}@bench.local"} for i in range(args.users)])
+        db.execute(insert(models.Book),
+                   [{"title": f"book {i}", "author": "bench", "total_copies": args.copies,
+                     "available_copies": args.copies} for i in range(args.books)])
+        db.commit()
+
+    latencies, rejected, errors = [], [], []
+    open_loans: list[int] = []
+    lock = threading.Lock()
+
+    def worker():
+        rng = random.Random()
+        for _ in range(args.ops):
+            start = time.perf_counter()
+            try:
+                with Session() as db:
+                    with lock:
+                        loan_id = open_loans.pop(rng.randrange(len(open_loans))) if open_loans and rng.random() < 0.4 else None
+                    if loan_id is None:
+                        loan = services.borrow_book(db, rng.randint(1, args.users), rng.randint(1, args.books))
+                        with lock:
+                            open_loans.append(loan.id)
+                    else:
+                        services.return_loan(db, loan_id)
+            except HTTPException:
+                rejected.append(1)
+            except Exception as exc:
+                errors.append(f"{type(exc).__name__}: {exc}".splitlines()[0])
+                continue
+            latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=worker) for _ in range(args.threads)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    violations = check_invariants(Session)
+    report(summarize("borrow_contention", latencies, elapsed,
+                     threads=args.threads, rejected=len(rejected), errors=len(errors),
+                     error_types=sorted(set(errors)), violations=violations))
+    engine.dispose()
+    if violations:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+from pathlib import Path
+from sqlalchemy.orm import sessionmaker
+import json
+import tempfile
+
+from api.database import Base, build_engine
+
+def percentile(samples: list[float],
+               pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(int(round(pct / 100 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+def summarize(name: str,
+              latencies: list[float],
+              elapsed: float,
+              **extra) -> dict:
+    return {
+        "name": name,
+        "ops": len(latencies),
+        "throughput": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        **extra,
+    }
+
+def report(result: dict) -> None:
+    print(json.dumps(result), flush=True)
+
+def temp_database(profile: str = "production"):
+    path = Path(tempfile.mkdtemp()) / "bench.db"
+    engine = build_engine(f"sqlite:///{path}",
+                          profile)
+    Base.metadata.create_all(bind=engine)
+    return engine, sessionmaker(bind=engine,
+                                autoflush=False,
+                                autocommit=False)
@@ -0,0 +1,65 @@
+"""Fine accrual job at scale: first full pass, next-day incremental pass, same-day rerun.
+
+Run from backend/:  python -m benchmarks.fine_accrual --loans 1000000
+"""
+from datetime import datetime, timedelta
+from sqlalchemy import func, insert, select
+import argparse
+import random
+import time
+
+from api import models
+from api.jobs import accrue_fines
+from api.services import FINE_PER_DAY
+from api.utils import days_overdue
+from .common import report, temp_database
+
+def seed(Session, loans: int, now: datetime) -> None:
+    rng = random.Random(7)
+    with Session() as db:
+        db.execute(insert(models.User), [{"name": "bench", "email": "bench@bench.local"}])
+        db.execute(insert(models.Book), [{"title": "bench", "author": "bench", "total_copies": loans,
+                                          "available_copies": 0}])
+        for start in range(0, loans, 50000):
+            rows = []
+            for _ in range(min(50000, loans - start)):
+                # due dates from 60 days ago to 14 days ahead; ~80% are overdue
+                due = now - timedelta(days=60) + timedelta(seconds=rng.randrange(74 * 86400))
+                rows.append({"user_id": 1, "book_id": 1, "loan_date": due - timedelta(days=14),
+                             "due_date": due})
+            db.execute(insert(models.Loan.__table__), rows)
+        db.commit()
+
+def check(Session, now: datetime, sample: int = 2000) -> int:
+    mismatches = 0
+    with Session() as db:
+        loans = db.execute(select(models.Loan.due_date, models.Loan.fine_amount)
+                           .order_by(func.random()).limit(sample)).all()
+    for due_date, fine in loans:
+        if fine != days_overdue(due_date, now) * FINE_PER_DAY:
+            mismatches += 1
+    return mismatches
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--loans", type=int, default=1000000)
+    args = parser.parse_args()
+
+    now = datetime(2026, 6, 1, 12, 0)
+    engine, Session = temp_database()
+    seed(Session, args.loans, now)
+
+    for name, at in [("first_run", now),
+                     ("next_day", now + timedelta(days=1)),
+                     ("same_day_rerun", now + timedelta(days=1, hours=3)),
+                     ("after_weekend", now + timedelta(days=4))]:
+        with Session() as db:
+            start = time.perf_counter()
+            result = accrue_fines(db, at)
+            elapsed = time.perf_counter() - start
+        report({"name": f"accrue_fines.{name}", "loans": args.loans,
+                "seconds": round(elapsed, 3), **result, "sample_mismatches": check(Session, at)})
+    engine.dispose()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+"""Load harness: seed the configured database (data/library.db by default) with a
+synthetic dataset, then drive a mixed workload through the ASGI app and report
+throughput and latency per scenario.
+
+Run from backend/:
+    python -m benchmarks.load seed --size 1m --replace
+    python -m benchmarks.load run --seconds 30 --concurrency 32
+    python -m benchmarks.load run --mix availability=50,borrow_return=50
+    python -m benchmarks.load run --mix shelf=50,borrow_return=50
+
+Seeding replaces the database file (restore the sample data with git checkout data).
+"""
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from sqlalchemy import func, insert, select
+import argparse
+import asyncio
+import logging
+import random
+import sys
+import time
+
+import httpx
+
+from api import models
+from api.database import Base, SessionLocal, engine
+from api.migrations import schema_version, upgrade
+from api.jobs import rebuild_stats, reconcile_user_counters
+from api.utils import encode_cursor
+from .common import report, summarize
+
+SIZES = {"10k": 10_000, "1m": 1_000_000, "10m": 10_000_000}
+CHUNK = 50_000
+COPIES = 3
+HOT_BOOKS = 20
+
+DEFAULT_MIX = {"availability": 35,
+               "book": 10,
+               "books_list": 15,
+               "loans_list": 10,
+               "user_loans": 10,
+               "borrow_return": 15,
+               "export": 5}
+
+# -------- SEED --------
+def seed(loans: int) -> dict:
+    users = max(loans // 20, 100)
+    books = max(loans // 10, 100)
+    # the newest loans are still out: one per book, at most one per user, so
+    # copies and loan limits stay consistent
+    active = min(loans // 50, books - HOT_BOOKS, users)
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    start = now - timedelta(days=730)
+    step = (now - timedelta(days=1) - start) / loans
+    rng = random.Random(17)
+
+    started = time.perf_counter()
+    with SessionLocal() as db:
+        for first in range(0, users, CHUNK):
+            db.execute(insert(models.User.__table__),
+                       [{"name": f"user {i}", "email": f"user{i}@load.local", "created_at": start}
+                        for i in range(first, min(first + CHUNK, users))])
+        for first in range(0, books, CHUNK):
+            db.execute(insert(models.Book.__table__),
+                       [{"title": f"{rng.choice(['the', 'a', 'our'])} book of {rng.choice(['code', 'stars', 'rivers', 'glass'])} {i}",
+                         "author": f"author {i % 5000}",
+                         "total_copies": COPIES,
+                         "available_copies": COPIES - (HOT_BOOKS <= i < HOT_BOOKS + active)}
+                        for i in range(first, min(first + CHUNK, books))])
+        for first in range(0, loans, CHUNK):
+            rows = []
+            for i in range(first, min(first + CHUNK, loans)):
+                slot = i - (loans - active)
+                loan_date = start + step * i
+                row = {"user_id": (slot if slot >= 0 else i % users) + 1,
+                       "book_id": (HOT_BOOKS + slot if slot >= 0 else i % books) + 1,
+                       "loan_date": loan_date,
+                       "due_date": loan_date + timedelta(days=14),
+                       "return_date": None,
+                       "fine_amount": 0}
+                if slot < 0:
+                    late = rng.random() < 0.1
+                    row["return_date"] = loan_date + timedelta(days=rng.randint(15, 30) if late else rng.randint(1, 14))
+                    row["fine_amount"] = (row["return_date"] - row["due_date"]).days * 2 if late else 0
+                rows.append(row)
+            db.execute(insert(models.Loan.__table__), rows)
+        db.commit()
+        counters = reconcile_user_counters(db,
+                                           repair=True)
+        rebuild_stats(db)
+    return {"users": users, "books": books, "loans": loans, "active": active,
+            "seconds": round(time.perf_counter() - started, 1), "counters_set": counters["repaired"]}
+
+# -------- WORKLOAD --------
+class Workload:
+    def __init__(self, client: httpx.AsyncClient, users: int, books: int):
+        self.client = client
+        self.users = users
+        self.books = books
+        self.rng = random.Random()
+
+    async def availability(self) -> int:
+        response = await self.client.get(f"/books/{self.rng.randint(1, self.books)}/availability")
+        return response.status_code
+
+    async def book(self) -> int:
+        response = await self.client.get(f"/books/{self.rng.randint(1, self.books)}")
+        return response.status_code
+
+    async def shelf(self) -> int:
+        # a shelf of 50 books in one multi-get, instead of 50 availability calls
+        ids = ",".join(str(self.rng.randint(1, self.books)) for _ in range(50))
+        response = await self.client.get("/books/availability", params={"ids": ids})
+        return response.status_code
+
+    async def books_list(self) -> int:
+        cursor = encode_cursor(self.rng.randint(0, self.books))
+        response = await self.client.get("/books", params={"after": cursor, "limit": 50})
+        return response.status_code
+
+    async def loans_list(self) -> int:
+        status = self.rng.choice(["active", "overdue", "all"])
+        response = await self.client.get("/loans", params={"status": status, "limit": 50})
+        return response.status_code
+
+    async def user_loans(self) -> int:
+        response = await self.client.get(f"/users/{self.rng.randint(1, self.users)}/loans",
+                                         params={"expand": "book"})
+        return response.status_code
+
+    async def borrow_return(self) -> int:
+        # hot books are shared by every worker, so this is the contention path
+        response = await self.client.post("/loans", json={"user_id": self.rng.randint(1, self.users),
+                                                          "book_id": self.rng.randint(1, HOT_BOOKS)})
+        if response.status_code != 201:
+            return response.status_code
+        response = await self.client.post(f"/loans/{response.json()['id']}/return")
+        return response.status_code
+
+    async def export(self) -> int:
+        async with self.client.stream("GET", "/loans/export/csv",
+                                      params={"user_id": self.rng.randint(1, self.users)}) as response:
+            async for _ in response.aiter_bytes():
+                pass
+        return response.status_code
+
+async def drive(app, mix: dict, seconds: float, concurrency: int, users: int, books: int) -> None:
+    transport = httpx.ASGITransport(app=app)
+    latencies = {name: [] for name in mix}
+    statuses = {name: Counter() for name in mix}
+    names, weights = list(mix), list(mix.values())
+
+    async def worker():
+        async with httpx.AsyncClient(transport=transport, base_url="http://load") as client:
+            workload = Workload(client, users, books)
+            while time.perf_counter() < stop:
+                name = workload.rng.choices(names, weights)[0]
+                began = time.perf_counter()
+                status = await getattr(workload, name)()
+                latencies[name].append(time.perf_counter() - began)
+                statuses[name][status] += 1
+
+    # ASGITransport skips lifespan events, so start the app the way a server would
+    async with app.router.lifespan_context(app):
+        logging.getLogger().setLevel(logging.ERROR)
+        started = time.perf_counter()
+        stop = started + seconds
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    for name in names:
+        report(summarize(f"load.{name}", latencies[name], elapsed,
+                         statuses=dict(statuses[name])))
+    every = [value for values in latencies.values() for value in values]
+    errors = sum(count for counter in statuses.values() for status, count in counter.items() if status >= 500)
+    report(summarize("load.total", every, elapsed, concurrency=concurrency, users=users, books=books,
+                     server_errors=errors))
+
+# -------- CLI --------
+def parse_mix(value: str) -> dict:
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if not hasattr(Workload, name):
+            raise argparse.ArgumentTypeError(f"unknown scenario {name}")
+        mix[name] = int(weight or 1)
+    return mix
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command", required=True)
+    seed_parser = commands.add_parser("seed")
+    seed_parser.add_argument("--size", choices=SIZES, default="10k")
+    seed_parser.add_argument("--replace", action="store_true",
+                             help="delete the existing database first (required)")
+    run_parser = commands.add_parser("run")
+    run_parser.add_argument("--seconds", type=float, default=10)
+    run_parser.add_argument("--concurrency", type=int, default=16)
+    run_parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX)
+    args = parser.parse_args()
+    # seeding and saturation make every statement "slow"; keep output to the report lines
+    logging.getLogger("library.metrics").setLevel(logging.ERROR)
+
+    if args.command == "seed":
+        if not args.replace:
+            sys.exit(f"seeding replaces {engine.url}; pass --replace to continue")
+        engine.dispose()
+        if engine.dialect.name == "sqlite" and engine.url.database:
+            # the configured file, which is data/library.db only by default
+            path = Path(engine.url.database)
+            for suffix in ("", "-wal", "-shm"):
+                path.with_name(path.name + suffix).unlink(missing_ok=True)
+        else:
+            Base.metadata.drop_all(bind=engine)
+            schema_version.drop(engine, checkfirst=True)
+        upgrade(engine)
+        report({"name": "load.seed", "size": args.size, **seed(SIZES[args.size])})
+        return
+
+    # imported here so seeding never runs against an app that already holds the old file
+    from api.main import api
+    with SessionLocal() as db:
+        users = db.scalar(select(func.max(models.User.id))) or 0
+        books = db.scalar(select(func.max(models.Book.id))) or 0
+    if books < HOT_BOOKS or not users:
+        sys.exit("database is empty; run the seed command first")
+    asyncio.run(drive(api, args.mix, args.seconds, args.concurrency, users, books))
+
+if __name__ == "__main__":
+    main()
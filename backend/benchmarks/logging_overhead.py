@@ -0,0 +1,61 @@
+"""Per-request cost of logging: handlers on the request thread (the old setup) against
+the QueueHandler/QueueListener pipeline, in text and JSON format.
+
+Each simulated request emits the lines a borrow produces (service + access log).
+Run from backend/:  python -m benchmarks.logging_overhead --requests 20000
+"""
+from pathlib import Path
+import argparse
+import io
+import logging
+import tempfile
+import time
+
+from api import logging_config
+from api.config import settings
+from .common import percentile, report, summarize
+
+service_logger = logging.getLogger("library.services")
+access_logger = logging.getLogger("httpx")
+
+def request(i: int) -> None:
+    service_logger.info("loan_created loan_id=%s user_id=%s book_id=%s due_date=%s",
+                        i, i % 100, i % 1000, "2026-11-01T13:26:09.288851+00:00")
+    access_logger.info('HTTP Request: %s %s "%s"', "POST", "http://testserver/loans",
+                       "HTTP/1.1 201 Created")
+
+def run(requests: int) -> list[float]:
+    latencies = []
+    for i in range(requests):
+        began = time.perf_counter()
+        request(i)
+        latencies.append(time.perf_counter() - began)
+    return latencies
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=20000)
+    args = parser.parse_args()
+
+    log_file = Path(tempfile.mkdtemp()) / "app.log"
+    logging.getLogger().handlers.clear()
+    logging.getLogger().setLevel(logging.CRITICAL)
+    baseline = run(args.requests)
+    report(summarize("logging.disabled", baseline, sum(baseline)))
+
+    for name, queued, log_format in [("sync_text", False, "text"),
+                                     ("queue_text", True, "text"),
+                                     ("sync_json", False, "json"),
+                                     ("queue_json", True, "json")]:
+        settings.log_queue = queued
+        settings.log_format = log_format
+        logging_config.setup_logging(log_file, io.StringIO())
+        start = time.perf_counter()
+        latencies = run(args.requests)
+        elapsed = time.perf_counter() - start
+        logging_config.stop_logging()
+        report(summarize(f"logging.{name}", latencies, elapsed,
+                         added_p99_ms=round((percentile(latencies, 99) - percentile(baseline, 99)) * 1000, 3)))
+
+if __name__ == "__main__":
+    main()
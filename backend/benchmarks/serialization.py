@@ -0,0 +1,86 @@
+"""List page serialization: ORM objects through response_model validation and stdlib
+JSON (the old path) against column rows / plain dicts dumped with orjson (the new one).
+
+Run from backend/:  python -m benchmarks.serialization --rows 100 --repeat 2000
+"""
+from datetime import datetime, timedelta
+from pydantic import TypeAdapter
+from sqlalchemy import insert, select
+import argparse
+import json
+import time
+
+import orjson
+
+from api import crud, models, schemas
+from api.utils import expand_rows, schema_rows
+from .common import report, summarize, temp_database
+
+def seed(Session, rows: int) -> None:
+    now = datetime(2026, 6, 1, 12, 0)
+    with Session() as db:
+        db.execute(insert(models.User.__table__), [{"name": f"user {i}", "email": f"user{i}@bench.local",
+                                                    "created_at": now} for i in range(rows)])
+        db.execute(insert(models.Book.__table__), [{"title": f"title {i}", "author": f"author {i}",
+                                                    "total_copies": 3, "available_copies": 2}
+                                                   for i in range(rows)])
+        db.execute(insert(models.Loan.__table__), [{"user_id": i + 1, "book_id": i + 1,
+                                                    "loan_date": now - timedelta(days=i % 30),
+                                                    "due_date": now + timedelta(days=14 - i % 30)}
+                                                   for i in range(rows)])
+        db.commit()
+
+def old_path(adapter: TypeAdapter, objects) -> bytes:
+    # what FastAPI does for a response_model: validate, dump to JSON types, json.dumps
+    validated = adapter.validate_python(objects, from_attributes=True)
+    return json.dumps(adapter.dump_python(validated, mode="json")).encode()
+
+def measure(name: str, repeat: int, fn) -> None:
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(repeat):
+        began = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - began)
+    report(summarize(name, latencies, time.perf_counter() - start))
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    engine, Session = temp_database()
+    seed(Session, args.rows)
+
+    cases = [("books", schemas.BookOut, models.Book, crud.BOOK_COLUMNS),
+             ("users", schemas.UserOut, models.User, crud.USER_COLUMNS)]
+    with Session() as db:
+        for name, schema, model, columns in cases:
+            adapter = TypeAdapter(list[schema])
+            objects = list(db.scalars(select(model).limit(args.rows)))
+            rows = db.execute(select(*columns).limit(args.rows)).all()
+            assert json.loads(old_path(adapter, objects)) == json.loads(orjson.dumps(schema_rows(rows, schema)))
+
+            measure(f"{name}.serialize.old", args.repeat, lambda: old_path(adapter, objects))
+            measure(f"{name}.serialize.new", args.repeat, lambda: orjson.dumps(schema_rows(rows, schema)))
+            measure(f"{name}.query_serialize.old", args.repeat,
+                    lambda: old_path(adapter, list(db.scalars(select(model).limit(args.rows)))))
+            measure(f"{name}.query_serialize.new", args.repeat,
+                    lambda: orjson.dumps(schema_rows(db.execute(select(*columns).limit(args.rows)).all(),
+                                                     schema)))
+
+        adapter = TypeAdapter(list[schemas.LoanOut])
+        loans = crud.list_loans(db, skip=0, limit=args.rows)
+        measure("loans.serialize.old", args.repeat, lambda: old_path(adapter, loans))
+        measure("loans.serialize.new", args.repeat,
+                lambda: orjson.dumps(expand_rows(loans, schemas.LoanOut, {})))
+        measure("loans.query_serialize.old", args.repeat,
+                lambda: old_path(adapter, crud.list_loans(db, skip=0, limit=args.rows)))
+        measure("loans.query_serialize.new", args.repeat,
+                lambda: orjson.dumps(expand_rows(crud.list_loans(db, skip=0, limit=args.rows),
+                                                 schemas.LoanOut, {})))
+    engine.dispose()
+
+if __name__ == "__main__":
+    main()
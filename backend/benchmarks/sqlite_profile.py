@@ -0,0 +1,83 @@
+"""Borrow/return writers against list readers, per SQLite engine profile.
+
+Run from backend/:  python -m benchmarks.sqlite_profile --seconds 10
+"""
+from fastapi import HTTPException
+from sqlalchemy import insert
+import argparse
+import random
+import threading
+import time
+
+from api import crud, models, services
+from .common import report, summarize, temp_database
+
+def seed(Session, users: int, books: int) -> None:
+    with Session() as db:
+        db.execute(insert(models.User),
+                   [{"name": f"user {i}", "email": f"user{i}@bench.local"} for i in range(users)])
+        db.execute(insert(models.Book),
+                   [{"title": f"book {i}", "author": "bench", "total_copies": 5, "available_copies": 5}
+                    for i in range(books)])
+        db.commit()
+
+def run_profile(profile: str, seconds: float, readers: int, writers: int,
+                users: int, books: int) -> None:
+    engine, Session = temp_database(profile)
+    seed(Session, users, books)
+    stop = time.perf_counter() + seconds
+    reads, writes, errors = [], [], []
+
+    def reader():
+        rng = random.Random()
+        while time.perf_counter() < stop:
+            start = time.perf_counter()
+            with Session() as db:
+                if rng.random() < 0.5:
+                    crud.list_books(db, skip=0, limit=20, after_id=rng.randint(0, books))
+                else:
+                    crud.list_loans(db, skip=0, limit=20, status="active")
+            reads.append(time.perf_counter() - start)
+
+    def writer():
+        rng = random.Random()
+        while time.perf_counter() < stop:
+            start = time.perf_counter()
+            try:
+                with Session() as db:
+                    loan = services.borrow_book(db, rng.randint(1, users), rng.randint(1, books))
+                    services.return_loan(db, loan.id)
+            except HTTPException:
+                pass
+            except Exception as exc:
+                errors.append(type(exc).__name__)
+                continue
+            writes.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=reader) for _ in range(readers)]
+    threads += [threading.Thread(target=writer) for _ in range(writers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    report(summarize(f"{profile}.list", reads, elapsed, readers=readers))
+    report(summarize(f"{profile}.borrow_return", writes, elapsed, writers=writers, errors=len(errors)))
+    engine.dispose()
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--books", type=int, default=5000)
+    parser.add_argument("--profiles", nargs="+", default=["default", "production"])
+    args = parser.parse_args()
+    for profile in args.profiles:
+        run_profile(profile, args.seconds, args.readers, args.writers, args.users, args.books)
+
+if __name__ == "__main__":
+    main()
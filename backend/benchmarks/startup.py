@@ -0,0 +1,85 @@
+"""Cold start: each run is a fresh interpreter that imports the app, runs its
+lifespan startup and serves one request, as a new worker or serverless instance would.
+
+Run from backend/:  python -m benchmarks.startup --runs 20 --budget-ms 1500
+
+Runs against a temporary SQLite file: "migrated" starts on an up-to-date schema,
+"empty" migrates a new database first. Exits non-zero when the p95 of a
+whole "migrated" start exceeds --budget-ms.
+"""
+from pathlib import Path
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from .common import report, summarize
+
+CHILD = """
+import json, time
+started = time.perf_counter()
+from api.main import api
+imported = time.perf_counter()
+from fastapi.testclient import TestClient
+with TestClient(api) as client:
+    ready = time.perf_counter()
+    client.get("/health").raise_for_status()
+    served = time.perf_counter()
+print(json.dumps({"import": imported - started, "startup": ready - imported, "first_request": served - ready}))
+"""
+
+def start_once(env: dict) -> dict:
+    began = time.perf_counter()
+    output = subprocess.run([sys.executable, "-c", CHILD],
+                            env=env,
+                            capture_output=True,
+                            text=True,
+                            check=True).stdout
+    timings = json.loads(output.strip().splitlines()[-1])
+    timings["process"] = time.perf_counter() - began
+    return timings
+
+def run_scenario(name: str, runs: int, workdir: Path, fresh: bool) -> dict:
+    env = {**os.environ,
+           "PYTHONPATH": str(Path(__file__).resolve().parents[1]),
+           "LIBRARY_LOG_LEVEL": "WARNING"}
+    samples = {"import": [], "startup": [], "first_request": [], "process": []}
+    started = time.perf_counter()
+    for run in range(runs):
+        path = workdir / (f"{name}-{run}.db" if fresh else f"{name}.db")
+        env["LIBRARY_DATABASE_URL"] = f"sqlite:///{path}"
+        if not fresh and run == 0:
+            # untimed: bring the shared file to the current schema
+            start_once(env)
+        for phase, value in start_once(env).items():
+            samples[phase].append(value)
+    elapsed = time.perf_counter() - started
+    results = {phase: summarize(f"startup.{name}.{phase}", values, elapsed)
+               for phase, values in samples.items()}
+    for result in results.values():
+        report(result)
+    return results
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--budget-ms", type=float, default=None,
+                        help="fail when the p95 cold start on a migrated database is slower")
+    args = parser.parse_args()
+
+    workdir = Path(tempfile.mkdtemp())
+    migrated = run_scenario("migrated", args.runs, workdir, fresh=False)
+    run_scenario("empty", args.runs, workdir, fresh=True)
+
+    if args.budget_ms is not None:
+        p95 = migrated["process"]["p95_ms"]
+        report({"name": "startup.budget", "budget_ms": args.budget_ms, "p95_ms": p95,
+                "ok": p95 <= args.budget_ms})
+        if p95 > args.budget_ms:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
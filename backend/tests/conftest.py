@@ -0,0 +1,71 @@
+from pathlib import Path
+from uuid import uuid4
+import os
+import tempfile
+
+# The engines are built from settings when api.database is imported, so the
+# scratch database has to be configured before anything imports api.
+os.environ.setdefault("LIBRARY_DATABASE_URL",
+                      f"sqlite:///{Path(tempfile.mkdtemp()) / 'library.db'}")
+os.environ.setdefault("LIBRARY_CACHE_BACKEND", "none")
+
+from sqlalchemy.orm import sessionmaker
+import pytest
+
+from api import crud
+from api.database import build_engine, engine
+from api.migrations import upgrade
+
+# PostgreSQL runs only against a scratch database named here, or a throwaway
+# server; the tests create rows and never clean up
+POSTGRES_URL = os.environ.get("LIBRARY_TEST_POSTGRES_URL")
+
+def postgres_url(request) -> str:
+    # without LIBRARY_TEST_POSTGRES_URL, start a local server for the run with
+    # testing.postgresql (needs initdb and postgres on the PATH)
+    if POSTGRES_URL:
+        return POSTGRES_URL
+    try:
+        import testing.postgresql
+        server = testing.postgresql.Postgresql()
+    except (ImportError, RuntimeError) as exc:
+        pytest.skip(f"no PostgreSQL to test against ({exc}); set LIBRARY_TEST_POSTGRES_URL "
+                    "or install the PostgreSQL server binaries")
+    request.addfinalizer(server.stop)
+    return server.url()
+
+@pytest.fixture(scope="session",
+                params=["sqlite", "postgresql"])
+def sessions(request):
+    # every test that touches the database runs once per backend
+    if request.param == "postgresql":
+        bind = build_engine(postgres_url(request))
+    else:
+        bind = engine
+    upgrade(bind)
+    yield sessionmaker(bind=bind,
+                       autoflush=False,
+                       autocommit=False)
+    if bind is not engine:
+        bind.dispose()
+
+# rows are created in their own session and come back detached, so each
+# test opens a fresh session per call, as a request would
+@pytest.fixture
+def make_user(sessions):
+    def make(name: str = "Reader"):
+        with sessions() as db:
+            return crud.create_user(db,
+                                    name=name,
+                                    email=f"{uuid4().hex}@example.com")
+    return make
+
+@pytest.fixture
+def make_book(sessions):
+    def make(total_copies: int = 1):
+        with sessions() as db:
+            return crud.create_book(db,
+                                    title=f"Book {uuid4().hex[:8]}",
+                                    author="Author",
+                                    total_copies=total_copies)
+    return make
@@ -0,0 +1,65 @@
+from datetime import datetime, timezone
+from uuid import uuid4
+import threading
+
+from api import bulk, crud, schemas
+
+def test_bulk_insert_returns_ids_in_row_order(sessions):
+    titles = [f"Bulk {uuid4().hex[:8]}" for _ in range(50)]
+    with sessions() as db:
+        crud.begin_write(db)
+        ids = crud.bulk_create_books(db,
+                                     [{"title": title,
+                                       "author": "Author",
+                                       "total_copies": 1,
+                                       "available_copies": 1} for title in titles])
+        db.commit()
+        assert {row.id: row.title for row in crud.get_books_by_ids(db, ids)} == dict(zip(ids, titles))
+
+def test_bulk_users_skip_taken_emails(sessions, make_user):
+    taken = make_user().email
+    fresh = [f"{uuid4().hex}@example.com" for _ in range(3)]
+    rows = [{"name": "Reader", "email": email} for email in (fresh[0], taken, fresh[1], fresh[0], fresh[2])]
+    with sessions() as db:
+        crud.begin_write(db)
+        ids = crud.bulk_create_users(db,
+                                     rows,
+                                     created_at=datetime.now(timezone.utc))
+        db.commit()
+    # the existing email and the repeat of the first one are skipped
+    assert [user_id is not None for user_id in ids] == [True, False, True, False, True]
+    with sessions() as db:
+        assert [crud.get_user(db, ids[index]).email for index in (0, 2, 4)] == fresh
+
+def test_concurrent_imports_sharing_emails(sessions):
+    # The first import holds its batch open while the second one inserts the
+    # same emails: the second waits (SQLite's write lock, or the unique index
+    # entry on PostgreSQL) and reports them as duplicates instead of failing.
+    shared = [f"{uuid4().hex}@example.com" for _ in range(3)]
+    own = f"{uuid4().hex}@example.com"
+    inserted, release = threading.Event(), threading.Event()
+
+    def first():
+        with sessions() as db:
+            crud.begin_write(db)
+            crud.bulk_create_users(db,
+                                   [{"name": "First", "email": email} for email in shared],
+                                   created_at=datetime.now(timezone.utc))
+            inserted.set()
+            release.wait(5)
+            db.commit()
+
+    thread = threading.Thread(target=first)
+    thread.start()
+    assert inserted.wait(5)
+    threading.Timer(0.3, release.set).start()
+    batch = [(row, schemas.UserCreate(name="Second", email=email))
+             for row, email in enumerate([*shared, own], start=1)]
+    with sessions() as db:
+        results = bulk.insert_users(db,
+                                    batch)
+    thread.join()
+
+    assert [result["status"] for result in results] == ["duplicate", "duplicate", "duplicate", "created"]
+    with sessions() as db:
+        assert [crud.get_user_by_email(db, email).name for email in shared] == ["First"] * 3
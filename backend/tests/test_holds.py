@@ -0,0 +1,52 @@
+from api import crud
+from api.services import MAX_ACTIVE_LOANS, borrow_book, place_hold, return_loan, update_book
+
+def hold_statuses(sessions,
+                  book_id: int) -> dict[int, str]:
+    with sessions() as db:
+        return {hold.user_id: hold.status for hold in crud.list_book_holds(db,
+                                                                            book_id)}
+
+def test_returned_copy_skips_a_holder_who_cannot_borrow(sessions, make_user, make_book):
+    reader, busy, next_in_line, book = make_user(), make_user(), make_user(), make_book()
+    with sessions() as db:
+        loan = borrow_book(db,
+                           reader.id,
+                           book.id)
+    for _ in range(MAX_ACTIVE_LOANS):
+        with sessions() as db:
+            borrow_book(db,
+                        busy.id,
+                        make_book().id)
+    for holder in (busy, next_in_line):
+        with sessions() as db:
+            place_hold(db,
+                       holder.id,
+                       book.id)
+
+    with sessions() as db:
+        return_loan(db,
+                    loan.id)
+    # the busy holder keeps the head of the queue for the next copy
+    assert hold_statuses(sessions, book.id) == {busy.id: "waiting",
+                                                next_in_line.id: "ready"}
+
+def test_added_copies_serve_the_hold_queue_first(sessions, make_user, make_book):
+    reader, holder, book = make_user(), make_user(), make_book()
+    with sessions() as db:
+        borrow_book(db,
+                    reader.id,
+                    book.id)
+    with sessions() as db:
+        place_hold(db,
+                   holder.id,
+                   book.id)
+
+    with sessions() as db:
+        updated = update_book(db,
+                              book.id,
+                              None,
+                              None,
+                              3)
+    assert (updated.total_copies, updated.available_copies) == (3, 1)
+    assert hold_statuses(sessions, book.id) == {holder.id: "ready"}
@@ -0,0 +1,137 @@
+from fastapi import HTTPException, Response
+from uuid import uuid4
+import json
+import threading
+import time
+
+from sqlalchemy import func, select
+import pytest
+
+from api import crud, idempotency, models, schemas
+from api.services import borrow_book, return_loan, update_book
+
+def borrow(sessions,
+           key: str,
+           user_id: int,
+           book_id: int,
+           hook=None):
+    # what POST /loans does, with an optional hook run just before commit
+    with sessions() as db:
+        def action(record):
+            def before_commit(session, loan):
+                if record:
+                    record(session,
+                           loan)
+                if hook:
+                    hook()
+            return borrow_book(db,
+                               user_id,
+                               book_id,
+                               before_commit=before_commit)
+        result = idempotency.execute(db,
+                                     key,
+                                     idempotency.fingerprint("POST /loans", {"user_id": user_id, "book_id": book_id}),
+                                     201,
+                                     schemas.LoanOut,
+                                     action)
+        return result if isinstance(result, Response) else schemas.LoanOut.model_validate(result)
+
+def give_back(sessions,
+              key: str,
+              loan_id: int,
+              hook=None):
+    with sessions() as db:
+        def action(record):
+            def before_commit(session, loan):
+                if record:
+                    record(session,
+                           loan)
+                if hook:
+                    hook()
+            return return_loan(db,
+                               loan_id,
+                               before_commit=before_commit)
+        result = idempotency.execute(db,
+                                     key,
+                                     idempotency.fingerprint("POST /loans/{loan_id}/return", {"loan_id": loan_id}),
+                                     200,
+                                     schemas.LoanOut,
+                                     action)
+        return result if isinstance(result, Response) else schemas.LoanOut.model_validate(result)
+
+def run_with_retry(first, retry) -> tuple:
+    # starts the retry once the original holds its key, and keeps the
+    # original's transaction open a while longer
+    claimed = threading.Event()
+    results = {}
+
+    def slow():
+        claimed.set()
+        time.sleep(0.5)
+
+    def original():
+        results["original"] = first(slow)
+
+    thread = threading.Thread(target=original)
+    thread.start()
+    assert claimed.wait(5)
+    results["retry"] = retry()
+    thread.join()
+    return results["original"], results["retry"]
+
+def assert_replayed(response, original) -> None:
+    assert isinstance(response, Response)
+    assert response.headers[idempotency.REPLAY_HEADER] == "true"
+    assert json.loads(response.body)["id"] == original.id
+
+def test_sequential_retry_replays(sessions, make_user, make_book):
+    user, book = make_user(), make_book()
+    key = uuid4().hex
+    loan = borrow(sessions, key, user.id, book.id)
+    assert_replayed(borrow(sessions, key, user.id, book.id),
+                    loan)
+
+def test_concurrent_borrow_retry_replays(sessions, make_user, make_book):
+    user, book = make_user(), make_book(total_copies=1)
+    key = uuid4().hex
+    loan, retry = run_with_retry(lambda hook: borrow(sessions, key, user.id, book.id, hook),
+                                 lambda: borrow(sessions, key, user.id, book.id))
+    assert_replayed(retry,
+                    loan)
+    with sessions() as db:
+        assert crud.get_book(db, book.id).available_copies == 0
+        assert db.scalar(select(func.count()).where(models.Loan.book_id == book.id)) == 1
+
+def test_concurrent_return_retry_replays(sessions, make_user, make_book):
+    user, book = make_user(), make_book()
+    loan = borrow(sessions, None, user.id, book.id)
+    key = uuid4().hex
+    returned, retry = run_with_retry(lambda hook: give_back(sessions, key, loan.id, hook),
+                                     lambda: give_back(sessions, key, loan.id))
+    assert returned.return_date is not None
+    assert_replayed(retry,
+                    returned)
+
+def test_retry_after_failed_original_runs_again(sessions, make_user, make_book):
+    user, book = make_user(), make_book(total_copies=0)
+    key = uuid4().hex
+    with pytest.raises(HTTPException) as failed:
+        borrow(sessions, key, user.id, book.id)
+    assert failed.value.status_code == 409
+
+    with sessions() as db:
+        update_book(db,
+                    book.id,
+                    title=None,
+                    author=None,
+                    total_copies=1)
+    loan = borrow(sessions, key, user.id, book.id)
+    assert isinstance(loan, schemas.LoanOut)
+
+def test_key_reused_for_other_request_is_rejected(sessions, make_user, make_book):
+    user, book, other = make_user(), make_book(), make_book()
+    key = uuid4().hex
+    borrow(sessions, key, user.id, book.id)
+    with pytest.raises(HTTPException) as rejected:
+        borrow(sessions, key, user.id, other.id)
+    assert rejected.value.status_code == 422
@@ -0,0 +1,117 @@
+from fastapi import HTTPException
+import random
+import threading
+
+from sqlalchemy import func, select
+import pytest
+
+from api import crud, models
+from api.migrations import upgrade
+from api.services import MAX_ACTIVE_LOANS, borrow_book, return_loan
+
+def counts(sessions,
+           book_id: int,
+           user_id: int) -> tuple[int, int, int]:
+    with sessions() as db:
+        book = crud.get_book(db,
+                             book_id)
+        user = crud.get_user(db,
+                             user_id)
+        return book.available_copies, user.active_loans, user.total_loans
+
+def test_upgrade_is_a_no_op_on_a_current_schema(sessions):
+    assert upgrade(sessions.kw["bind"]) == []
+
+def test_borrow_and_return_keep_counters_in_step(sessions, make_user, make_book):
+    user, book = make_user(), make_book(total_copies=2)
+    with sessions() as db:
+        loan = borrow_book(db,
+                           user.id,
+                           book.id)
+    assert counts(sessions, book.id, user.id) == (1, 1, 1)
+
+    with sessions() as db:
+        return_loan(db,
+                    loan.id)
+    assert counts(sessions, book.id, user.id) == (2, 0, 1)
+
+def test_last_copy_goes_to_one_borrower(sessions, make_user, make_book):
+    first, second, book = make_user(), make_user(), make_book(total_copies=1)
+    with sessions() as db:
+        borrow_book(db,
+                    first.id,
+                    book.id)
+    with sessions() as db, pytest.raises(HTTPException) as refused:
+        borrow_book(db,
+                    second.id,
+                    book.id)
+    assert refused.value.detail == "No available copies"
+
+def test_max_active_loans(sessions, make_user, make_book):
+    user = make_user()
+    for _ in range(MAX_ACTIVE_LOANS):
+        with sessions() as db:
+            borrow_book(db,
+                        user.id,
+                        make_book().id)
+    with sessions() as db, pytest.raises(HTTPException) as refused:
+        borrow_book(db,
+                    user.id,
+                    make_book().id)
+    assert refused.value.detail == "User reached max active loans"
+
+def test_concurrent_borrows_and_returns_keep_invariants(sessions, make_user, make_book):
+    # the checks of benchmarks/borrow_contention.py, on a smaller run: threads
+    # race for the last copies and each user's last loan slot, with returns
+    # mixed in
+    users = [make_user().id for _ in range(3)]
+    books = [make_book(total_copies=2).id for _ in range(2)]
+    open_loans: list[int] = []
+    errors: list[Exception] = []
+    lock = threading.Lock()
+    start = threading.Barrier(8)
+
+    def worker(seed: int):
+        rng = random.Random(seed)
+        start.wait()
+        for _ in range(25):
+            with lock:
+                loan_id = open_loans.pop(rng.randrange(len(open_loans))) if open_loans and rng.random() < 0.4 else None
+            try:
+                with sessions() as db:
+                    if loan_id is None:
+                        loan = borrow_book(db,
+                                           rng.choice(users),
+                                           rng.choice(books))
+                        with lock:
+                            open_loans.append(loan.id)
+                    else:
+                        return_loan(db,
+                                    loan_id)
+            except HTTPException:
+                pass
+            except Exception as exc:
+                errors.append(exc)
+
+    threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+
+    with sessions() as db:
+        active = select(func.count()).where(models.Loan.return_date.is_(None))
+        for book_id in books:
+            book = crud.get_book(db,
+                                 book_id)
+            lent = db.scalar(active.where(models.Loan.book_id == book_id))
+            assert 0 <= book.available_copies
+            assert book.available_copies + lent == book.total_copies
+        for user_id in users:
+            user = crud.get_user(db,
+                                 user_id)
+            held = db.scalar(active.where(models.Loan.user_id == user_id))
+            assert held <= MAX_ACTIVE_LOANS
+            assert user.active_loans == held
+        assert len(open_loans) == db.scalar(active.where(models.Loan.book_id.in_(books)))
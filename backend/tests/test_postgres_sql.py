@@ -0,0 +1,136 @@
+from datetime import datetime
+import re
+
+from sqlalchemy import create_engine
+from sqlalchemy.dialects import postgresql
+
+from api import crud, jobs, migrations, models, search
+from api.database import use_utc_sessions
+
+# The PostgreSQL branches compiled against the dialect, so they are checked
+# even when no server is available for the postgresql pass of `sessions`.
+class CompilingSession:
+    # stands in for a Session on PostgreSQL: records the SQL of each
+    # statement and returns no rows
+    def __init__(self):
+        self.dialect = postgresql.dialect()
+        self.statements: list[str] = []
+
+    def get_bind(self):
+        return self
+
+    def _compile(self, stmt, params=None) -> str:
+        rows = params if isinstance(params, list) else [params] if params else []
+        sql = str(stmt.compile(dialect=self.dialect,
+                               column_keys=list(rows[0]) if rows else None))
+        self.statements.append(" ".join(sql.split()))
+        return self
+
+    def execute(self, stmt, params=None):
+        return self._compile(stmt,
+                             params)
+
+    def scalars(self, stmt, params=None):
+        return self._compile(stmt,
+                             params)
+
+    def scalar(self, stmt, params=None):
+        self._compile(stmt,
+                      params)
+        return None
+
+    def exec_driver_sql(self, sql, params=None):
+        self.statements.append(" ".join(sql.split()))
+
+    def all(self) -> list:
+        return []
+
+def compiled(expression) -> str:
+    return str(expression.compile(dialect=postgresql.dialect()))
+
+def test_search_uses_the_indexed_document():
+    db = CompilingSession()
+    crud.search_books(db,
+                      "'harry' & 'pot':*",
+                      10,
+                      after=(-0.5, 7))
+    sql, = db.statements
+    document = ("setweight(to_tsvector('simple', books.title), 'A') || "
+                "setweight(to_tsvector('simple', books.author), 'B')")
+    assert f"WHERE (({document}) @@ to_tsquery('simple', %(to_tsquery_1)s))" in sql
+    assert f"-ts_rank({document}, to_tsquery('simple', %(to_tsquery_1)s)) AS rank" in sql
+    assert "books.id) > (%(param_1)s, %(param_2)s) ORDER BY rank, books.id" in sql
+    # the GIN index only serves the query if its expression is the same one
+    index_expression = re.sub(r"\s+", " ", search.POSTGRES_DDL[0])
+    assert f"USING gin ( ({document.replace('books.', '')}) )" in index_expression
+
+def test_install_fts_creates_the_gin_index():
+    conn = CompilingSession()
+    search.install_fts(conn)
+    assert conn.statements == [" ".join(ddl.split()) for ddl in search.POSTGRES_DDL]
+    assert conn.statements[0].startswith("CREATE INDEX IF NOT EXISTS ix_books_search ON books USING gin")
+
+def test_day_arithmetic_casts_to_date():
+    db = CompilingSession()
+    assert compiled(jobs.day_of(db,
+                                models.Loan.loan_date)) == "CAST(loans.loan_date AS DATE)"
+    assert compiled(jobs.days_before(db,
+                                     datetime(2024, 5, 1),
+                                     models.Loan.due_date)) == "CAST(%(param_1)s AS DATE) - CAST(loans.due_date AS DATE)"
+
+def test_next_hold_skips_locked_rows():
+    db = CompilingSession()
+    assert crud.allocate_next_hold(db,
+                                   book_id=1,
+                                   now=datetime(2024, 5, 1),
+                                   expires_at=datetime(2024, 5, 3),
+                                   max_active_loans=5) is None
+    sql, = db.statements
+    assert "JOIN users ON users.id = holds.user_id" in sql
+    assert "users.active_loans < %(active_loans_1)s" in sql
+    assert sql.endswith("LIMIT %(param_1)s FOR UPDATE OF holds SKIP LOCKED")
+
+def test_bulk_insert_returns_ids():
+    db = CompilingSession()
+    crud.bulk_create_books(db,
+                           [{"title": "Title", "author": "Author", "total_copies": 1, "available_copies": 1}])
+    crud.bulk_create_users(db,
+                           [{"name": "Reader", "email": "reader@example.com"}],
+                           created_at=datetime(2024, 5, 1))
+    books, users = db.statements
+    assert books.startswith("INSERT INTO books (title, author, total_copies, available_copies, version)")
+    assert books.endswith("RETURNING books.id")
+    assert users.startswith("INSERT INTO users (name, email, created_at, active_loans")
+    assert users.endswith("ON CONFLICT (email) DO NOTHING RETURNING users.email, users.id")
+
+def test_sessions_read_timestamps_as_utc():
+    executed = []
+
+    class Connection:
+        def cursor(self):
+            return self
+
+        def execute(self, sql):
+            executed.append(sql)
+
+        def close(self):
+            pass
+
+        def commit(self):
+            executed.append("COMMIT")
+
+    # the listener is the same on any engine; this one never connects
+    engine = create_engine("sqlite://")
+    use_utc_sessions(engine)
+    set_time_zone, = [listener for listener in engine.pool.dispatch.connect
+                      if listener.__name__ == "set_time_zone"]
+    set_time_zone(Connection(),
+                  None)
+    assert executed == ["SET TIME ZONE 'UTC'", "COMMIT"]
+
+def test_stats_migration_groups_by_date():
+    conn = CompilingSession()
+    migrations.roll_up_stats(conn)
+    assert "SELECT CAST(loan_date AS DATE) AS day, book_id, 1 AS loans" in conn.statements[2]
+    assert "CASE WHEN CAST(return_date AS DATE) > CAST(due_date AS DATE) THEN 1 ELSE 0 END" in conn.statements[2]
+    assert conn.statements[3].endswith("FROM daily_book_stats WHERE day <= %(through)s GROUP BY day")
@@ -0,0 +1,77 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, insert, select
+from sqlalchemy.orm import sessionmaker
+
+from api import crud, models
+from api.database import build_engine
+from api.migrations import upgrade
+
+def day_totals(sessions, day) -> tuple[int, int, int, int]:
+    with sessions() as db:
+        rows = crud.get_daily_stats(db,
+                                    day,
+                                    day)
+    return tuple(sum(getattr(row, name) for row in rows) for name in crud.STATS_COUNTS)
+
+def test_day_totals_are_the_same_before_and_after_the_rollup(sessions, make_book):
+    first, second = make_book(), make_book()
+    with sessions() as db:
+        # the upgrade set the mark; the day after it is summed from the per-book rows
+        day = crud.stats_rolled_through(db) + timedelta(days=1)
+    before = day_totals(sessions, day)
+
+    with sessions() as db:
+        crud.begin_write(db)
+        crud.record_loan_event(db,
+                               first.id,
+                               day,
+                               loans=2)
+        crud.record_loan_event(db,
+                               second.id,
+                               day,
+                               loans=1,
+                               returns=1,
+                               late_returns=1,
+                               fines=50)
+        crud.record_loan_event(db,
+                               first.id,
+                               day,
+                               returns=1)
+        db.commit()
+    expected = tuple(total + added for total, added in zip(before, (3, 2, 1, 50)))
+    assert day_totals(sessions, day) == expected
+
+    with sessions() as db:
+        crud.begin_write(db)
+        assert crud.roll_up_daily_stats(db,
+                                        day,
+                                        datetime.now()) == 1
+        db.commit()
+    with sessions() as db:
+        assert crud.stats_rolled_through(db) == day
+    assert day_totals(sessions, day) == expected
+
+def test_upgrade_rebuilds_the_rollups_from_loans(tmp_path):
+    # a database from before the rollup migration, with loans already in it
+    bind = build_engine(f"sqlite:///{tmp_path / 'library.db'}")
+    upgrade(bind,
+            target=3)
+    old_day = (datetime.now() - timedelta(days=10)).replace(hour=12)
+    with bind.begin() as conn:
+        conn.execute(insert(models.User).values(id=1, name="Reader", email="reader@example.com"))
+        conn.execute(insert(models.Book).values(id=1, title="Book", author="Author", total_copies=2, available_copies=1))
+        conn.execute(insert(models.Loan),
+                     [{"user_id": 1, "book_id": 1, "loan_date": old_day, "due_date": old_day,
+                       "return_date": old_day + timedelta(days=1), "fine_amount": 20},
+                      {"user_id": 1, "book_id": 1, "loan_date": old_day, "due_date": old_day + timedelta(days=14),
+                       "return_date": None, "fine_amount": 0}])
+    upgrade(bind)
+
+    sessions = sessionmaker(bind=bind)
+    with sessions() as db:
+        assert crud.stats_rolled_through(db) == crud.rollup_through(datetime.now())
+        assert db.scalar(select(func.count()).select_from(models.DailyStats)) == 2
+    assert day_totals(sessions, old_day.date()) == (2, 0, 0, 0)
+    assert day_totals(sessions, old_day.date() + timedelta(days=1)) == (0, 1, 1, 20)
+    bind.dispose()